@@ -0,0 +1,153 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from db_firebase import FirebaseDatabase
+from firebase_config import configure_http_pool
+
+# Threads available for blocking Firebase calls, per worker process.
+# Roughly: requests in flight per worker that may wait on the database at once.
+DB_POOL_SIZE = int(os.environ.get("AGROTECH_DB_POOL_SIZE", 16))
+# Default per-call timeout (seconds), including time spent queued for a thread
+DB_CALL_TIMEOUT = float(os.environ.get("AGROTECH_DB_TIMEOUT", 10))
+
+# "Use the facade's timeout" (None means no timeout)
+_DEFAULT_TIMEOUT: Any = object()
+
+
+class StorageTimeout(Exception):
+    """
+    A storage call did not complete within its timeout (queued + running). A call still
+    queued is cancelled and never runs; one a thread had already started cannot be
+    stopped and keeps running (still_running), so a write may land after the timeout.
+    """
+    def __init__(self, message: str, still_running: bool = False):
+        super().__init__(message)
+        self.still_running = still_running
+
+
+class StoragePool:
+    """
+    Bounded thread pool running the synchronous Firebase SDK off the event loop.
+    Keeps queue-depth and latency counters so the pool can be sized per worker.
+    """
+    def __init__(self, size: int = DB_POOL_SIZE):
+        self.size = size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._peak_queued = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._wait_seconds = 0.0
+        self._run_seconds = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    configure_http_pool(self.size)
+                    self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="storage")
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = DB_CALL_TIMEOUT, **kwargs) -> Any:
+        """Runs fn on the pool. timeout None (or 0) waits for as long as it takes."""
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+            self._submitted += 1
+            self._peak_queued = max(self._peak_queued, self._queued)
+
+        def job():
+            started_at = time.perf_counter()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_seconds += started_at - submitted_at
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._failed += 0 if ok else 1
+                    self._run_seconds += time.perf_counter() - started_at
+
+        future = self._get_executor().submit(job)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or None)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+                # Cancelled before a thread picked it up: job() never ran to decrement
+                if future.cancelled():
+                    self._queued -= 1
+            name = getattr(fn, "__qualname__", repr(fn))
+            raise StorageTimeout(f"{name} did not complete within {timeout}s", still_running=not future.cancelled())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "pool_size": self.size,
+                "queued": self._queued,
+                "running": self._running,
+                "peak_queued": self._peak_queued,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._wait_seconds / started * 1000, 2) if started else 0.0,
+                "avg_run_ms": round(self._run_seconds / self._completed * 1000, 2) if self._completed else 0.0,
+            }
+
+
+storage_pool = StoragePool()
+
+
+def pool_stats() -> Dict[str, Any]:
+    return storage_pool.stats()
+
+
+class AsyncStorage:
+    """
+    Awaitable facade over a synchronous storage object for the async routers.
+    Every method of the wrapped object is available as a coroutine that runs on the
+    shared storage pool, e.g. `await db_fields.query("farmerID", 1)`; each call accepts
+    an optional timeout= (seconds) overriding the facade default, None (or 0) for none.
+    A write that times out after it started still completes (see StorageTimeout).
+    """
+    def __init__(self, target: Any, timeout: float = DB_CALL_TIMEOUT):
+        self.target = target
+        self.timeout = timeout
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.target, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def call(*args, timeout: Optional[float] = _DEFAULT_TIMEOUT, **kwargs):
+            if timeout is _DEFAULT_TIMEOUT:
+                timeout = self.timeout
+            return await storage_pool.run(attr, *args, timeout=timeout, **kwargs)
+
+        return call
+
+
+class AsyncFirebaseDatabase(AsyncStorage):
+    """AsyncStorage over a FirebaseDatabase collection; kwargs go to FirebaseDatabase."""
+    def __init__(self, collection: str, timeout: float = DB_CALL_TIMEOUT, **kwargs):
+        super().__init__(FirebaseDatabase(collection, **kwargs), timeout)
+        self.db = self.target
+        self.collection = collection
@@ -0,0 +1,212 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from firebase_config import get_db_reference
+from db_firebase import INDEX_ROOT, SUMMARY_ROOT
+from iot_store import IOT_ROOT
+
+# Backup and restore of the whole database as one gzipped NDJSON file per top-level
+# node plus a manifest. Keys are listed with shallow reads and records fetched in
+# key-range chunks on a thread pool; only the chunks in flight are held in memory,
+# whatever the size of a collection. Each line is {"p": path under the node, "v": value}.
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_FORMAT = 1
+# Keys per range read, and records per multi-path update on restore
+BACKUP_CHUNK = 1000
+BACKUP_WORKERS = 8
+# Levels below these nodes that are listed before records start; a single child there
+# (an index of a collection, a field's readings) can be as large as a collection
+SPLIT_DEPTH = {INDEX_ROOT: 2, SUMMARY_ROOT: 1, IOT_ROOT: 2}
+
+
+def _key_order(key: str) -> Tuple[int, int, str]:
+    # The database's key order: integer-like keys numerically, then the rest as strings
+    if key.isdigit() and len(key) < 19:
+        return (0, int(key), "")
+    return (1, 0, key)
+
+
+def _in_order(tasks: Iterable[Callable[[], Any]], workers: int) -> Iterator[Any]:
+    """Runs tasks on a pool and yields their results in order, with at most `workers` in flight."""
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="backup") as pool:
+        pending: Deque[Future] = deque()
+        for task in tasks:
+            pending.append(pool.submit(task))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _join(*parts: str) -> str:
+    return "/".join(p for p in parts if p)
+
+
+# --- Backup ---
+
+def _units(root: str, path: str, depth: int) -> Iterator[Tuple[str, Any]]:
+    """
+    (path under root, shallow listing) of the nodes `depth` levels below root/path whose
+    children are the records. A listing that is not a dict is a leaf value.
+    """
+    listing = get_db_reference(_join(root, path)).get(shallow=True)
+    if depth == 0 or not isinstance(listing, dict):
+        yield path, listing
+        return
+    for key in sorted(listing, key=_key_order):
+        if listing[key] is True:
+            yield from _units(root, _join(path, key), depth - 1)
+        else:
+            yield _join(path, key), listing[key]
+
+
+def _fetch(root: str, unit: str, keys: List[str]) -> List[Tuple[str, Any]]:
+    """Records of one key range of root/unit, as (path under root, value), in key order."""
+    ref = get_db_reference(_join(root, unit))
+    found = ref.order_by_key().start_at(keys[0]).end_at(keys[-1]).get() or {}
+    rows = []
+    for key in keys:
+        if key in found:
+            value = found[key]
+        else:
+            # Not in the range answer (key order mismatch, or changed meanwhile): read it directly
+            value = ref.child(key).get()
+        if value is not None:
+            rows.append((_join(unit, key), value))
+    return rows
+
+
+def _range_tasks(root: str, chunk: int) -> Iterator[Callable[[], List[Tuple[str, Any]]]]:
+    for unit, listing in _units(root, "", SPLIT_DEPTH.get(root, 0)):
+        if not isinstance(listing, dict):
+            if listing is not None:
+                yield (lambda unit=unit, listing=listing: [(unit, listing)])
+            continue
+        keys = sorted(listing, key=_key_order)
+        del listing
+        for start in range(0, len(keys), chunk):
+            yield (lambda unit=unit, part=keys[start:start + chunk]: _fetch(root, unit, part))
+
+
+def backup_node(root: str, out_dir: str, workers: int = BACKUP_WORKERS, chunk: int = BACKUP_CHUNK) -> Dict[str, Any]:
+    """Writes root (a top-level node) to <out_dir>/<root>.ndjson.gz; returns its manifest entry."""
+    name = f"{root}.ndjson.gz"
+    path = os.path.join(out_dir, name)
+    records = 0
+    with gzip.open(path + ".part", "wt", encoding="utf-8") as f:
+        for rows in _in_order(_range_tasks(root, chunk), workers):
+            for p, value in rows:
+                f.write(json.dumps({"p": p, "v": value}, separators=(",", ":")) + "\n")
+            records += len(rows)
+    os.replace(path + ".part", path)
+    return {"file": name, "records": records, "bytes": os.path.getsize(path), "sha256": _sha256(path)}
+
+
+def backup(out_dir: str, collections: Optional[List[str]] = None,
+           workers: int = BACKUP_WORKERS, chunk: int = BACKUP_CHUNK) -> Dict[str, Any]:
+    """
+    Backs up the given top-level nodes (default: all, derived ones included) into out_dir
+    and writes the manifest last, so a directory without one is an unfinished backup.
+    Each record is read atomically; records written while the backup runs may or may not
+    be in it, so run it while writes are quiet for a point-in-time copy.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    roots = collections or sorted(get_db_reference("/").get(shallow=True) or {})
+    manifest = {"format": MANIFEST_FORMAT, "started_at": datetime.now(timezone.utc).isoformat(), "collections": {}}
+    for root in roots:
+        began = time.perf_counter()
+        entry = backup_node(root, out_dir, workers, chunk)
+        manifest["collections"][root] = entry
+        elapsed = time.perf_counter() - began
+        print(f"✅ {root}: {entry['records']:,} records, {entry['bytes'] / 1e6:.1f} MB compressed in {elapsed:.2f}s")
+    manifest["finished_at"] = datetime.now(timezone.utc).isoformat()
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+# --- Restore ---
+
+def _chunks(path: str, chunk: int) -> Iterator[Dict[str, Any]]:
+    """Multi-path updates of at most `chunk` records, read lazily from a backup file."""
+    updates: Dict[str, Any] = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                updates[row["p"]] = row["v"]
+                if len(updates) >= chunk:
+                    yield updates
+                    updates = {}
+    if updates:
+        yield updates
+
+
+def restore_node(root: str, path: str, merge: bool = False,
+                 workers: int = BACKUP_WORKERS, chunk: int = BACKUP_CHUNK) -> int:
+    """Writes the records of a backup file under root; returns how many were written."""
+    ref = get_db_reference(root)
+    if not merge:
+        ref.delete()
+
+    def write(updates: Dict[str, Any]) -> int:
+        if "" in updates:
+            # The node itself was a plain value
+            ref.set(updates.pop(""))
+            return 1 + write(updates) if updates else 1
+        ref.update(updates)
+        return len(updates)
+
+    tasks = ((lambda updates=updates: write(updates)) for updates in _chunks(path, chunk))
+    return sum(_in_order(tasks, workers))
+
+
+def restore(in_dir: str, collections: Optional[List[str]] = None, merge: bool = False,
+            workers: int = BACKUP_WORKERS, chunk: int = BACKUP_CHUNK) -> bool:
+    """
+    Restores the given nodes (default: all in the manifest) from a backup directory,
+    replacing what is there unless merge. A node whose file fails its checksum is
+    left untouched. Returns False if any node was skipped or came back incomplete.
+    """
+    with open(os.path.join(in_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != MANIFEST_FORMAT:
+        raise ValueError(f"Unsupported backup format {manifest.get('format')}")
+
+    ok = True
+    for root in collections or sorted(manifest["collections"]):
+        entry = manifest["collections"].get(root)
+        if entry is None:
+            print(f"⚠️  {root} is not in this backup.")
+            ok = False
+            continue
+        path = os.path.join(in_dir, entry["file"])
+        if not os.path.exists(path) or _sha256(path) != entry["sha256"]:
+            print(f"❌ {root}: {entry['file']} is missing or fails its checksum; not restored.")
+            ok = False
+            continue
+        began = time.perf_counter()
+        written = restore_node(root, path, merge, workers, chunk)
+        elapsed = time.perf_counter() - began
+        if written != entry["records"]:
+            print(f"❌ {root}: wrote {written:,} records, the manifest lists {entry['records']:,}.")
+            ok = False
+            continue
+        print(f"✅ {root}: {written:,} records restored in {elapsed:.2f}s")
+    return ok
@@ -0,0 +1,194 @@
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+
+# Avatars and documents are stored once on local disk, addressed by the sha256 of
+# their bytes; records only keep the blob's path on the API. Same bytes -> same file
+# and path, so blobs are immutable and can be cached by clients forever.
+BLOB_DIR = os.environ.get("AGROTECH_BLOB_DIR", os.path.join(os.path.dirname(__file__), "blobs"))
+# What records store: host-independent, so it survives a move to another host or port
+BLOB_PATH = "/api/v1/blobs"
+# What responses carry, resolved per response: absolute so the frontends (served from
+# another origin) can use it directly as <img src>
+BLOB_BASE_URL = os.environ.get("AGROTECH_BLOB_BASE_URL", "http://127.0.0.1:8000/api/v1/blobs").rstrip("/")
+
+# Content types served inline; anything else (HTML, SVG, scripts) would run on the API
+# origin, so it is stored without a type and served as an attachment
+SAFE_CONTENT_TYPES = frozenset({
+    "image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/avif",
+    "application/pdf",
+})
+FALLBACK_CONTENT_TYPE = "application/octet-stream"
+
+# Largest blob accepted through the generic upload and from data URIs in records
+MAX_BLOB_BYTES = 5 * 1024 * 1024
+
+# Record keys that hold files, per collection (migrate-blobs moves old data URIs out of these)
+BLOB_FIELDS: Dict[str, List[str]] = {
+    "farmers": ["farmerProfilePicture"],
+    "experts": ["expertProfilePicture", "expertDigitalCertificate"],
+}
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_DATA_URI_RE = re.compile(r"^data:([\w.+-]+/[\w.+-]+)?(;[^,]*)?,", re.IGNORECASE)
+# Absolute blob URLs, as records stored them before they kept only the path
+_ABSOLUTE_URL_RE = re.compile(r"^https?://[^/?#]+" + re.escape(BLOB_PATH) + r"/([0-9a-f]{64})$")
+
+
+def safe_content_type(content_type: Optional[str]) -> Optional[str]:
+    """The bare media type if it is on the inline whitelist, else None."""
+    media_type = (content_type or "").split(";", 1)[0].strip().lower()
+    return media_type if media_type in SAFE_CONTENT_TYPES else None
+
+
+class BlobTooLarge(ValueError):
+    """The blob exceeds the size limit (raised as soon as the limit is crossed)."""
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File too large. Max {max_bytes // (1024 * 1024)}MB.")
+
+
+class BlobWriter:
+    """
+    Incremental write into the store: bytes go to a temp file and into the hash as
+    they arrive, and commit() moves the file to its content address.
+    """
+    def __init__(self, store: "LocalBlobStore", max_bytes: int):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        os.makedirs(store.root, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=store.root, prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.abort()
+            raise BlobTooLarge(self.max_bytes)
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self, content_type: Optional[str] = None) -> str:
+        """Stores the blob and returns its digest. Only a whitelisted content type is kept."""
+        self._file.close()
+        digest = self._hash.hexdigest()
+        path = self.store.path_of(digest)
+        if os.path.exists(path):
+            # Already stored: identical bytes
+            os.remove(self._tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._tmp_path, path)
+        type_path = path + ".type"
+        content_type = safe_content_type(content_type)
+        if content_type and not os.path.exists(type_path):
+            with open(type_path, "w") as f:
+                f.write(content_type)
+        return digest
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class LocalBlobStore:
+    """Content-addressed blobs under root/<aa>/<bb>/<sha256>, with the content type beside each."""
+    def __init__(self, root: str = BLOB_DIR, base_url: str = BLOB_BASE_URL):
+        self.root = root
+        self.base_url = base_url
+
+    def path_of(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def writer(self, max_bytes: int = MAX_BLOB_BYTES) -> BlobWriter:
+        return BlobWriter(self, max_bytes)
+
+    def put(self, data: bytes, content_type: Optional[str] = None, max_bytes: int = MAX_BLOB_BYTES) -> str:
+        w = self.writer(max_bytes)
+        w.write(data)
+        return w.commit(content_type)
+
+    def open(self, digest: str) -> Optional[Tuple[str, str]]:
+        """(file path, content type) of a stored blob, or None. The type is always a safe one."""
+        if not _DIGEST_RE.match(digest or ""):
+            return None
+        path = self.path_of(digest)
+        if not os.path.exists(path):
+            return None
+        content_type = None
+        if os.path.exists(path + ".type"):
+            with open(path + ".type") as f:
+                # Re-checked: sidecars written before the whitelist may hold anything
+                content_type = safe_content_type(f.read())
+        return path, content_type or FALLBACK_CONTENT_TYPE
+
+    def url_of(self, digest: str) -> str:
+        """What a record stores for a blob: its path on the API."""
+        return f"{BLOB_PATH}/{digest}"
+
+    def public_url(self, value: Any) -> Any:
+        """The absolute URL for a stored blob path (or an old absolute blob URL); anything else unchanged."""
+        if isinstance(value, str):
+            if value.startswith(BLOB_PATH + "/"):
+                return self.base_url + value[len(BLOB_PATH):]
+            match = _ABSOLUTE_URL_RE.match(value)
+            if match:
+                return f"{self.base_url}/{match.group(1)}"
+        return value
+
+    def public_urls(self, record: Optional[Dict[str, Any]], keys: List[str]) -> Optional[Dict[str, Any]]:
+        """A copy of a record (for a response) with the blob paths under keys made absolute."""
+        if not isinstance(record, dict) or not any(key in record for key in keys):
+            return record
+        return dict(record, **{key: self.public_url(record[key]) for key in keys if key in record})
+
+    def store_data_uri(self, value: Any, max_bytes: int = MAX_BLOB_BYTES) -> Any:
+        """
+        Moves a base64 data URI into the store and returns its path. Anything else
+        (URLs, empty values) is returned unchanged.
+        """
+        if not isinstance(value, str):
+            return value
+        match = _DATA_URI_RE.match(value)
+        if not match or ";base64" not in (match.group(2) or "").lower():
+            return value
+        encoded = value[match.end():]
+        # Reject before decoding: base64 is 4 chars per 3 bytes
+        if len(encoded) * 3 // 4 > max_bytes + 2:
+            raise BlobTooLarge(max_bytes)
+        try:
+            data = base64.b64decode(encoded)
+        except (binascii.Error, ValueError):
+            return value
+        return self.url_of(self.put(data, match.group(1), max_bytes))
+
+    def externalize(self, record: Dict[str, Any], keys: List[str], max_bytes: int = MAX_BLOB_BYTES) -> Dict[str, Any]:
+        """
+        Replaces data URIs under the given keys of a record with blob paths, and absolute
+        blob URLs (as responses carry them) with their paths (in place).
+        """
+        for key in keys:
+            value = record.get(key)
+            if is_data_uri(value):
+                record[key] = self.store_data_uri(value, max_bytes)
+            elif is_absolute_blob_url(value):
+                record[key] = self.url_of(_ABSOLUTE_URL_RE.match(value).group(1))
+        return record
+
+
+def is_data_uri(value: Any) -> bool:
+    return isinstance(value, str) and value[:5].lower() == "data:"
+
+
+def is_absolute_blob_url(value: Any) -> bool:
+    return isinstance(value, str) and bool(_ABSOLUTE_URL_RE.match(value))
+
+
+blob_store = LocalBlobStore()
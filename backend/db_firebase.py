@@ -1,6 +1,12 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple, Iterator
+from collections import OrderedDict
+from datetime import datetime
 from firebase_config import get_db_reference, initialize_firebase
 import json
+import os
+import threading
+import time
+import uuid
 
 # Ensure Firebase is initialized when this module is imported
 # This might be better placed in main.py startup event, but for simplicity here:
@@ -9,14 +15,376 @@ try:
 except Exception as e:
     print(f"Failed to auto-init firebase in wrapper: {e}")
 
+# Upper bound for the in-process read cache (serialized JSON bytes, all collections together)
+CACHE_MAX_BYTES = int(os.environ.get("AGROTECH_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# _cache_generations/<collection> -> token replaced by every write through the adapter, in
+# any process. Cached readers compare it at most every CACHE_RECHECK_SECONDS and drop the
+# collection's entries when it changed, which bounds how stale another worker's cache can be.
+CACHE_GENERATION_ROOT = "_cache_generations"
+CACHE_RECHECK_SECONDS = float(os.environ.get("AGROTECH_CACHE_RECHECK", 1))
+
+# Side paths holding secondary indexes: _indexes/<collection>/<index>/<value> -> storage key
+INDEX_ROOT = "_indexes"
+INDEX_META_ROOT = "_index_meta"
+# Projected copies of records for list endpoints: _summaries/<collection>/<storage key> -> {field: value}
+SUMMARY_ROOT = "_summaries"
+# Name of the summary records' entry under _index_meta/<collection>
+SUMMARY_META_NAME = "_summary"
+# Per-collection ID counters: _counters/<collection> -> last allocated integer ID
+COUNTER_ROOT = "_counters"
+# Aggregate tables maintained on writes: _rollups/<name>/<group...>/<measure>
+ROLLUP_ROOT = "_rollups"
+# Primary key of collections whose records also carry a foreign key that the generic
+# guess below would pick first (a consultation's fieldID is not its ID). Records added
+# before these were set are stored under the foreign key; lookups that miss fall back to
+# an indexed query on the primary key (see QUERY_INDEXES), so they are still found.
+PRIMARY_KEYS = {"consultations": "id", "iot_data": "ioTDataID"}
+# How long a "this index has not been built yet" answer is trusted before re-checking
+INDEX_RECHECK_SECONDS = 60
+
+_INVALID_KEY_CHARS = str.maketrans({c: "_" for c in ".$#[]/"})
+
+# Children the routers filter/order on. The database only serves order_by_child queries
+# for children listed under ".indexOn" in the security rules; `python manage.py index-rules`
+# prints the snippet to merge into the project's rules.
+QUERY_INDEXES: Dict[str, List[str]] = {
+    "fields": ["farmerID"],
+    "iot_data": ["fieldID", "createTime", "ioTDataID"],
+    "advice_reports": ["fieldId", "sourceType"],
+    "consultations": ["expertID", "id"],
+}
+
+
+class ReadCache:
+    """
+    Process-wide LRU cache for Firebase reads, shared by every FirebaseDatabase
+    instance so a write through one router invalidates what another router cached.
+    Writes from other processes are noticed through the collection's generation token
+    (see CACHE_GENERATION_ROOT), within CACHE_RECHECK_SECONDS.
+
+    Entries are kept as serialized JSON: every hit hands back a fresh copy
+    (routers mutate the dicts they get) and the memory bound can be enforced
+    on actual byte size.
+    """
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # (collection, path) -> (expires_at, payload)
+        self._bytes = 0
+        self._generations: Dict[str, int] = {}
+        # collection -> (its generation token in the database, when it was last read)
+        self._tokens: Dict[str, Tuple[Any, float]] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _collection_stats(self, collection: str) -> Dict[str, float]:
+        stats = self._stats.get(collection)
+        if stats is None:
+            stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "fetch_seconds": 0.0}
+            self._stats[collection] = stats
+        return stats
+
+    def get_or_load(self, collection: str, path: str, ttl: float, loader: Callable[[], Any]) -> Any:
+        key = (collection, path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._collection_stats(collection)["hits"] += 1
+                    return json.loads(payload)
+                self._drop(key)
+            generation = self._generations.get(collection, 0)
+
+        start = time.perf_counter()
+        value = loader()
+        elapsed = time.perf_counter() - start
+        payload = json.dumps(value)
+
+        with self._lock:
+            stats = self._collection_stats(collection)
+            stats["misses"] += 1
+            stats["fetch_seconds"] += elapsed
+            # A write landed while we were fetching; don't cache what may be stale.
+            if self._generations.get(collection, 0) == generation and len(payload) <= self.max_bytes:
+                if key in self._entries:
+                    self._drop(key)
+                self._entries[key] = (time.monotonic() + ttl, payload)
+                self._bytes += len(payload)
+                while self._bytes > self.max_bytes:
+                    oldest = next(iter(self._entries))
+                    self._collection_stats(oldest[0])["evictions"] += 1
+                    self._drop(oldest)
+        return value
+
+    def invalidate(self, collection: str):
+        with self._lock:
+            self._invalidate_locked(collection)
+
+    def _invalidate_locked(self, collection: str):
+        self._generations[collection] = self._generations.get(collection, 0) + 1
+        for key in [k for k in self._entries if k[0] == collection]:
+            self._drop(key)
+        self._collection_stats(collection)["invalidations"] += 1
+
+    def sync(self, collection: str, dependents: List[str], load_token: Callable[[], Any]):
+        """
+        Drops the entries of collection (and of the dependents cached from it) if its
+        generation token changed since it was last read; reads it at most every
+        CACHE_RECHECK_SECONDS.
+        """
+        with self._lock:
+            seen = self._tokens.get(collection)
+            if seen is not None and time.monotonic() - seen[1] < CACHE_RECHECK_SECONDS:
+                return
+        token = load_token()
+        with self._lock:
+            seen = self._tokens.get(collection)
+            self._tokens[collection] = (token, time.monotonic())
+            if seen is not None and seen[0] != token:
+                for name in [collection] + dependents:
+                    self._invalidate_locked(name)
+
+    def wrote(self, collection: str, token: Any):
+        """Records this process's own write (already invalidated locally): not a foreign change."""
+        with self._lock:
+            self._tokens[collection] = (token, time.monotonic())
+
+    def _drop(self, key: tuple):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters per collection, with an estimate of the round-trip time saved."""
+        with self._lock:
+            collections = {}
+            for collection, s in self._stats.items():
+                avg_fetch = s["fetch_seconds"] / s["misses"] if s["misses"] else 0.0
+                lookups = s["hits"] + s["misses"]
+                collections[collection] = {
+                    "hits": s["hits"],
+                    "misses": s["misses"],
+                    "hit_ratio": round(s["hits"] / lookups, 4) if lookups else 0.0,
+                    "evictions": s["evictions"],
+                    "invalidations": s["invalidations"],
+                    "avg_fetch_ms": round(avg_fetch * 1000, 2),
+                    "est_saved_ms": round(s["hits"] * avg_fetch * 1000, 2),
+                }
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "collections": collections,
+            }
+
+
+_read_cache = ReadCache()
+
+
+def cache_stats() -> Dict[str, Any]:
+    return _read_cache.stats()
+
+
+# collection -> {index name: (field, normalizer)}; shared by every instance of the collection
+_indexes: Dict[str, Dict[str, Tuple[str, Callable[[Any], str]]]] = {}
+# collection -> fields copied into its summary records
+_summaries: Dict[str, List[str]] = {}
+# collection -> {rollup name: (group_by, {measure: value_of})}
+_rollups: Dict[str, Dict[str, Tuple[Callable[[Dict[str, Any]], Optional[Tuple[Any, ...]]],
+                                    Dict[str, Callable[[Dict[str, Any]], float]]]]] = {}
+# (collection, index name) -> (built, checked_at)
+_index_state: Dict[Tuple[str, str], Tuple[bool, float]] = {}
+# collection -> (list_shaped, checked_at)
+_layout_state: Dict[str, Tuple[bool, float]] = {}
+# (collection, child) -> checked_at, for children the backend refused to query on
+_unqueryable: Dict[Tuple[str, str], float] = {}
+# collection -> IdAllocator, so every instance in the process shares reserved blocks
+_allocators: Dict[str, "IdAllocator"] = {}
+_allocators_lock = threading.Lock()
+_root_ref = None
+
+
+def register_index(collection: str, name: str, field: str, normalize: Callable[[Any], str] = str):
+    """
+    Declares a secondary index on collection[field]. Every FirebaseDatabase instance
+    of that collection keeps it in sync on add/update/save, wherever it was created.
+    """
+    _indexes.setdefault(collection, {})[name] = (field, normalize)
+
+
+def register_summary(collection: str, fields: List[str]):
+    """
+    Declares the fields list endpoints need from collection. Every write through a
+    FirebaseDatabase keeps _summaries/<collection>/<key> in sync, and page(projected=True)
+    reads those small records instead of whole ones.
+    """
+    _summaries[collection] = list(fields)
+
+
+def register_rollup(collection: str, name: str,
+                    group_by: Callable[[Dict[str, Any]], Optional[Tuple[Any, ...]]],
+                    measures: Dict[str, Callable[[Dict[str, Any]], float]]):
+    """
+    Declares the aggregate table _rollups/<name>: for each group (the tuple group_by returns
+    for a record, None to leave it out) the sum of each measure over the collection. Every
+    write through a FirebaseDatabase adjusts the table with server-side increments in the
+    same multi-path update, so concurrent writers never overwrite each other's totals.
+    """
+    _rollups.setdefault(collection, {})[name] = (group_by, dict(measures))
+
+
+def rollup_path(name: str, group: Tuple[Any, ...]) -> str:
+    # Missing group values are counted under "unknown" rather than dropped
+    return "/".join([ROLLUP_ROOT, name] + [index_key(g) if g not in (None, "") else "unknown" for g in group])
+
+
+def get_root_ref():
+    global _root_ref
+    if _root_ref is None:
+        _root_ref = get_db_reference("/")
+    return _root_ref
+
+
+def index_key(value: Any) -> str:
+    """Makes a value usable as a Realtime DB key."""
+    return str(value).translate(_INVALID_KEY_CHARS)
+
+
+def _values(data: Any) -> List[Dict[str, Any]]:
+    # Realtime DB returns either a list (if integer keys) or dict (if string keys)
+    if isinstance(data, list):
+        return [x for x in data if x is not None]
+    elif isinstance(data, dict):
+        return list(data.values())
+    return []
+
+
+def _items(data: Any) -> List[Tuple[str, Any]]:
+    """(key, value) pairs of a collection snapshot, for either layout."""
+    if isinstance(data, list):
+        return [(str(i), x) for i, x in enumerate(data) if x is not None]
+    elif isinstance(data, dict):
+        return [(str(k), x) for k, x in data.items() if x is not None]
+    return []
+
+
+def _key_order(key: str) -> Tuple[int, Any]:
+    """Database key ordering: integer-like keys numerically first, then the rest lexicographically."""
+    if key.isdigit() and len(key) < 19:
+        return (0, int(key))
+    return (1, key)
+
+
+def _order_key(value: Any) -> Tuple[int, Any]:
+    """Sort key matching the database ordering: null < false < true < numbers < strings < objects."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, int(value))
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, 0)
+
+
+class IdAllocator:
+    """
+    Allocates unique integer IDs for a collection from the counter at _counters/<collection>.
+
+    The counter only moves forward inside a database transaction, so concurrent requests
+    (and workers) never get the same ID. IDs are reserved in blocks: with block_size > 1
+    one transaction serves that many next_id() calls, and reserve(n) takes n IDs in a
+    single round trip. IDs left over in a block when the process exits are skipped.
+    """
+    def __init__(self, db: "FirebaseDatabase", id_field: str, block_size: int = 1):
+        self.db = db
+        self.id_field = id_field
+        self.block_size = max(1, block_size)
+        self.ref = get_root_ref().child(f"{COUNTER_ROOT}/{db.collection}")
+        self._next = 0
+        self._end = 0  # exclusive
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                block = self._reserve(self.block_size)
+                self._next, self._end = block.start, block.stop
+            new_id = self._next
+            self._next += 1
+            return new_id
+
+    def reserve(self, count: int) -> range:
+        """Reserves count consecutive IDs with a single transaction."""
+        if count <= 0:
+            return range(0)
+        return self._reserve(count)
+
+    def _reserve(self, count: int) -> range:
+        seed = None
+        if self.ref.get() is None:
+            # First allocation for this collection: continue after the largest existing ID
+            seed = self._max_existing_id()
+
+        def bump(current):
+            if current is None:
+                current = seed if seed is not None else self._max_existing_id()
+            return int(current) + count
+
+        end = self.ref.transaction(bump)
+        return range(end - count + 1, end + 1)
+
+    def _max_existing_id(self) -> int:
+        ids = [int(i.get(self.id_field)) for i in self.db.get_all()
+               if isinstance(i, dict) and str(i.get(self.id_field, "")).isdigit()]
+        return max(ids) if ids else 0
+
+
 class FirebaseDatabase:
     """
     Adapter class to make Firebase Realtime DB look like the previous JSONDatabase.
     This minimizes changes needed in the routers.
+
+    Pass cache_ttl (seconds) to opt in to the shared read cache for this collection.
+    Writes made through any instance invalidate the cached reads of the collection;
+    writes made in other processes do within CACHE_RECHECK_SECONDS (ttl is only the
+    upper bound for writes that bypass the adapter).
     """
-    def __init__(self, collection: str):
+    def __init__(self, collection: str, cache_ttl: Optional[float] = None, id_block_size: int = 1):
         self.collection = collection
         self.ref = get_db_reference(collection)
+        self.cache_ttl = cache_ttl
+        self.id_block_size = id_block_size
+        self._summary_db: Optional["FirebaseDatabase"] = None
+        # Collection whose writes change what this instance reads (differs for summary views)
+        self._source = collection
+
+    def _read(self, path: str = "", ref=None) -> Any:
+        """
+        Reads the collection (or a child path of it), going through the cache if enabled.
+        Side paths that belong to the collection (indexes) pass their own ref and a cache path.
+        """
+        if ref is None:
+            ref = self.ref.child(path) if path else self.ref
+        if not self.cache_ttl:
+            return ref.get()
+        _read_cache.sync(self._source, [f"{SUMMARY_ROOT}/{self._source}"],
+                         get_root_ref().child(f"{CACHE_GENERATION_ROOT}/{self._source}").get)
+        return _read_cache.get_or_load(self.collection, path, self.cache_ttl, ref.get)
+
+    def _invalidate(self):
+        # Unconditional: another instance of the same collection may have caching enabled,
+        # here or in another process (which sees the new generation token)
+        _read_cache.invalidate(self.collection)
+        if self._summary_fields():
+            _read_cache.invalidate(f"{SUMMARY_ROOT}/{self.collection}")
+        token = uuid.uuid4().hex
+        get_root_ref().child(f"{CACHE_GENERATION_ROOT}/{self.collection}").set(token)
+        _read_cache.wrote(self.collection, token)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return _read_cache.stats()["collections"].get(self.collection, {})
 
     def get_all(self) -> List[Dict[str, Any]]:
         """
@@ -24,21 +392,326 @@ class FirebaseDatabase:
         Returns a list of values (ignoring the keys/IDs for now, 
         or ensuring the ID is part of the value).
         """
-        data = self.ref.get()
-        if not data:
-            return []
-        
-        # Realtime DB returns either a list (if integer keys) or dict (if string keys)
-        if isinstance(data, list):
-            return [x for x in data if x is not None]
-        elif isinstance(data, dict):
-            return list(data.values())
-        return []
+        return _values(self._read())
 
     def load(self) -> List[Dict[str, Any]]:
         """Alias for get_all to match JSONDatabase interface."""
         return self.get_all()
 
+    def query(self, where: Optional[str] = None, equals: Any = None, order_by: Optional[str] = None,
+              limit_to_first: Optional[int] = None, limit_to_last: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Returns records with record[where] == equals (type-strict, like the database),
+        ordered by the order_by child ("$key" for key order), optionally limited.
+
+        Filtering, ordering and limits run on the database when the children are indexed
+        (see QUERY_INDEXES), so only matching records are transferred. The database
+        supports a single ordering per query: with both a filter and a different order_by,
+        the filtered rows are sorted and limited here. Backends or paths that can't serve
+        the query fall back to doing all of it in-process over get_all().
+        """
+        server_order = where or order_by
+        server_limits = order_by is None or order_by == server_order
+
+        if server_order and self._queryable(server_order):
+            cache_path = "?" + json.dumps([where, equals, server_order, limit_to_first, limit_to_last], default=str)
+            try:
+                q = self.ref.order_by_key() if server_order == "$key" else self.ref.order_by_child(server_order)
+                if where:
+                    q = q.equal_to(equals)
+                if server_limits and limit_to_first:
+                    q = q.limit_to_first(limit_to_first)
+                if server_limits and limit_to_last:
+                    q = q.limit_to_last(limit_to_last)
+                rows = _values(self._read(cache_path, q))
+            except Exception as e:
+                # Typically "Index not defined" for a child missing from .indexOn
+                print(f"WARNING: {self.collection} query on '{server_order}' not served by the database ({e}); filtering in-process")
+                _unqueryable[(self.collection, server_order)] = time.monotonic()
+            else:
+                if server_limits:
+                    return rows
+                return self._order_and_limit(rows, order_by, limit_to_first, limit_to_last)
+
+        items = _items(self._read())
+        if order_by == "$key":
+            items.sort(key=lambda kv: _key_order(kv[0]))
+        rows = [v for _, v in items]
+        if where:
+            rows = [r for r in rows if isinstance(r, dict) and r.get(where) == equals]
+        return self._order_and_limit(rows, order_by, limit_to_first, limit_to_last)
+
+    def page(self, limit: int, after: Optional[str] = None,
+             filters: Optional[List[Tuple[str, Any]]] = None,
+             projected: bool = False) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of records in key order, starting after the storage key `after`.
+        Returns (records, key to pass as `after` for the next page, or None on the last page).
+        projected=True returns only the collection's summary fields (see register_summary),
+        read from the summary records once they have been built.
+
+        Unfiltered pages are one key-range query (start_at + limit_to_first), so page N
+        never reads the pages before it. With filters, (child, value) pairs of which any may
+        match, the database returns the matching records and the page is cut from them by
+        key; that read goes through the cache, so walking the pages costs one filtered read.
+        """
+        if projected and self._summary_fields():
+            if self._index_built(SUMMARY_META_NAME):
+                return self._summary_view().page(limit, after, filters)
+            rows, next_key = self.page(limit, after, filters)
+            return [self._project(r) for r in rows], next_key
+
+        if filters:
+            matches: Dict[str, Any] = {}
+            for child, value in filters:
+                matches.update(self._filtered_items(child, value))
+            keys = sorted(matches, key=_key_order)
+            if after is not None:
+                after_order = _key_order(after)
+                keys = [k for k in keys if _key_order(k) > after_order]
+            page_keys = keys[:limit]
+            next_key = page_keys[-1] if len(keys) > limit else None
+            return [matches[k] for k in page_keys], next_key
+
+        # start_at is inclusive: one extra row for `after` itself, one to detect a next page
+        items = self._key_range(after, limit + (2 if after is not None else 1))
+        if after is not None:
+            items = [(k, v) for k, v in items if k != after]
+        page_items = items[:limit]
+        next_key = page_items[-1][0] if len(items) > limit else None
+        return [v for _, v in page_items], next_key
+
+    def scan(self, chunk_size: int = 1000, projected: bool = False) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Every record in key order, in chunks of up to chunk_size. Each chunk is one key-range
+        read that bypasses the read cache, so exports hold a single chunk in memory and don't
+        evict the entries the API is serving. projected=True works as in page().
+        """
+        if projected and self._summary_fields():
+            if self._index_built(SUMMARY_META_NAME):
+                yield from self._summary_view().scan(chunk_size)
+            else:
+                for chunk in self.scan(chunk_size):
+                    yield [self._project(r) for r in chunk]
+            return
+        after = None
+        while True:
+            q = self.ref.order_by_key()
+            if after is not None:
+                q = q.start_at(after)
+            items = sorted(_items(q.limit_to_first(chunk_size + (1 if after is not None else 0)).get()),
+                           key=lambda kv: _key_order(kv[0]))
+            if after is not None:
+                items = [kv for kv in items if kv[0] != after]
+            if not items:
+                return
+            yield [v for _, v in items]
+            if len(items) < chunk_size:
+                return
+            after = items[-1][0]
+
+    def _key_range(self, after: Optional[str], count: int) -> List[Tuple[str, Any]]:
+        if self._queryable("$key"):
+            cache_path = "?" + json.dumps(["$key", after, count])
+            try:
+                q = self.ref.order_by_key()
+                if after is not None:
+                    q = q.start_at(after)
+                items = _items(self._read(cache_path, q.limit_to_first(count)))
+                return sorted(items, key=lambda kv: _key_order(kv[0]))
+            except Exception as e:
+                print(f"WARNING: {self.collection} key-range query not served by the database ({e}); paging in-process")
+                _unqueryable[(self.collection, "$key")] = time.monotonic()
+
+        items = sorted(_items(self._read()), key=lambda kv: _key_order(kv[0]))
+        if after is not None:
+            after_order = _key_order(after)
+            items = [kv for kv in items if _key_order(kv[0]) >= after_order]
+        return items[:count]
+
+    def _filtered_items(self, child: str, value: Any, fresh: bool = False) -> Dict[str, Any]:
+        """{storage key: record} for records with record[child] == value. fresh=True bypasses the cache."""
+        if self._queryable(child):
+            cache_path = "?" + json.dumps([child, value, child, None, None], default=str)
+            q = self.ref.order_by_child(child).equal_to(value)
+            try:
+                return dict(_items(q.get() if fresh else self._read(cache_path, q)))
+            except Exception as e:
+                print(f"WARNING: {self.collection} query on '{child}' not served by the database ({e}); filtering in-process")
+                _unqueryable[(self.collection, child)] = time.monotonic()
+        data = self.ref.get() if fresh else self._read()
+        return {k: v for k, v in _items(data) if isinstance(v, dict) and v.get(child) == value}
+
+    def _queryable(self, child: str) -> bool:
+        failed_at = _unqueryable.get((self.collection, child))
+        return failed_at is None or time.monotonic() - failed_at > INDEX_RECHECK_SECONDS
+
+    def _order_and_limit(self, rows: List[Dict[str, Any]], order_by: Optional[str],
+                         limit_to_first: Optional[int], limit_to_last: Optional[int]) -> List[Dict[str, Any]]:
+        if order_by and order_by != "$key":
+            rows = sorted(rows, key=lambda r: _order_key(r.get(order_by) if isinstance(r, dict) else None))
+        if limit_to_first:
+            rows = rows[:limit_to_first]
+        if limit_to_last:
+            rows = rows[-limit_to_last:]
+        return rows
+
+    def next_id(self, id_field: str) -> int:
+        """Allocates a new unique integer ID for this collection (replaces len(load()) + 1)."""
+        return self._allocator(id_field).next_id()
+
+    def reserve_ids(self, id_field: str, count: int) -> range:
+        """Allocates count consecutive IDs in one round trip, for bulk writers."""
+        return self._allocator(id_field).reserve(count)
+
+    def _allocator(self, id_field: str) -> IdAllocator:
+        with _allocators_lock:
+            allocator = _allocators.get(self.collection)
+            if allocator is None:
+                allocator = IdAllocator(self, id_field, self.id_block_size)
+                _allocators[self.collection] = allocator
+            return allocator
+
+    def get_by_id(self, value: Any, key_field: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Fetches one record by its ID with a single child read, instead of loading the collection.
+        add() stores records under their primary key, so the ID is the child key.
+        Collections migrated as JSON arrays are keyed by position instead; for those
+        the child is checked against the ID and we fall back to a scan on mismatch.
+        key_field names the ID field (e.g. "farmerID"); defaults to the record's primary key.
+        """
+        found = self._locate(value, key_field)
+        return found[1] if found else None
+
+    def _locate(self, value: Any, key_field: Optional[str] = None, fresh: bool = False) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(storage key, record) for the record with this ID, or None. fresh=True bypasses the cache."""
+        if value is None or str(value) == "":
+            return None
+
+        storage_key = index_key(value)
+        item = self.ref.child(storage_key).get() if fresh else self._read(storage_key)
+        if isinstance(item, dict) and self._id_matches(item, key_field, value):
+            return storage_key, item
+        if not self._is_list_shaped():
+            if self.collection in PRIMARY_KEYS:
+                # Possibly added before its primary key was set, under another key
+                return self._locate_by_child(key_field or PRIMARY_KEYS[self.collection], value, fresh)
+            if item is None:
+                return None
+        data = self.ref.get() if fresh else self._read()
+        return next(((k, i) for k, i in _items(data) if isinstance(i, dict) and self._id_matches(i, key_field, value)), None)
+
+    def _locate_by_child(self, field: str, value: Any, fresh: bool = False) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(storage key, record) of the record with record[field] == value (as an int or a string)."""
+        candidates = [value]
+        if isinstance(value, str) and value.isdigit():
+            candidates.append(int(value))
+        elif not isinstance(value, str):
+            candidates.append(str(value))
+        for candidate in candidates:
+            items = self._filtered_items(field, candidate, fresh)
+            if items:
+                return next(iter(items.items()))
+        return None
+
+    def patch(self, value: Any, changes: Dict[str, Any], key_field: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Updates only the given fields of the record with this ID (a None value removes
+        the field), as one multi-path update that also moves affected index entries.
+        Returns the updated record, or None if no record has this ID.
+        """
+        found = self._locate(value, key_field, fresh=True)
+        if not found:
+            return None
+        storage_key, item = found
+
+        merged = dict(item)
+        for field, new_value in changes.items():
+            if new_value is None:
+                merged.pop(field, None)
+            else:
+                merged[field] = new_value
+        if not changes:
+            return merged
+
+        updates = {f"{self.collection}/{storage_key}/{field}": v for field, v in changes.items()}
+        updates.update(self._side_updates(storage_key, item, merged))
+        get_root_ref().update(updates)
+        self._invalidate()
+        return merged
+
+    def patch_many(self, changes_by_id: Dict[Any, Dict[str, Any]], key_field: Optional[str] = None) -> int:
+        """
+        patch() for many records at once: one child read per record (a single collection
+        read covers any not stored under their ID) and one multi-path update for all of them.
+        Returns how many records were found and patched.
+        """
+        located: Dict[Any, Tuple[str, Dict[str, Any]]] = {}
+        missing = []
+        for value in changes_by_id:
+            item = self.ref.child(index_key(value)).get()
+            if isinstance(item, dict) and self._id_matches(item, key_field, value):
+                located[value] = (index_key(value), item)
+            else:
+                missing.append(value)
+        if missing and self._is_list_shaped():
+            items = [(k, i) for k, i in _items(self.ref.get()) if isinstance(i, dict)]
+            for value in missing:
+                found = next(((k, i) for k, i in items if self._id_matches(i, key_field, value)), None)
+                if found:
+                    located[value] = found
+        elif missing and self.collection in PRIMARY_KEYS:
+            for value in missing:
+                found = self._locate_by_child(key_field or PRIMARY_KEYS[self.collection], value, fresh=True)
+                if found:
+                    located[value] = found
+
+        updates = {}
+        moved = []
+        for value, (storage_key, item) in located.items():
+            changes = changes_by_id[value]
+            merged = {k: v for k, v in item.items() if k not in changes}
+            merged.update({k: v for k, v in changes.items() if v is not None})
+            updates.update({f"{self.collection}/{storage_key}/{field}": v for field, v in changes.items()})
+            updates.update(self._side_updates(storage_key, item, merged, rollups=False))
+            moved.append((item, merged))
+        # One increment per rollup path, however many of the records share it
+        updates.update(self._rollup_updates(moved))
+        if updates:
+            get_root_ref().update(updates)
+            self._invalidate()
+        return len(located)
+
+    def delete_by_id(self, value: Any, key_field: Optional[str] = None) -> bool:
+        """Removes the record with this ID (and its index entries). Returns False if not found."""
+        found = self._locate(value, key_field, fresh=True)
+        if not found:
+            return False
+        storage_key, item = found
+
+        index_updates = self._side_updates(storage_key, item, {})
+        if index_updates:
+            index_updates[f"{self.collection}/{storage_key}"] = None
+            get_root_ref().update(index_updates)
+        else:
+            self.ref.child(storage_key).delete()
+        self._invalidate()
+        return True
+
+    def _id_matches(self, item: Dict[str, Any], key_field: Optional[str], value: Any) -> bool:
+        # Compare as strings to handle "1" vs 1 mismatch loosely
+        found = item.get(key_field) if key_field else self._find_primary_key(item)
+        return str(found) == str(value)
+
+    def _is_list_shaped(self) -> bool:
+        """True if the collection still uses array indices as keys (legacy JSON upload)."""
+        state = _layout_state.get(self.collection)
+        if state and time.monotonic() - state[1] < INDEX_RECHECK_SECONDS:
+            return state[0]
+        list_shaped = self.ref.child("0").get(shallow=True) is not None
+        _layout_state[self.collection] = (list_shaped, time.monotonic())
+        return list_shaped
+
     def add(self, item: Dict[str, Any]):
         """
         Adds a new item.
@@ -58,9 +731,19 @@ class FirebaseDatabase:
         # Let's use the item's ID as the key if it exists, to prevent duplicates easily.
         pk = self._find_primary_key(item)
         if pk:
-            self.ref.child(str(pk)).set(item)
+            if self._indexes() or self._summary_fields() or self._rollups():
+                # Record, index entries and summary land together in one atomic multi-path update
+                updates = {f"{self.collection}/{pk}": item}
+                updates.update(self._side_updates(str(pk), None, item))
+                get_root_ref().update(updates)
+            else:
+                self.ref.child(str(pk)).set(item)
         else:
-            self.ref.push(item)
+            ref = self.ref.push(item)
+            updates = self._side_updates(ref.key, None, item)
+            if updates:
+                get_root_ref().update(updates)
+        self._invalidate()
 
     def save(self, data: List[Dict[str, Any]]):
         """
@@ -73,12 +756,21 @@ class FirebaseDatabase:
         # But generally objects are better.
         # For backward compatibility with the 'save' call which dumps a list:
         self.ref.set(data)
+        self._invalidate()
+        _layout_state.pop(self.collection, None)
+        for name in self._indexes():
+            self.rebuild_index(name, data)
+        if self._summary_fields():
+            self.rebuild_summaries(data)
+        if self._rollups():
+            self.rebuild_rollups(data)
 
     def update(self, key: str, value: Any, new_data: Dict[str, Any]):
         """
         Updates an item where item[key] == value.
         Uses manual iteration for safety against type mismatches and Index structures.
         """
+        # Always read fresh here: we are about to write, a cached copy could point at a stale key.
         data = self.ref.get()
         if not data:
             return False
@@ -100,12 +792,211 @@ class FirebaseDatabase:
                     break
         
         if target_k:
-            self.ref.child(target_k).set(new_data)
+            old_item = data[int(target_k)] if isinstance(data, list) else data[target_k]
+            index_updates = self._side_updates(target_k, old_item, new_data)
+            if index_updates:
+                index_updates[f"{self.collection}/{target_k}"] = new_data
+                get_root_ref().update(index_updates)
+            else:
+                self.ref.child(target_k).set(new_data)
+            self._invalidate()
             return True
             
         return False
+
+    # --- Secondary indexes ---
+
+    def _indexes(self) -> Dict[str, Tuple[str, Callable[[Any], str]]]:
+        return _indexes.get(self.collection, {})
+
+    def _index_path(self, name: str, norm: str = "") -> str:
+        path = f"{INDEX_ROOT}/{self.collection}/{name}"
+        return f"{path}/{index_key(norm)}" if norm else path
+
+    def _side_updates(self, storage_key: str, old_item: Optional[Dict[str, Any]], new_item: Dict[str, Any],
+                      rollups: bool = True) -> Dict[str, Any]:
+        """Index, summary and rollup entries to write together with a record change (multi-path, root-relative)."""
+        updates = self._index_updates(storage_key, old_item, new_item)
+        if rollups:
+            updates.update(self._rollup_updates([(old_item, new_item)]))
+        if self._summary_fields():
+            new_summary = self._project(new_item) if isinstance(new_item, dict) and new_item else None
+            old_summary = self._project(old_item) if isinstance(old_item, dict) else None
+            # Changes outside the summary fields (passwords, bios...) leave the summary alone
+            if old_summary is None or new_summary != old_summary:
+                updates[f"{SUMMARY_ROOT}/{self.collection}/{storage_key}"] = new_summary
+        return updates
+
+    def _index_updates(self, storage_key: str, old_item: Optional[Dict[str, Any]], new_item: Dict[str, Any]) -> Dict[str, Any]:
+        """Multi-path update entries (relative to the DB root) moving index entries from old_item to new_item."""
+        updates = {}
+        for name, (field, normalize) in self._indexes().items():
+            new_norm = normalize(new_item.get(field)) if isinstance(new_item, dict) else ""
+            old_norm = normalize(old_item.get(field)) if isinstance(old_item, dict) else ""
+            if old_norm and old_norm != new_norm:
+                updates[self._index_path(name, old_norm)] = None
+            if new_norm:
+                updates[self._index_path(name, new_norm)] = storage_key
+        return updates
+
+    def _index_built(self, name: str) -> bool:
+        state = _index_state.get((self.collection, name))
+        if state and (state[0] or time.monotonic() - state[1] < INDEX_RECHECK_SECONDS):
+            return state[0]
+        meta = get_root_ref().child(f"{INDEX_META_ROOT}/{self.collection}/{name}").get()
+        built = bool(meta)
+        if built and name == SUMMARY_META_NAME:
+            # Summaries built before fields were added to register_summary() lack them
+            missing = set(self._summary_fields()) - set((meta or {}).get("fields") or [])
+            if missing:
+                print(f"WARNING: {self.collection} summaries lack {sorted(missing)}; run `python manage.py rebuild-summaries`")
+                built = False
+        _index_state[(self.collection, name)] = (built, time.monotonic())
+        return built
+
+    def find_by_index(self, name: str, value: Any) -> Optional[Dict[str, Any]]:
+        """
+        Returns the record whose indexed field matches value (after normalization), or None.
+        One keyed read of the index plus one of the record, instead of a collection scan.
+        Falls back to scanning while the index has not been built yet.
+        """
+        field, normalize = self._indexes()[name]
+        norm = normalize(value)
+        if not norm:
+            return None
+
+        if self._index_built(name):
+            path = self._index_path(name, norm)
+            storage_key = self._read(path, get_root_ref().child(path))
+            if storage_key is None:
+                return None
+            item = self._read(str(storage_key))
+            if isinstance(item, dict) and normalize(item.get(field)) == norm:
+                return item
+            # Stale entry (record changed behind our back): answer from a scan below
+
+        return next((i for i in self.get_all() if isinstance(i, dict) and normalize(i.get(field)) == norm), None)
+
+    def rebuild_index(self, name: str, data: Any = None) -> int:
+        """Rewrites an index from the collection contents. Returns the number of entries."""
+        field, normalize = self._indexes()[name]
+        if data is None:
+            data = self.ref.get()
+        mapping = {}
+        for storage_key, item in _items(data):
+            if isinstance(item, dict):
+                norm = normalize(item.get(field))
+                if norm:
+                    mapping[index_key(norm)] = storage_key
+
+        root = get_root_ref()
+        root.child(self._index_path(name)).set(mapping or None)
+        root.child(f"{INDEX_META_ROOT}/{self.collection}/{name}").set({
+            "field": field,
+            "entries": len(mapping),
+            "builtAt": datetime.now().isoformat()
+        })
+        _index_state[(self.collection, name)] = (True, time.monotonic())
+        self._invalidate()
+        return len(mapping)
         
+    # --- Summary records ---
+
+    def _summary_fields(self) -> List[str]:
+        return _summaries.get(self.collection, [])
+
+    def _project(self, item: Any) -> Dict[str, Any]:
+        if not isinstance(item, dict):
+            return item
+        return {f: item[f] for f in self._summary_fields() if f in item}
+
+    def _summary_view(self) -> "FirebaseDatabase":
+        """The summary records as a collection of their own (same storage keys, same cache settings)."""
+        if self._summary_db is None:
+            self._summary_db = FirebaseDatabase(f"{SUMMARY_ROOT}/{self.collection}", cache_ttl=self.cache_ttl)
+            self._summary_db._source = self.collection
+        return self._summary_db
+
+    def rebuild_summaries(self, data: Any = None) -> int:
+        """Rewrites the summary records from the collection contents. Returns how many were written."""
+        if data is None:
+            data = self.ref.get()
+        summaries = {storage_key: self._project(item) for storage_key, item in _items(data) if isinstance(item, dict)}
+
+        root = get_root_ref()
+        root.child(f"{SUMMARY_ROOT}/{self.collection}").set(summaries or None)
+        root.child(f"{INDEX_META_ROOT}/{self.collection}/{SUMMARY_META_NAME}").set({
+            "fields": self._summary_fields(),
+            "entries": len(summaries),
+            "builtAt": datetime.now().isoformat()
+        })
+        _index_state[(self.collection, SUMMARY_META_NAME)] = (True, time.monotonic())
+        self._invalidate()
+        return len(summaries)
+
+    # --- Rollups ---
+
+    def _rollups(self) -> Dict[str, Tuple[Callable, Dict[str, Callable]]]:
+        return _rollups.get(self.collection, {})
+
+    def _rollup_deltas(self, item: Any, sign: int, into: Dict[str, float]):
+        if not isinstance(item, dict) or not item:
+            return
+        for name, (group_by, measures) in self._rollups().items():
+            group = group_by(item)
+            if group is None:
+                continue
+            path = rollup_path(name, group)
+            for measure, value_of in measures.items():
+                value = value_of(item)
+                if value:
+                    into[f"{path}/{measure}"] = into.get(f"{path}/{measure}", 0) + sign * value
+
+    def _rollup_updates(self, changes: List[Tuple[Optional[Dict[str, Any]], Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Server-side increments moving each (old, new) record's contribution from its old
+        group(s) to its new one(s); records sharing a group are summed into one increment.
+        """
+        if not self._rollups():
+            return {}
+        deltas: Dict[str, float] = {}
+        for old_item, new_item in changes:
+            self._rollup_deltas(old_item, -1, deltas)
+            self._rollup_deltas(new_item, 1, deltas)
+        return {path: {".sv": {"increment": delta}} for path, delta in deltas.items() if delta}
+
+    def rebuild_rollups(self, data: Any = None) -> Dict[str, int]:
+        """
+        Recomputes this collection's rollup tables from its records (read in chunks unless
+        given). Returns the number of groups per table. Increments landing during the
+        rebuild are overwritten, so run it while writes are quiet.
+        """
+        totals: Dict[str, float] = {}
+        chunks = [_values(data)] if data is not None else self.scan()
+        for chunk in chunks:
+            for item in chunk:
+                self._rollup_deltas(item, 1, totals)
+
+        root = get_root_ref()
+        groups = {}
+        for name in self._rollups():
+            table: Dict[str, Any] = {}
+            prefix = f"{ROLLUP_ROOT}/{name}/"
+            for path, value in totals.items():
+                if not path.startswith(prefix):
+                    continue
+                node = table
+                parts = path[len(prefix):].split("/")
+                for part in parts[:-1]:
+                    node = node.setdefault(part, {})
+                node[parts[-1]] = value
+            root.child(f"{ROLLUP_ROOT}/{name}").set(table or None)
+            groups[name] = len({path.rsplit("/", 1)[0] for path in totals if path.startswith(prefix)})
+        return groups
+
     def _find_primary_key(self, item: Dict[str, Any]) -> Optional[Any]:
+        if self.collection in PRIMARY_KEYS:
+            return item.get(PRIMARY_KEYS[self.collection])
         # Helper to guess common ID fields
         for k in ['fieldID', 'id', 'reportId', 'ioTDataID', 'consultation_id', 'farmerID', 'expertID']:
             if k in item:
@@ -0,0 +1,270 @@
+import asyncio
+import bisect
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from async_db import storage_pool
+from db_firebase import FirebaseDatabase
+from presence import PresenceRegistry
+
+# The /experts/ listing, materialized: each expert is mapped to its directory entry once,
+# and in-memory indexes answer the filters and sort orders of the endpoint without
+# touching the database. Register/update in this worker apply to it immediately; writes
+# made by other workers show up with the next periodic reload. Online status is kept in
+# step with the presence registry.
+
+# Seconds between background reloads from the summary records
+DIRECTORY_REFRESH_SECONDS = float(os.environ.get("AGROTECH_DIRECTORY_REFRESH", 300))
+
+# Query parameter -> expert record field, for the equality filters (case-insensitive)
+FILTER_FIELDS = {
+    "specialization": "expertSpecialization",
+    "division": "expertDivision",
+    "district": "expertDistrict",
+    "upazila": "expertUpazila",
+}
+STATUSES = ("online", "offline")
+# "id": expertID ascending; "rating": expertRating descending
+SORTS = ("id", "rating")
+
+_EMPTY: Set[str] = frozenset()
+
+
+def normalize(value: Any) -> str:
+    return str(value).strip().casefold() if value is not None else ""
+
+
+def to_entry(record: Dict[str, Any]) -> Dict[str, Any]:
+    """The /experts/ item of an expert record (or its summary), without is_online."""
+    return {
+        "id": str(record.get("expertID", "")),
+        "user": record.get("expertID"),
+        "name": record.get("expertName", "Unknown"),
+        "specialization": record.get("expertSpecialization", "Agronomist"),
+        "title": record.get("expertTitle", "Expert"),
+        "bio": record.get("expertBio", ""),
+        "experience_years": record.get("expertExperience", 0),
+        "rating": record.get("expertRating", 0),
+        "division": record.get("expertDivision", ""),
+        "district": record.get("expertDistrict", ""),
+        "upazila": record.get("expertUpazila", ""),
+        "profile_picture": record.get("expertProfilePicture")
+    }
+
+
+def _id_order(expert_id: str) -> Tuple[int, Any]:
+    # Numeric IDs in numeric order, anything else after them
+    return (0, int(expert_id)) if expert_id.isdigit() else (1, expert_id)
+
+
+def rating_of(entry: Dict[str, Any]) -> float:
+    rating = entry.get("rating")
+    return float(rating) if isinstance(rating, (int, float)) and not isinstance(rating, bool) else 0.0
+
+
+def _order_key(sort: str, entry: Dict[str, Any]) -> tuple:
+    """Position of an entry in a sort order; the expert ID comes last, which keeps keys unique."""
+    expert_id = entry["id"]
+    if sort == "rating":
+        return (-rating_of(entry),) + _id_order(expert_id) + (expert_id,)
+    return _id_order(expert_id) + (expert_id,)
+
+
+def cursor_of(sort: str, entry: Dict[str, Any]) -> str:
+    """
+    Page cursor after an entry: its position in the sort order, not just its ID, so the
+    next page resumes at the right place even if that expert was removed or re-rated.
+    """
+    if sort == "rating":
+        return json.dumps([rating_of(entry), entry["id"]])
+    return entry["id"]
+
+
+def _cursor_key(sort: str, cursor: str) -> tuple:
+    """The order key a cursor_of cursor stands for. Raises ValueError if malformed."""
+    if sort == "rating":
+        try:
+            rating, expert_id = json.loads(cursor)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor")
+        if isinstance(rating, bool) or not isinstance(rating, (int, float)) or not isinstance(expert_id, str):
+            raise ValueError("Invalid cursor")
+        return _order_key(sort, {"id": expert_id, "rating": rating})
+    return _order_key(sort, {"id": cursor})
+
+
+class _Tables:
+    """Entries and the indexes over them (built off the event loop, then swapped in whole)."""
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        # filter param -> normalized value -> expert IDs
+        self.index: Dict[str, Dict[str, Set[str]]] = {param: {} for param in FILTER_FIELDS}
+        # status -> expert IDs
+        self.status: Dict[str, Set[str]] = {s: set() for s in STATUSES}
+        # sort -> order keys, sorted
+        self.orders: Dict[str, List[tuple]] = {sort: [] for sort in SORTS}
+
+    def add(self, entry: Dict[str, Any], online: bool, keep_sorted: bool = True):
+        expert_id = entry["id"]
+        self.entries[expert_id] = entry
+        for param in FILTER_FIELDS:
+            value = normalize(entry.get(param))
+            if value:
+                self.index[param].setdefault(value, set()).add(expert_id)
+        self.status["online" if online else "offline"].add(expert_id)
+        for sort, order in self.orders.items():
+            if keep_sorted:
+                bisect.insort(order, _order_key(sort, entry))
+            else:
+                order.append(_order_key(sort, entry))
+
+    def sort(self):
+        for order in self.orders.values():
+            order.sort()
+
+    def remove(self, expert_id: str):
+        entry = self.entries.pop(expert_id, None)
+        if entry is None:
+            return
+        for param in FILTER_FIELDS:
+            value = normalize(entry.get(param))
+            ids = self.index[param].get(value)
+            if ids is not None:
+                ids.discard(expert_id)
+                if not ids:
+                    del self.index[param][value]
+        for ids in self.status.values():
+            ids.discard(expert_id)
+        for sort, order in self.orders.items():
+            key = _order_key(sort, entry)
+            i = bisect.bisect_left(order, key)
+            if i < len(order) and order[i] == key:
+                del order[i]
+
+
+class ExpertDirectory:
+    def __init__(self, db: FirebaseDatabase, presence: PresenceRegistry,
+                 refresh_seconds: float = DIRECTORY_REFRESH_SECONDS):
+        self.db = db
+        self.presence = presence
+        self.refresh_seconds = refresh_seconds
+        self._tables = _Tables()
+        self._loaded_at: Optional[float] = None
+        self._loading: Optional[asyncio.Task] = None
+        # Upserts made while a reload is reading, re-applied on top of it
+        self._replay: List[Dict[str, Any]] = []
+        presence.add_listener(self._on_presence)
+
+    @property
+    def tables(self) -> _Tables:
+        """The current entries and indexes (replaced as a whole on reload)."""
+        return self._tables
+
+    async def ensure_loaded(self):
+        """Loads the directory on first use; afterwards reloads it in the background when stale."""
+        if self._loaded_at is None:
+            await self._reload_once()
+        elif time.monotonic() - self._loaded_at > self.refresh_seconds and self._loading is None:
+            self._loading = asyncio.create_task(self.reload())
+
+    async def _reload_once(self):
+        # Concurrent first requests share one load
+        if self._loading is None:
+            self._loading = asyncio.create_task(self.reload())
+        await asyncio.shield(self._loading)
+
+    async def reload(self):
+        self._replay = []
+        try:
+            tables = await storage_pool.run(self._build, timeout=120)
+            online = set(self.presence.online_experts())
+            for expert_id in tables.entries:
+                if expert_id in online:
+                    tables.status["offline"].discard(expert_id)
+                    tables.status["online"].add(expert_id)
+            self._tables = tables
+            for record in self._replay:
+                self._apply(record)
+            self._loaded_at = time.monotonic()
+        finally:
+            self._replay = []
+            self._loading = None
+
+    def _build(self) -> _Tables:
+        tables = _Tables()
+        for chunk in self.db.scan(projected=True):
+            for record in chunk:
+                if isinstance(record, dict) and record.get("expertID") is not None:
+                    # Everyone starts offline; reload() marks the online ones on the loop
+                    tables.add(to_entry(record), False, keep_sorted=False)
+        tables.sort()
+        return tables
+
+    def upsert(self, record: Dict[str, Any]):
+        """Applies a registered or updated expert record (call after writing it)."""
+        if record.get("expertID") is None:
+            return
+        if self._loading is not None:
+            self._replay.append(record)
+        self._apply(record)
+
+    def _apply(self, record: Dict[str, Any]):
+        entry = to_entry(record)
+        self._tables.remove(entry["id"])
+        self._tables.add(entry, self.presence.is_online(entry["id"]))
+
+    def _on_presence(self, expert_id: str, online: bool):
+        status = self._tables.status
+        if expert_id in self._tables.entries:
+            status["offline" if online else "online"].discard(expert_id)
+            status["online" if online else "offline"].add(expert_id)
+
+    def query(self, filters: Optional[Dict[str, Optional[str]]] = None, status: Optional[str] = None,
+              sort: str = "id", limit: int = 100, after: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of entries matching every given filter, in the given sort order, starting
+        after the cursor `after`. Returns (entries, cursor for the next page or None).
+        Raises ValueError for a malformed cursor.
+        """
+        tables = self._tables
+        sets = [tables.index[param].get(normalize(value), _EMPTY)
+                for param, value in (filters or {}).items() if value]
+        if status:
+            sets.append(tables.status.get(status, _EMPTY))
+
+        order = tables.orders[sort]
+        start_key = _cursor_key(sort, after) if after is not None else None
+        start = bisect.bisect_right(order, start_key) if start_key is not None else 0
+
+        if not sets:
+            keys = order[start:start + limit + 1]
+        else:
+            sets.sort(key=len)
+            candidates = sets[0].intersection(*sets[1:]) if len(sets) > 1 else sets[0]
+            if len(candidates) * 8 < len(order) - start:
+                # Few matches: sort just those rather than walking the whole order
+                ranked = sorted(_order_key(sort, tables.entries[e]) for e in candidates)
+                if start_key is not None:
+                    ranked = ranked[bisect.bisect_right(ranked, start_key):]
+                keys = ranked[:limit + 1]
+            else:
+                keys = []
+                for key in order[start:]:
+                    if key[-1] in candidates:
+                        keys.append(key)
+                        if len(keys) > limit:
+                            break
+
+        page = [tables.entries[key[-1]] for key in keys[:limit]]
+        next_after = cursor_of(sort, tables.entries[keys[limit - 1][-1]]) if len(keys) > limit else None
+        return page, next_after
+
+    def stats(self) -> Dict[str, Any]:
+        tables = self._tables
+        return {
+            "experts": len(tables.entries),
+            "online": len(tables.status["online"]),
+            "loaded_seconds_ago": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+        }
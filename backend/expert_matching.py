@@ -0,0 +1,156 @@
+import asyncio
+import heapq
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from async_db import storage_pool
+from db_firebase import FirebaseDatabase
+from expert_directory import ExpertDirectory, DIRECTORY_REFRESH_SECONDS, normalize, rating_of
+
+# Ranking of experts for a field's problem, from indexes kept in memory: the directory's
+# area and specialization indexes, and open-consultation counts per expert. Order:
+# same upazila > same district > same division > elsewhere, then a specialization that
+# covers the risk type, then fewer open consultations, then higher rating.
+
+# Words in expertSpecialization that cover each RiskType (matched case-insensitively)
+RISK_SPECIALIZATIONS: Dict[str, List[str]] = {
+    "disease": ["patholog", "disease", "entomolog", "plant protection", "pest"],
+    "nutrient": ["soil", "nutrient", "fertili", "agronom"],
+    "salinity": ["soil", "salin", "irrigation", "water"],
+    "flood": ["water", "irrigation", "hydrolog", "flood", "agronom"],
+    "general": ["agronom", "general", "extension"],
+}
+# Consultation statuses that no longer count towards an expert's load
+CLOSED_STATUSES = {"REJECTED", "COMPLETED"}
+
+PROXIMITY = ("upazila", "district", "division")
+
+
+class ConsultationLoad:
+    """Open consultations per expert, built from the consultations and kept current on writes."""
+    def __init__(self, db: FirebaseDatabase, refresh_seconds: float = DIRECTORY_REFRESH_SECONDS):
+        self.db = db
+        self.refresh_seconds = refresh_seconds
+        # consultation id -> expert ID it counts for (open consultations only)
+        self._open: Dict[str, str] = {}
+        self._counts: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+        self._loading: Optional[asyncio.Task] = None
+
+    async def ensure_loaded(self):
+        if self._loaded_at is None:
+            if self._loading is None:
+                self._loading = asyncio.create_task(self.reload())
+            await asyncio.shield(self._loading)
+        elif time.monotonic() - self._loaded_at > self.refresh_seconds and self._loading is None:
+            self._loading = asyncio.create_task(self.reload())
+
+    async def reload(self):
+        try:
+            opened = await storage_pool.run(self._build, timeout=120)
+            counts: Dict[str, int] = {}
+            for expert_id in opened.values():
+                counts[expert_id] = counts.get(expert_id, 0) + 1
+            self._open, self._counts = opened, counts
+            self._loaded_at = time.monotonic()
+        finally:
+            self._loading = None
+
+    def _build(self) -> Dict[str, str]:
+        opened = {}
+        for chunk in self.db.scan():
+            for c in chunk:
+                if isinstance(c, dict) and self._is_open(c):
+                    opened[str(c.get("id"))] = str(c.get("expertID"))
+        return opened
+
+    @staticmethod
+    def _is_open(consultation: Dict[str, Any]) -> bool:
+        return consultation.get("expertID") is not None and \
+            str(consultation.get("status", "")).upper() not in CLOSED_STATUSES
+
+    def record(self, consultation: Dict[str, Any]):
+        """Applies a created or updated consultation (call after writing it)."""
+        consultation_id = str(consultation.get("id"))
+        previous = self._open.pop(consultation_id, None)
+        if previous is not None:
+            self._counts[previous] -= 1
+            if not self._counts[previous]:
+                del self._counts[previous]
+        if self._is_open(consultation):
+            expert_id = str(consultation.get("expertID"))
+            self._open[consultation_id] = expert_id
+            self._counts[expert_id] = self._counts.get(expert_id, 0) + 1
+
+    def of(self, expert_id: str) -> int:
+        return self._counts.get(expert_id, 0)
+
+
+def specialists(directory: ExpertDirectory, risk_type: Optional[str]) -> Set[str]:
+    """Experts whose specialization covers risk_type, from the specialization index."""
+    words = RISK_SPECIALIZATIONS.get(normalize(risk_type), [])
+    matched: Set[str] = set()
+    # One pass over the distinct specializations, not over the experts
+    for value, ids in directory.tables.index["specialization"].items():
+        if any(word in value for word in words):
+            matched |= ids
+    return matched
+
+
+def rank_experts(directory: ExpertDirectory, load: ConsultationLoad, area: Dict[str, Any],
+                 risk_type: Optional[str], limit: int = 10, online_only: bool = True) -> List[Dict[str, Any]]:
+    """
+    The best `limit` experts for a field in `area` ({"division", "district", "upazila"} of
+    its farmer) with a problem of `risk_type`. Each result is the directory entry plus a
+    "match" dict explaining its rank.
+    """
+    tables = directory.tables
+    # Membership tests only: the online set, or the entries' key view (no copy of the pool)
+    pool = tables.status["online"] if online_only else tables.entries.keys()
+    index = tables.index
+
+    # Area index entries of the field's area, coarsest first; a level only counts when
+    # every coarser one is known (an upazila is only "near" within its district and division)
+    chain: List[Tuple[str, Set[str]]] = []
+    for level in reversed(PROXIMITY):
+        value = normalize(area.get(level))
+        if not value:
+            break
+        chain.append((level, index[level].get(value, set())))
+
+    def tiers() -> Iterator[Tuple[Optional[str], Any]]:
+        # Nearest first, each built only when the previous ones did not fill the list,
+        # by intersecting the index entries smallest first (never walking the pool)
+        for depth in range(len(chain), 0, -1):
+            sets = sorted((ids for _, ids in chain[:depth]), key=len)
+            members = sets[0] & pool
+            for ids in sets[1:]:
+                members &= ids
+            yield chain[depth - 1][0], members
+        yield None, pool
+
+    covered = specialists(directory, risk_type)
+    results: List[Dict[str, Any]] = []
+    taken: Set[str] = set()
+
+    def take(level: Optional[str], specialist: bool, group: Iterable[str]):
+        best = heapq.nsmallest(limit - len(results), group,
+                               key=lambda e: (load.of(e), -rating_of(tables.entries[e]), e))
+        for expert_id in best:
+            taken.add(expert_id)
+            results.append(dict(tables.entries[expert_id], match={
+                "proximity": level,
+                "specialization": specialist,
+                "open_consultations": load.of(expert_id),
+            }))
+
+    for level, members in tiers():
+        # Specialists: the smaller of the tier and the specialization match is walked
+        take(level, True, (covered & members) - taken)
+        if len(results) >= limit:
+            return results
+        # The rest of the tier is only walked when its specialists did not fill the list
+        take(level, False, [e for e in members if e not in covered and e not in taken])
+        if len(results) >= limit:
+            return results
+    return results
@@ -7,8 +7,15 @@ import sys
 # We expect this file to be in the same directory as this script (backend/)
 CRED_PATH = os.path.join(os.path.dirname(__file__), "serviceAccountKey.json")
 
+# "firebase" (default) or "local": an in-memory stand-in seeded from data/*.json,
+# for running without credentials and for benchmarks (see local_store.py)
+STORAGE_BACKEND = os.environ.get("AGROTECH_STORAGE", "firebase")
+_local_store = None
+
 def initialize_firebase():
     """Initializes the Firebase Admin SDK."""
+    if STORAGE_BACKEND == "local":
+        return
     if not firebase_admin._apps:
         if not os.path.exists(CRED_PATH):
             print(f"WARNING: Firebase credentials not found at {CRED_PATH}. Firebase features will fail.")
@@ -23,6 +30,37 @@ def initialize_firebase():
     else:
         print("ℹ️ Firebase App already initialized")
 
+def use_local_store(store=None):
+    """Routes every get_db_reference() to a LocalStore (a fresh one seeded from data/ by default)."""
+    global _local_store
+    if store is None:
+        from local_store import LocalStore
+        store = LocalStore.from_json_dir(os.path.join(os.path.dirname(__file__), "data"))
+    _local_store = store
+    return store
+
 def get_db_reference(path: str):
     """Returns a reference to a specific path in the Realtime Database."""
+    if _local_store is None and STORAGE_BACKEND == "local":
+        use_local_store()
+    if _local_store is not None:
+        return _local_store.reference(path)
     return db.reference(path)
+
+def configure_http_pool(pool_size: int):
+    """
+    Sizes the connection pool of the SDK's HTTP session. All references share one
+    session per database URL; its default pool (10 connections) would make the
+    storage thread pool queue on sockets when it is larger than that.
+    """
+    if not firebase_admin._apps:
+        return
+    try:
+        from requests.adapters import HTTPAdapter
+        session = db.reference()._client.session
+        for prefix in ("https://", "http://"):
+            current = session.adapters.get(prefix)
+            retries = current.max_retries if current is not None else 0
+            session.mount(prefix, HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retries))
+    except Exception as e:
+        print(f"WARNING: Could not resize Firebase HTTP pool: {e}")
@@ -0,0 +1,174 @@
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import threading
+import warnings
+
+import numpy as np
+
+from iot_store import IoTTimeSeriesStore, parse_time, to_epoch, from_epoch, bucket_of
+
+# Bucket widths (seconds) accepted by /iot/aggregate
+BUCKETS = {"15m": 900, "1h": 3600, "1d": 86400}
+# Window used when the client gives no `since`
+DEFAULT_SPAN = {900: timedelta(days=2), 3600: timedelta(days=7), 86400: timedelta(days=90)}
+MAX_BUCKETS = 5000
+
+AGG_METRICS = ["soilTemp", "soilMoisture", "soilPH", "soilEC", "soilN", "soilP", "soilK"]
+
+# Completed buckets kept in memory, all fields and widths together
+CACHE_MAX_BUCKETS = 200_000
+
+
+def _epochs(rows: List[Dict[str, Any]]) -> np.ndarray:
+    """createTime of each row as epoch seconds (float64, NaN if unparseable)."""
+    values = [r.get("createTime") for r in rows]
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            stamps = np.asarray(values, dtype="datetime64[us]")
+        return stamps.astype(np.int64) / 1e6
+    except (TypeError, ValueError, UserWarning):
+        out = np.full(len(values), np.nan)
+        for i, v in enumerate(values):
+            dt = parse_time(v)
+            if dt:
+                out[i] = to_epoch(dt)
+        return out
+
+
+def _metric_value(v: Any) -> float:
+    return v if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan
+
+
+def summarize(rows: List[Dict[str, Any]], width: int) -> Dict[int, Dict[str, Any]]:
+    """
+    min/max/mean/last of every AGG_METRICS column per bucket, keyed by bucket start (epoch).
+    Vectorized: one sort, then ufunc.reduceat over the bucket boundaries.
+    """
+    if not rows:
+        return {}
+    ts = _epochs(rows)
+    keep = ~np.isnan(ts)
+    if not keep.any():
+        return {}
+    ts = ts[keep]
+    values = np.array([[_metric_value(r.get(m)) for m in AGG_METRICS] for r in rows], dtype=np.float64)[keep]
+
+    order = np.argsort(ts, kind="stable")
+    ts, values = ts[order], values[order]
+    starts_of = (np.floor(ts / width) * width).astype(np.int64)
+    bounds = np.flatnonzero(np.r_[True, starts_of[1:] != starts_of[:-1]])
+    sizes = np.diff(np.r_[bounds, len(ts)])
+
+    present = ~np.isnan(values)
+    counts = np.add.reduceat(present.astype(np.int64), bounds, axis=0)
+    sums = np.add.reduceat(np.where(present, values, 0.0), bounds, axis=0)
+    # fmin/fmax skip NaN unless the whole bucket is NaN
+    mins = np.fmin.reduceat(values, bounds, axis=0)
+    maxs = np.fmax.reduceat(values, bounds, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    # Row of the last non-missing value in each bucket
+    positions = np.where(present, np.arange(len(ts))[:, None], -1)
+    last_idx = np.maximum.reduceat(positions, bounds, axis=0)
+
+    out: Dict[int, Dict[str, Any]] = {}
+    for b, start in enumerate(starts_of[bounds].tolist()):
+        entry: Dict[str, Any] = {"count": int(sizes[b])}
+        for m, name in enumerate(AGG_METRICS):
+            if counts[b, m] == 0:
+                entry[name] = None
+                continue
+            entry[name] = {
+                "min": float(mins[b, m]),
+                "max": float(maxs[b, m]),
+                "mean": round(float(means[b, m]), 4),
+                "last": float(values[last_idx[b, m], m]),
+            }
+        out[start] = entry
+    return out
+
+
+class IoTAggregator:
+    """
+    Downsamples a field's readings into fixed buckets. Buckets that have ended only change
+    when late readings arrive, so they are cached along with the write version of their day
+    (see iot_store.VERSIONS_ROOT) and reused while it is unchanged: a late or backfilled
+    reading written by any worker or script invalidates them on the next call.
+    """
+    def __init__(self, store: IoTTimeSeriesStore, max_buckets: int = CACHE_MAX_BUCKETS):
+        self.store = store
+        self.max_buckets = max_buckets
+        # (field_id, width, bucket start) -> (day version, summary or None for an empty bucket)
+        self._cache: "OrderedDict[Tuple[int, int, int], Tuple[Optional[str], Optional[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def aggregate(self, field_id: int, bucket: str = "1h", metrics: Optional[List[str]] = None,
+                  since: Optional[datetime] = None, until: Optional[datetime] = None) -> Dict[str, Any]:
+        width = BUCKETS[bucket]
+        metrics = [m for m in (metrics or AGG_METRICS) if m in AGG_METRICS]
+        field_id = int(field_id)
+        # Same clock as createTime stamps written by the routers (naive datetime.now())
+        now = datetime.now()
+        until = min(parse_time(until) or now, now)
+        since = parse_time(since) or until - DEFAULT_SPAN[width]
+
+        first = int(to_epoch(since) // width * width)
+        last = int(to_epoch(until) // width * width)
+        if (last - first) // width + 1 > MAX_BUCKETS:
+            first = last - (MAX_BUCKETS - 1) * width
+        # Buckets ending by then are final: closed, and read to their end (not cut off by until)
+        complete_ts = min(to_epoch(now), to_epoch(until))
+        starts = range(first, last + width, width)
+        # Read before the readings: a write landing in between changes it again
+        versions = self.store.versions(field_id, bucket_of(from_epoch(first)), bucket_of(from_epoch(last)))
+        days: Dict[int, Optional[str]] = {}
+
+        def version_of(start: int) -> Optional[str]:
+            # Every bucket lies inside one UTC day (widths divide a day)
+            day = start // 86400
+            if day not in days:
+                days[day] = versions.get(bucket_of(from_epoch(day * 86400)))
+            return days[day]
+
+        found: Dict[int, Optional[Dict[str, Any]]] = {}
+        missing_from = None
+        with self._lock:
+            for start in starts:
+                key = (field_id, width, start)
+                cached = self._cache.get(key)
+                if cached is not None and cached[0] == version_of(start):
+                    self._cache.move_to_end(key)
+                    found[start] = cached[1]
+                elif missing_from is None:
+                    missing_from = start
+
+        if missing_from is not None:
+            # One range read from the first uncached bucket onwards (usually just the open one).
+            # Buckets about to be cached are read from the database, not the recent-readings
+            # buffer, which can lag other workers' writes by a few seconds.
+            caching = missing_from + width <= complete_ts
+            rows = self.store.range(field_id, since=from_epoch(missing_from), until=until, buffered=not caching)
+            computed = summarize(rows, width)
+            with self._lock:
+                for start in range(missing_from, last + width, width):
+                    if start in found:
+                        continue
+                    summary = computed.get(start)
+                    found[start] = summary
+                    if start + width <= complete_ts:
+                        self._cache[(field_id, width, start)] = (version_of(start), summary)
+                while len(self._cache) > self.max_buckets:
+                    self._cache.popitem(last=False)
+
+        buckets = []
+        for start in starts:
+            summary = found.get(start)
+            if not summary:
+                continue
+            entry = {"start": from_epoch(start).isoformat(), "count": summary["count"]}
+            for m in metrics:
+                entry[m] = summary[m]
+            buckets.append(entry)
+        return {"field_id": field_id, "bucket": bucket, "metrics": metrics, "buckets": buckets}
@@ -0,0 +1,211 @@
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+import csv
+import io
+import json
+import warnings
+
+import numpy as np
+
+from iot_store import parse_time
+
+# Bulk IoT ingestion: NDJSON or CSV bodies are parsed into columns, validated
+# column-wise with NumPy and written to the time-series store in chunks.
+
+# Largest batch accepted in one request
+MAX_BATCH_ROWS = 100_000
+# Per-row rejection details returned (the count is always complete)
+MAX_REJECTIONS_REPORTED = 1000
+
+# Numeric sensor columns with their accepted [min, max] (inclusive)
+RANGES: Dict[str, Tuple[float, float]] = {
+    "locationLat": (-90.0, 90.0),
+    "locationLng": (-180.0, 180.0),
+    "soilTemp": (-20.0, 80.0),       # °C
+    "soilMoisture": (0.0, 100.0),    # %
+    "soilPH": (0.0, 14.0),
+    "soilEC": (0.0, 20.0),           # dS/m
+    "soilN": (0.0, 1000.0),          # mg/kg
+    "soilP": (0.0, 1000.0),
+    "soilK": (0.0, 1000.0),
+}
+NUMERIC_COLUMNS = list(RANGES)
+
+
+class BatchFormatError(ValueError):
+    """The body can't be parsed as a batch at all (as opposed to individual bad rows)."""
+
+
+def parse_ndjson(body: bytes) -> Tuple[List[Dict[str, Any]], Dict[int, str]]:
+    """One JSON object per line. Returns (rows, {row number: error}) for unparseable lines."""
+    lines = [line for line in body.splitlines() if line.strip()]
+    try:
+        # Whole body as one JSON array: a single C-level parse instead of one per line.
+        # Only valid if every line gave exactly one object: a line like "{...},{...}" parses
+        # as two and would shift the row numbers of everything after it.
+        rows = json.loads(b"[" + b",".join(lines) + b"]")
+        if len(rows) == len(lines) and all(isinstance(row, dict) for row in rows):
+            return rows, {}
+    except ValueError:
+        pass
+
+    rows: List[Dict[str, Any]] = []
+    errors: Dict[int, str] = {}
+    for line in lines:
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            errors[len(rows)] = "line is not a JSON object"
+            row = {}
+        rows.append(row)
+    return rows, errors
+
+
+def parse_csv(body: bytes) -> Tuple[List[Dict[str, Any]], Dict[int, str]]:
+    """CSV with a header row naming the IoTData fields."""
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise BatchFormatError("CSV body must be UTF-8")
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None)
+    if not header:
+        raise BatchFormatError("CSV body needs a header row")
+    header = [h.strip() for h in header]
+    if "fieldID" not in header:
+        raise BatchFormatError("CSV header must include fieldID")
+    width = len(header)
+    rows: List[Dict[str, Any]] = []
+    errors: Dict[int, str] = {}
+    for values in reader:
+        if not values:
+            continue
+        if len(values) != width:
+            errors[len(rows)] = f"expected {width} columns, got {len(values)}"
+            rows.append({})
+            continue
+        rows.append(dict(zip(header, values)))
+    return rows, errors
+
+
+def _float_column(rows: List[Dict[str, Any]], name: str) -> np.ndarray:
+    """Column as float64; missing or non-numeric cells become NaN."""
+    values = [r.get(name) for r in rows]
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        out = np.empty(len(values), dtype=np.float64)
+        for i, v in enumerate(values):
+            try:
+                out[i] = float(v) if v is not None and not isinstance(v, bool) else np.nan
+            except (TypeError, ValueError):
+                out[i] = np.nan
+        return out
+
+
+def _time_column(rows: List[Dict[str, Any]], default: datetime) -> np.ndarray:
+    """createTime as datetime64[us]; rows without one get default, unparseable ones NaT."""
+    values = [r.get("createTime") or default.isoformat() for r in rows]
+    try:
+        # NumPy only warns on UTC offsets; treat that as "needs the slow path" instead
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            return np.asarray(values, dtype="datetime64[us]")
+    except (TypeError, ValueError, UserWarning):
+        out = np.empty(len(values), dtype="datetime64[us]")
+        for i, v in enumerate(values):
+            dt = parse_time(v)
+            out[i] = np.datetime64(dt, "us") if dt else np.datetime64("NaT")
+        return out
+
+
+def validate(rows: List[Dict[str, Any]], parse_errors: Optional[Dict[int, str]] = None,
+             now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Validates every column at once. Returns the parsed columns, a boolean `valid` mask
+    and `reasons` ({row number: first failed check}) for the rejected rows.
+    """
+    n = len(rows)
+    now = now or datetime.now()
+    valid = np.ones(n, dtype=bool)
+    reasons: Dict[int, str] = {}
+
+    def reject(mask: np.ndarray, reason: str):
+        newly = np.nonzero(mask & valid)[0]
+        if len(newly):
+            valid[newly] = False
+            for i in newly.tolist():
+                reasons[i] = reason
+
+    if parse_errors:
+        valid[list(parse_errors)] = False
+        reasons.update(parse_errors)
+
+    field_ids = _float_column(rows, "fieldID")
+    with np.errstate(invalid="ignore"):
+        reject(~np.isfinite(field_ids) | (field_ids < 1) | (field_ids != np.floor(field_ids)), "fieldID must be a positive integer")
+
+    columns = {"fieldID": field_ids}
+    for name, (low, high) in RANGES.items():
+        col = _float_column(rows, name)
+        reject(np.isnan(col), f"{name} missing or not a number")
+        with np.errstate(invalid="ignore"):
+            reject((col < low) | (col > high), f"{name} out of range [{low}, {high}]")
+        columns[name] = col
+
+    times = _time_column(rows, now)
+    reject(np.isnat(times), "createTime is not an ISO-8601 timestamp")
+    columns["createTime"] = times
+
+    return {"columns": columns, "valid": valid, "reasons": reasons}
+
+
+def build_readings(columns: Dict[str, np.ndarray], valid: np.ndarray, ids: range) -> List[Dict[str, Any]]:
+    """IoTData dicts for the valid rows, with IDs assigned in row order."""
+    idx = np.nonzero(valid)[0]
+    field_ids = columns["fieldID"][idx].astype(np.int64).tolist()
+    metrics = [columns[name][idx].tolist() for name in NUMERIC_COLUMNS]
+    times = columns["createTime"][idx]
+    # Keep the stored "2026-01-09T00:15:00" format unless readings carry sub-second times
+    unit = "us" if (times.astype(np.int64) % 1_000_000).any() else "s"
+    times = np.datetime_as_string(times, unit=unit).tolist()
+    readings = []
+    for j, reading_id in enumerate(ids):
+        reading = {"ioTDataID": reading_id, "fieldID": field_ids[j]}
+        for name, col in zip(NUMERIC_COLUMNS, metrics):
+            reading[name] = col[j]
+        reading["createTime"] = times[j]
+        readings.append(reading)
+    return readings
+
+
+def ingest(body: bytes, fmt: str, store, id_source) -> Dict[str, Any]:
+    """
+    Parses, validates and writes one batch. store is an IoTTimeSeriesStore, id_source a
+    FirebaseDatabase whose counter hands out ioTDataIDs (one reservation per batch).
+    """
+    rows, parse_errors = parse_csv(body) if fmt == "csv" else parse_ndjson(body)
+    if len(rows) > MAX_BATCH_ROWS:
+        raise BatchFormatError(f"Batch too large: {len(rows)} rows, max {MAX_BATCH_ROWS}")
+
+    checked = validate(rows, parse_errors)
+    valid = checked["valid"]
+    accepted = int(valid.sum())
+
+    readings: List[Dict[str, Any]] = []
+    if accepted:
+        ids = id_source.reserve_ids("ioTDataID", accepted)
+        readings = build_readings(checked["columns"], valid, ids)
+        store.add_many(readings)
+
+    reasons = checked["reasons"]
+    return {
+        "received": len(rows),
+        "accepted": accepted,
+        "rejected": len(reasons),
+        # Row numbers are 1-based positions among the data rows of the body
+        "rejections": [{"row": i + 1, "reason": reasons[i]} for i in sorted(reasons)[:MAX_REJECTIONS_REPORTED]],
+        "readings": readings,
+    }
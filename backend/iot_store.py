@@ -0,0 +1,421 @@
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+from datetime import datetime, timezone
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from firebase_config import get_db_reference
+from db_firebase import FirebaseDatabase, INDEX_META_ROOT, INDEX_RECHECK_SECONDS
+
+# Readings live under iot_ts/<fieldID>/<YYYY-MM-DD>/<HHMMSSffffff>_<ioTDataID>.
+# Keys sort by time inside a day bucket, and day buckets sort by date, so range and
+# "latest N" reads are key-ordered queries on one field's subtree only.
+IOT_ROOT = "iot_ts"
+# Legacy flat collection, read for fields that have not been backfilled yet
+LEGACY_COLLECTION = "iot_data"
+# Written by `manage.py backfill-iot` once every legacy reading is in the buckets; until
+# then reads merge the legacy rows in, so history does not vanish when bucketing starts
+BACKFILL_MARKER = f"{INDEX_META_ROOT}/{IOT_ROOT}/legacy_backfill"
+# <fieldID>/<YYYY-MM-DD> -> token replaced after every write of readings for that day, by
+# any worker or script; caches derived from a day's readings are valid while it is unchanged
+VERSIONS_ROOT = f"{INDEX_META_ROOT}/{IOT_ROOT}/versions"
+
+# Latest readings kept in memory per field, and how long a buffer synced from the
+# database is trusted (other workers may have written since)
+BUFFER_CAPACITY = int(os.environ.get("AGROTECH_IOT_BUFFER", 512))
+BUFFER_TTL = float(os.environ.get("AGROTECH_IOT_BUFFER_TTL", 5))
+
+# Readings per multi-path update when writing many at once
+WRITE_CHUNK = 500
+
+
+def parse_time(value: Any) -> Optional[datetime]:
+    """createTime as a naive UTC datetime (stored strings are naive ISO-8601)."""
+    if isinstance(value, datetime):
+        dt = value
+    elif value:
+        try:
+            dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    else:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def to_epoch(dt: datetime) -> float:
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def from_epoch(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+def bucket_of(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d")
+
+
+def reading_key(dt: datetime, reading_id: Any) -> str:
+    return f"{dt.strftime('%H%M%S%f')}_{reading_id}"
+
+
+class RecentReadings:
+    """
+    One field's latest readings, sorted by time (oldest first): timestamps in a NumPy
+    array, so windows are found with searchsorted, and each reading as it was written
+    beside its timestamp, so the buffer serves the same rows as the database. When full,
+    a newer reading evicts the oldest; an older one is not kept.
+    """
+    def __init__(self, capacity: int = BUFFER_CAPACITY):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.rows = np.empty(capacity, dtype=object)
+        self.size = 0
+        self.synced_at = 0.0
+        # True when everything the field has in the database fits in the buffer
+        self.complete = False
+
+    def append(self, reading: Dict[str, Any]):
+        dt = parse_time(reading.get("createTime"))
+        if dt is None:
+            return
+        ts = to_epoch(dt)
+        n = self.size
+        # After equal timestamps, so arrival order breaks ties
+        i = int(np.searchsorted(self.ts[:n], ts, side="right"))
+        if n == self.capacity:
+            if i == 0:
+                # Older than everything buffered (a late or historical reading): not among the latest
+                self.complete = False
+                return
+            # Evict the oldest: shift the older part down one slot
+            i -= 1
+            self.ts[:i] = self.ts[1:i + 1]
+            self.rows[:i] = self.rows[1:i + 1]
+            self.complete = False
+        else:
+            self.ts[i + 1:n + 1] = self.ts[i:n]
+            self.rows[i + 1:n + 1] = self.rows[i:n]
+            self.size += 1
+        self.ts[i] = ts
+        # A copy: the caller's dict may change after it is written
+        self.rows[i] = dict(reading)
+
+    def oldest(self) -> Optional[float]:
+        return float(self.ts[0]) if self.size else None
+
+    def select(self, since: Optional[float] = None, until: Optional[float] = None,
+               limit: Optional[int] = None) -> np.ndarray:
+        """Slot positions of readings in [since, until], newest first."""
+        ts = self.ts[:self.size]
+        lo = int(np.searchsorted(ts, since, side="left")) if since is not None else 0
+        hi = int(np.searchsorted(ts, until, side="right")) if until is not None else self.size
+        slots = np.arange(lo, hi)[::-1]
+        return slots[:limit] if limit else slots
+
+    def to_dicts(self, slots: np.ndarray) -> List[Dict[str, Any]]:
+        """Copies of the readings in the given slots, keys and value types as written."""
+        return [dict(self.rows[i]) for i in slots]
+
+
+class IoTTimeSeriesStore:
+    """
+    IoT readings partitioned by field and day. Serves time-range and "latest N" reads
+    from one field's buckets, with the latest readings of each field buffered in memory.
+    """
+    def __init__(self, root: str = IOT_ROOT, buffer_capacity: int = BUFFER_CAPACITY, buffer_ttl: float = BUFFER_TTL):
+        self.root = root
+        self.ref = get_db_reference(root)
+        self.buffer_capacity = buffer_capacity
+        self.buffer_ttl = buffer_ttl
+        self._buffers: Dict[int, RecentReadings] = {}
+        self._lock = threading.Lock()
+        # (backfilled, checked_at) of the legacy collection
+        self._backfill_state = (False, 0.0)
+
+    # --- Writes ---
+
+    def add(self, reading: Dict[str, Any]):
+        self.add_many([reading])
+
+    def add_many(self, readings: Iterable[Dict[str, Any]]) -> int:
+        """Writes readings in chunked multi-path updates. Returns how many were written."""
+        written = 0
+        updates = {}
+        touched = []
+        days = set()
+        for reading in readings:
+            path = self.path_of(reading)
+            if path is None:
+                continue
+            updates[path] = reading
+            touched.append(reading)
+            days.add(path.rsplit("/", 1)[0])
+            if len(updates) >= WRITE_CHUNK:
+                self.ref.update(updates)
+                written += len(updates)
+                updates = {}
+        if updates:
+            self.ref.update(updates)
+            written += len(updates)
+        if days:
+            # After the readings, so a reader that sees the new version also sees them
+            token = uuid.uuid4().hex
+            get_db_reference(VERSIONS_ROOT).update({day: token for day in days})
+
+        with self._lock:
+            for reading in touched:
+                buf = self._buffers.get(int(reading["fieldID"]))
+                if buf is not None:
+                    buf.append(reading)
+        return written
+
+    def path_of(self, reading: Dict[str, Any]) -> Optional[str]:
+        """Storage path of a reading relative to the store root, or None if it lacks field/time."""
+        field_id = reading.get("fieldID")
+        if field_id is None:
+            return None
+        t = reading.get("createTime")
+        if isinstance(t, str) and len(t) == 19 and t[10] == "T" and t[13] == ":" and t[16] == ":":
+            # Canonical "YYYY-MM-DDTHH:MM:SS" (what we store): slice instead of parse + format
+            return f"{field_id}/{t[:10]}/{t[11:13]}{t[14:16]}{t[17:19]}000000_{reading.get('ioTDataID')}"
+        dt = parse_time(t)
+        if dt is None:
+            return None
+        return f"{field_id}/{bucket_of(dt)}/{reading_key(dt, reading.get('ioTDataID'))}"
+
+    def position_of(self, reading: Dict[str, Any]) -> Optional[str]:
+        """"<day>/<key>" of a reading inside its field: sorts like (createTime, ID), used as a page cursor."""
+        path = self.path_of(reading)
+        return path.split("/", 1)[1] if path else None
+
+    # --- Reads ---
+
+    def buckets(self, field_id: int) -> List[str]:
+        """Day buckets holding data for a field (shallow read: keys only)."""
+        data = self.ref.child(str(field_id)).get(shallow=True)
+        return sorted(data.keys()) if isinstance(data, dict) else []
+
+    def fields(self) -> List[str]:
+        data = self.ref.get(shallow=True)
+        return sorted(data.keys()) if isinstance(data, dict) else []
+
+    def range(self, field_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+              limit: Optional[int] = None, before: Optional[str] = None, buffered: bool = True) -> List[Dict[str, Any]]:
+        """
+        Readings of one field with since <= createTime <= until, newest first, at most limit.
+        before (a position_of cursor) continues a previous page with the readings older than it.
+        Answered from the in-memory buffer when it covers the window, unless buffered is False
+        (the buffer may miss up to BUFFER_TTL seconds of other workers' writes).
+        """
+        since, until = parse_time(since), parse_time(until)
+        field_id = int(field_id)
+        if before or not buffered:
+            return self._read_range(field_id, since, until, limit, before)
+        since_ts = to_epoch(since) if since else None
+        until_ts = to_epoch(until) if until else None
+
+        with self._lock:
+            buf = self._buffers.get(field_id)
+            if buf is not None and self._covers(buf, since_ts, limit, until_ts):
+                return buf.to_dicts(buf.select(since_ts, until_ts, limit))
+
+        if since is None and until is None and limit and limit <= self.buffer_capacity:
+            buf = self._sync(field_id)
+            return buf.to_dicts(buf.select(limit=limit))
+
+        return self._read_range(field_id, since, until, limit)
+
+    def latest(self, field_id: int, n: int = 1) -> List[Dict[str, Any]]:
+        return self.range(field_id, limit=n)
+
+    def range_all(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  limit: Optional[int] = None, before: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Readings of every field in the window, newest first (one range read per field)."""
+        rows = []
+        for field_id in self.fields():
+            if field_id.isdigit():
+                rows.extend(self.range(int(field_id), since, until, limit, before))
+        if self.legacy_pending():
+            seen = {r.get("ioTDataID") for r in rows}
+            rows.extend(r for r in FirebaseDatabase(LEGACY_COLLECTION).get_all()
+                        if isinstance(r, dict) and r.get("ioTDataID") not in seen)
+        since, until = parse_time(since), parse_time(until)
+        ordered = []
+        for r in rows:
+            dt = parse_time(r.get("createTime"))
+            if dt is None or (since and dt < since) or (until and dt > until):
+                continue
+            position = self.position_of(r)
+            if before and position >= before:
+                continue
+            ordered.append((position, r))
+        ordered.sort(key=lambda x: x[0], reverse=True)
+        rows = [r for _, r in ordered]
+        return rows[:limit] if limit else rows
+
+    def scan(self, field_id: Optional[int] = None, chunk_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Every reading (of one field, or all fields) oldest first, in chunks of up to
+        chunk_size: shallow reads list the fields and days, then each day is read in
+        key-ordered chunks. Until the legacy collection is backfilled, its readings come
+        first, and bucketed copies of them are skipped.
+        """
+        copied: set = set()
+        if self.legacy_pending():
+            for chunk in FirebaseDatabase(LEGACY_COLLECTION).scan(chunk_size):
+                rows = [r for r in chunk if isinstance(r, dict)]
+                if field_id is not None:
+                    rows = [r for r in rows if str(r.get("fieldID")) == str(field_id)]
+                copied.update(r.get("ioTDataID") for r in rows)
+                if rows:
+                    yield rows
+
+        field_ids = [str(field_id)] if field_id is not None else self.fields()
+        for fid in field_ids:
+            for day in self.buckets(fid):
+                after = None
+                while True:
+                    q = self.ref.child(f"{fid}/{day}").order_by_key()
+                    if after is not None:
+                        q = q.start_at(after)
+                    data = q.limit_to_first(chunk_size + (1 if after is not None else 0)).get()
+                    items = [(k, v) for k, v in data.items() if k != after] if isinstance(data, dict) else []
+                    if not items:
+                        break
+                    rows = [v for _, v in items if not (copied and isinstance(v, dict) and v.get("ioTDataID") in copied)]
+                    if rows:
+                        yield rows
+                    if len(items) < chunk_size:
+                        break
+                    after = items[-1][0]
+
+    def _covers(self, buf: RecentReadings, since_ts: Optional[float], limit: Optional[int],
+                until_ts: Optional[float] = None) -> bool:
+        if time.monotonic() - buf.synced_at > self.buffer_ttl:
+            return False
+        if buf.complete:
+            return True
+        if since_ts is not None:
+            oldest = buf.oldest()
+            return oldest is not None and since_ts >= oldest
+        # Unbounded below: enough buffered readings must fall inside the window
+        return bool(limit) and len(buf.select(until=until_ts, limit=limit)) >= limit
+
+    def _sync(self, field_id: int) -> RecentReadings:
+        rows = self._read_range(field_id, limit=self.buffer_capacity)
+        buf = RecentReadings(self.buffer_capacity)
+        for reading in reversed(rows):
+            buf.append(reading)
+        buf.complete = len(rows) < self.buffer_capacity
+        buf.synced_at = time.monotonic()
+        with self._lock:
+            self._buffers[field_id] = buf
+        return buf
+
+    def versions(self, field_id: int, first_day: str, last_day: str) -> Dict[str, str]:
+        """Write version (see VERSIONS_ROOT) of each day of a field in [first_day, last_day] that has one."""
+        data = get_db_reference(f"{VERSIONS_ROOT}/{int(field_id)}").order_by_key() \
+            .start_at(first_day).end_at(last_day).get()
+        return data if isinstance(data, dict) else {}
+
+    def legacy_pending(self) -> bool:
+        """True until the legacy collection has been backfilled (re-checked every minute)."""
+        backfilled, checked_at = self._backfill_state
+        if backfilled or time.monotonic() - checked_at < INDEX_RECHECK_SECONDS:
+            return not backfilled
+        backfilled = get_db_reference(BACKFILL_MARKER).get() is not None
+        self._backfill_state = (backfilled, time.monotonic())
+        return not backfilled
+
+    def _read_range(self, field_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                    limit: Optional[int] = None, before: Optional[str] = None) -> List[Dict[str, Any]]:
+        rows = self._read_buckets(field_id, since, until, limit, before)
+        if not self.legacy_pending():
+            return rows
+        # Merge in legacy readings not copied yet (bucketed copies win), newest first
+        ids = {r.get("ioTDataID") for r in rows}
+        legacy = [r for r in self._read_legacy(field_id, since, until, limit, before) if r.get("ioTDataID") not in ids]
+        if not legacy:
+            return rows
+        rows = sorted(rows + legacy, key=self.position_of, reverse=True)
+        return rows[:limit] if limit else rows
+
+    def _read_buckets(self, field_id: int, since: Optional[datetime], until: Optional[datetime],
+                      limit: Optional[int], before: Optional[str]) -> List[Dict[str, Any]]:
+        days = self.buckets(field_id)
+        if not days:
+            return []
+
+        first_day = bucket_of(since) if since else None
+        last_day = bucket_of(until) if until else None
+        before_day, _, before_key = before.partition("/") if before else (None, "", None)
+        days = [d for d in days if (first_day is None or d >= first_day) and (last_day is None or d <= last_day)
+                and (before_day is None or d <= before_day)]
+
+        rows: List[Dict[str, Any]] = []
+        for day in reversed(days):
+            q = self.ref.child(f"{field_id}/{day}").order_by_key()
+            if day == first_day:
+                # The "_" keeps the bound a string key: an all-digit one is ordered as an integer,
+                # ahead of every reading key, and would filter nothing
+                q = q.start_at(since.strftime("%H%M%S%f") + "_")
+            end = None
+            if day == last_day:
+                # "~" sorts after "_" and digits: includes every reading of that microsecond
+                end = until.strftime("%H%M%S%f") + "~"
+            if day == before_day:
+                # end_at is inclusive: the cursor's own reading comes back and is dropped below
+                end = min(end, before_key) if end else before_key
+            if end:
+                q = q.end_at(end)
+            if limit:
+                q = q.limit_to_last(limit - len(rows) + (1 if day == before_day else 0))
+            data = q.get()
+            if isinstance(data, dict):
+                rows.extend(v for k, v in reversed(list(data.items()))
+                            if not (day == before_day and k == before_key) and self._within(v, since, until))
+            if limit and len(rows) >= limit:
+                break
+        return rows[:limit] if limit else rows
+
+    @staticmethod
+    def _within(reading: Any, since: Optional[datetime], until: Optional[datetime]) -> bool:
+        dt = parse_time(reading.get("createTime")) if isinstance(reading, dict) else None
+        return dt is not None and not (since and dt < since) and not (until and dt > until)
+
+    def _read_legacy(self, field_id: int, since: Optional[datetime], until: Optional[datetime],
+                     limit: Optional[int], before: Optional[str] = None) -> List[Dict[str, Any]]:
+        values = FirebaseDatabase(LEGACY_COLLECTION).query("fieldID", field_id)
+        rows = []
+        for r in values:
+            dt = parse_time(r.get("createTime")) if isinstance(r, dict) else None
+            if dt is None or (since and dt < since) or (until and dt > until):
+                continue
+            if before and self.position_of(r) >= before:
+                continue
+            rows.append((dt, r))
+        rows.sort(key=lambda x: x[0], reverse=True)
+        rows = [r for _, r in rows]
+        return rows[:limit] if limit else rows
+
+    # --- Maintenance ---
+
+    def backfill(self, readings: Iterable[Dict[str, Any]]) -> int:
+        """Copies readings from the legacy flat collection into the buckets (idempotent)."""
+        written = self.add_many(r for r in readings if isinstance(r, dict))
+        with self._lock:
+            self._buffers.clear()
+        return written
+
+    def mark_backfilled(self, readings: int):
+        """Records that every legacy reading is bucketed: reads stop merging the legacy collection in."""
+        get_db_reference(BACKFILL_MARKER).set({"readings": readings, "doneAt": datetime.now().isoformat()})
+        self._backfill_state = (True, time.monotonic())
+        with self._lock:
+            self._buffers.clear()
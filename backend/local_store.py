@@ -0,0 +1,323 @@
+"""
+In-memory stand-in for the Firebase Realtime Database.
+
+Implements the subset of the firebase_admin.db Reference/Query API the backend
+uses (get/set/update/push/delete/transaction, ordered queries, shallow reads,
+multi-path updates and the {".sv": {"increment": n}} server value), so the
+routers and tools can run without credentials and benchmarks can run without
+network noise.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import json
+import os
+import threading
+import time
+
+_PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+
+
+def _split(path: str) -> List[str]:
+    return [p for p in str(path).split("/") if p]
+
+
+def _normalize(value: Any) -> Any:
+    """Stores values the way the database does: lists become integer-keyed objects, nulls vanish."""
+    if isinstance(value, (list, tuple)):
+        value = {str(i): v for i, v in enumerate(value)}
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            v = _normalize(v)
+            if v is not None:
+                out[str(k)] = v
+        return out or None
+    return value
+
+
+def _prepare(value: Any):
+    """
+    Copies a payload through JSON, like the REST client serializing it (C-speed, and
+    rejects values the database couldn't store). Returns (copy, needs_normalize, has_server_values).
+    """
+    raw = json.dumps(value)
+    return json.loads(raw), ("[" in raw or "null" in raw), '".sv"' in raw
+
+
+def _export(node: Any) -> Any:
+    """Renders a stored node like the REST API: mostly-dense integer keys come back as a list."""
+    if not isinstance(node, dict):
+        return node
+    if node and all(k.isdigit() for k in node):
+        top = max(int(k) for k in node)
+        if len(node) * 2 > top + 1:
+            out = [None] * (top + 1)
+            for k, v in node.items():
+                out[int(k)] = _export(v)
+            return out
+    return {k: _export(v) for k, v in node.items()}
+
+
+def _key_sort(key: str):
+    # Integer-like keys sort numerically before all other keys
+    if key.isdigit() and len(key) < 19:
+        return (0, int(key), "")
+    return (1, 0, key)
+
+
+def _value_sort(value: Any):
+    if value is None:
+        return (0, 0, "")
+    if isinstance(value, bool):
+        return (1, int(value), "")
+    if isinstance(value, (int, float)):
+        return (2, value, "")
+    if isinstance(value, str):
+        return (3, 0, value)
+    return (4, 0, "")
+
+
+class LocalStore:
+    """Holds the tree; every LocalReference created from it shares the same data."""
+    def __init__(self, data: Optional[Dict[str, Any]] = None, latency: float = 0.0):
+        self.root: Dict[str, Any] = _normalize(data or {}) or {}
+        self.lock = threading.RLock()
+        # Optional simulated round-trip time, useful when sizing thread pools locally
+        self.latency = latency
+        self._push_last = 0
+        self._push_seq = 0
+
+    def reference(self, path: str = "/") -> "LocalReference":
+        return LocalReference(self, _split(path))
+
+    @classmethod
+    def from_json_dir(cls, data_dir: str, **kwargs) -> "LocalStore":
+        """Seeds a store from the legacy data/<collection>.json files."""
+        data = {}
+        if os.path.isdir(data_dir):
+            for name in sorted(os.listdir(data_dir)):
+                if name.endswith(".json"):
+                    with open(os.path.join(data_dir, name), "r", encoding="utf-8") as f:
+                        data[name[:-5]] = json.load(f)
+        return cls(data, **kwargs)
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _node(self, parts: List[str]) -> Any:
+        node = self.root
+        for p in parts:
+            if not isinstance(node, dict) or p not in node:
+                return None
+            node = node[p]
+        return node
+
+    def _write(self, parts: List[str], value: Any):
+        """Stores an already-normalized value (None deletes)."""
+        if isinstance(value, dict) and not value:
+            value = None
+        if not parts:
+            self.root = value if isinstance(value, dict) else {}
+            return
+        node = self.root
+        trail = []
+        for p in parts[:-1]:
+            child = node.get(p)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = {}
+                node[p] = child
+            trail.append((node, p))
+            node = child
+        if value is None:
+            node.pop(parts[-1], None)
+            # Prune parents left empty, as the database does
+            for parent, key in reversed(trail):
+                if parent[key]:
+                    break
+                del parent[key]
+        else:
+            node[parts[-1]] = value
+
+    def _resolve_server_values(self, parts: List[str], value: Any) -> Any:
+        if isinstance(value, dict):
+            if set(value) == {".sv"}:
+                sv = value[".sv"]
+                if isinstance(sv, dict) and "increment" in sv:
+                    current = self._node(parts)
+                    current = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+                    return current + sv["increment"]
+                if sv == "timestamp":
+                    return int(time.time() * 1000)
+            return {k: self._resolve_server_values(parts + [str(k)], v) for k, v in value.items()}
+        return value
+
+    def push_key(self) -> str:
+        now = int(time.time() * 1000)
+        if now == self._push_last:
+            self._push_seq += 1
+        else:
+            self._push_last, self._push_seq = now, 0
+        chars = []
+        t = now
+        for _ in range(8):
+            chars.append(_PUSH_CHARS[t % 64])
+            t //= 64
+        seq = self._push_seq
+        tail = []
+        for _ in range(12):
+            tail.append(_PUSH_CHARS[seq % 64])
+            seq //= 64
+        return "".join(reversed(chars)) + "".join(reversed(tail))
+
+
+class LocalQuery:
+    def __init__(self, ref: "LocalReference", order_by: str):
+        self._ref = ref
+        self._order_by = order_by
+        self._start = None
+        self._end = None
+        self._equal = None
+        self._has_equal = False
+        self._first = None
+        self._last = None
+
+    def start_at(self, start):
+        self._start = start
+        return self
+
+    def end_at(self, end):
+        self._end = end
+        return self
+
+    def equal_to(self, value):
+        self._equal = value
+        self._has_equal = True
+        return self
+
+    def limit_to_first(self, limit: int):
+        self._first = limit
+        return self
+
+    def limit_to_last(self, limit: int):
+        self._last = limit
+        return self
+
+    def _sort_value(self, key: str, value: Any):
+        if self._order_by == "$key":
+            return key
+        node = value
+        for p in _split(self._order_by):
+            node = node.get(p) if isinstance(node, dict) else None
+        return node
+
+    def get(self):
+        store = self._ref._store
+        store._wait()
+        with store.lock:
+            node = store._node(self._ref._parts)
+            if not isinstance(node, dict):
+                return OrderedDict()
+            items = list(node.items())
+        by_key = self._order_by == "$key"
+        rows = []
+        for k, v in items:
+            sv = self._sort_value(k, v)
+            rank = _key_sort(sv) if by_key else _value_sort(sv)
+            if self._has_equal and sv != self._equal:
+                continue
+            if self._start is not None and rank < (_key_sort(str(self._start)) if by_key else _value_sort(self._start)):
+                continue
+            if self._end is not None and rank > (_key_sort(str(self._end)) if by_key else _value_sort(self._end)):
+                continue
+            rows.append((rank, _key_sort(k), k, v))
+        rows.sort(key=lambda r: (r[0], r[1]))
+        if self._first is not None:
+            rows = rows[:self._first]
+        if self._last is not None:
+            rows = rows[-self._last:] if self._last else []
+        return OrderedDict((k, json.loads(json.dumps(_export(v))) if isinstance(v, dict) else v) for _, _, k, v in rows)
+
+
+class LocalReference:
+    def __init__(self, store: LocalStore, parts: List[str]):
+        self._store = store
+        self._parts = parts
+
+    @property
+    def key(self) -> Optional[str]:
+        return self._parts[-1] if self._parts else None
+
+    @property
+    def path(self) -> str:
+        return "/" + "/".join(self._parts)
+
+    def child(self, path: str) -> "LocalReference":
+        return LocalReference(self._store, self._parts + _split(path))
+
+    def get(self, etag: bool = False, shallow: bool = False):
+        self._store._wait()
+        with self._store.lock:
+            node = self._store._node(self._parts)
+            if shallow and isinstance(node, dict):
+                value = {k: (True if isinstance(v, dict) else v) for k, v in node.items()}
+            else:
+                value = _export(node)
+                value = json.loads(json.dumps(value)) if isinstance(value, (dict, list)) else value
+        if etag:
+            return value, str(hash(json.dumps(value, sort_keys=True, default=str)))
+        return value
+
+    def set(self, value: Any):
+        value, needs_normalize, has_sv = _prepare(value)
+        self._store._wait()
+        with self._store.lock:
+            if has_sv:
+                value = self._store._resolve_server_values(self._parts, value)
+            self._store._write(self._parts, _normalize(value) if needs_normalize else value)
+
+    def update(self, value: Dict[str, Any]):
+        if not isinstance(value, dict) or not value:
+            raise ValueError("Value argument must be a non-empty dictionary.")
+        value, needs_normalize, has_sv = _prepare(value)
+        self._store._wait()
+        with self._store.lock:
+            for path, v in value.items():
+                parts = self._parts + _split(path)
+                if has_sv:
+                    v = self._store._resolve_server_values(parts, v)
+                self._store._write(parts, _normalize(v) if needs_normalize else v)
+
+    def push(self, value: Any = ""):
+        with self._store.lock:
+            ref = self.child(self._store.push_key())
+        if value is not None:
+            ref.set(value)
+        return ref
+
+    def delete(self):
+        self._store._wait()
+        with self._store.lock:
+            self._store._write(self._parts, None)
+
+    def transaction(self, transaction_update):
+        self._store._wait()
+        with self._store.lock:
+            current = _export(self._store._node(self._parts))
+            current = json.loads(json.dumps(current)) if isinstance(current, (dict, list)) else current
+            new_value = transaction_update(current)
+            stored = _prepare(new_value)[0]
+            # _normalize builds new containers, so the returned copy stays independent
+            self._store._write(self._parts, _normalize(stored))
+            return stored
+
+    def order_by_child(self, path: str) -> LocalQuery:
+        return LocalQuery(self, path)
+
+    def order_by_key(self) -> LocalQuery:
+        return LocalQuery(self, "$key")
+
+    def order_by_value(self) -> LocalQuery:
+        return LocalQuery(self, "$value")
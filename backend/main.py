@@ -1,6 +1,9 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth, farmer, expert, common, websocket
+from fastapi.responses import JSONResponse
+from routers import auth, farmer, expert, common, websocket, admin, blobs, tiles
+from async_db import StorageTimeout
+from pagination import NEXT_CURSOR_HEADER
 
 app = FastAPI(title="AgroTech Mock Backend")
 
@@ -20,6 +23,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets browser clients read the next-page cursor of list endpoints
+    expose_headers=[NEXT_CURSOR_HEADER, "X-Truncated"],
 )
 
 # Include Routers
@@ -27,8 +32,27 @@ app.include_router(auth.router, prefix="/api/v1")
 app.include_router(farmer.router, prefix="/api/v1")
 app.include_router(expert.router, prefix="/api/v1")
 app.include_router(common.router, prefix="/api/v1")
+app.include_router(admin.router, prefix="/api/v1")
+app.include_router(blobs.router, prefix="/api/v1")
+app.include_router(tiles.router, prefix="/api/v1")
 app.include_router(websocket.router)
 
+@app.on_event("startup")
+async def start_ws_broker():
+    # Connects this worker to the WebSocket broker (AGROTECH_WS_BROKER) before clients arrive
+    await websocket.manager.start()
+
+@app.on_event("shutdown")
+async def stop_ws_broker():
+    await websocket.manager.stop()
+
+@app.exception_handler(StorageTimeout)
+async def storage_timeout_handler(request: Request, exc: StorageTimeout):
+    if exc.still_running:
+        # Started but not finished: a write may still land, so a blind retry could repeat it
+        return JSONResponse(status_code=503, content={"detail": "Storage is slow; the operation may still complete. Check before retrying."})
+    return JSONResponse(status_code=503, content={"detail": "Storage is busy, please retry."})
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to AgroTech Mock Backend"}
@@ -0,0 +1,233 @@
+import argparse
+import json
+import sys
+
+from firebase_config import initialize_firebase
+
+
+def rebuild_indexes(args):
+    # Importing the routers registers the secondary indexes they rely on
+    from routers import auth
+    from db_firebase import FirebaseDatabase, _indexes
+
+    collections = [args.collection] if args.collection else sorted(_indexes)
+    for collection in collections:
+        if collection not in _indexes:
+            print(f"⚠️  No indexes registered for {collection}.")
+            continue
+        db = FirebaseDatabase(collection)
+        for name in sorted(_indexes[collection]):
+            count = db.rebuild_index(name)
+            print(f"✅ {collection}.{name}: {count} entries")
+
+
+def rebuild_summaries(args):
+    # Importing the routers registers the summary fields they rely on
+    from routers import expert
+    from db_firebase import FirebaseDatabase, _summaries
+
+    collections = [args.collection] if args.collection else sorted(_summaries)
+    for collection in collections:
+        if collection not in _summaries:
+            print(f"⚠️  No summary registered for {collection}.")
+            continue
+        count = FirebaseDatabase(collection).rebuild_summaries()
+        print(f"✅ {collection}: {count} summary records")
+
+
+def rebuild_rollups(args):
+    # Importing the routers registers the rollup tables they maintain
+    from routers import farmer, common, expert
+    from db_firebase import FirebaseDatabase, _rollups
+
+    collections = [args.collection] if args.collection else sorted(_rollups)
+    for collection in collections:
+        if collection not in _rollups:
+            print(f"⚠️  No rollups registered for {collection}.")
+            continue
+        if collection == "fields":
+            print(f"✅ fields: district copied onto {backfill_field_districts()} fields")
+        for name, groups in sorted(FirebaseDatabase(collection).rebuild_rollups().items()):
+            print(f"✅ {collection}.{name}: {groups} groups")
+
+
+def backfill_field_districts() -> int:
+    # Fields created before fieldDistrict existed take it from their farmer
+    from db_firebase import FirebaseDatabase
+
+    districts = {}
+    for chunk in FirebaseDatabase("farmers").scan():
+        for farmer in chunk:
+            if isinstance(farmer, dict) and farmer.get("farmerDistrict"):
+                districts[str(farmer.get("farmerID"))] = farmer["farmerDistrict"]
+    fields = FirebaseDatabase("fields")
+    patched = 0
+    for chunk in fields.scan():
+        changes = {f["fieldID"]: {"fieldDistrict": districts[str(f.get("farmerID"))]} for f in chunk
+                   if isinstance(f, dict) and f.get("fieldID") is not None and not f.get("fieldDistrict")
+                   and str(f.get("farmerID")) in districts}
+        if changes:
+            patched += fields.patch_many(changes, "fieldID")
+    return patched
+
+
+def backfill_iot(args):
+    from db_firebase import FirebaseDatabase
+    from iot_store import IoTTimeSeriesStore, LEGACY_COLLECTION
+
+    readings = FirebaseDatabase(LEGACY_COLLECTION).get_all()
+    store = IoTTimeSeriesStore()
+    count = store.backfill(readings)
+    store.mark_backfilled(count)
+    print(f"✅ {count} of {len(readings)} readings copied into the time-series store")
+
+
+def bench_iot_ingest(args):
+    import random
+    import time
+    from datetime import datetime, timedelta
+    from firebase_config import use_local_store
+    from local_store import LocalStore
+
+    # Always against a fresh in-memory stand-in, never the real database
+    use_local_store(LocalStore())
+    from db_firebase import FirebaseDatabase
+    from iot_store import IoTTimeSeriesStore
+    import iot_ingest
+
+    store = IoTTimeSeriesStore()
+    ids = FirebaseDatabase("iot_data")
+    start = datetime(2026, 1, 1)
+    bodies = []
+    for b in range(args.batches):
+        lines = []
+        for i in range(args.rows):
+            n = b * args.rows + i
+            # Sensor-like precision (a few decimals), not 17-digit random floats
+            lines.append(json.dumps({
+                "fieldID": n % args.fields + 1,
+                "locationLat": round(23.8 + random.random() / 100, 6), "locationLng": round(90.4 + random.random() / 100, 6),
+                "soilTemp": round(random.uniform(15, 40), 1), "soilMoisture": round(random.uniform(10, 90), 1),
+                "soilPH": round(random.uniform(4, 9), 2), "soilEC": round(random.uniform(0, 4), 2),
+                "soilN": round(random.uniform(0, 60), 1), "soilP": round(random.uniform(0, 30), 1), "soilK": round(random.uniform(0, 40), 1),
+                "createTime": (start + timedelta(seconds=30 * n)).isoformat()
+            }))
+        bodies.append("\n".join(lines).encode())
+
+    began = time.perf_counter()
+    accepted = 0
+    for body in bodies:
+        accepted += iot_ingest.ingest(body, "ndjson", store, ids)["accepted"]
+    elapsed = time.perf_counter() - began
+    print(f"✅ {accepted} readings in {elapsed:.2f}s: {accepted / elapsed:,.0f} readings/s "
+          f"({args.batches} batches of {args.rows}, {args.fields} fields)")
+
+
+def migrate_blobs(args):
+    from db_firebase import FirebaseDatabase
+    from blob_store import blob_store, is_data_uri, is_absolute_blob_url, BlobTooLarge, BLOB_FIELDS
+
+    def movable(value):
+        # Data URIs, and absolute blob URLs written before records kept only the path
+        return is_data_uri(value) or is_absolute_blob_url(value)
+
+    id_fields = {"farmers": "farmerID", "experts": "expertID"}
+    for collection, keys in sorted(BLOB_FIELDS.items()):
+        db = FirebaseDatabase(collection)
+        moved = 0
+        for chunk in db.scan():
+            for record in chunk:
+                if not isinstance(record, dict) or not any(movable(record.get(k)) for k in keys):
+                    continue
+                changes = {k: record[k] for k in keys if movable(record.get(k))}
+                try:
+                    blob_store.externalize(changes, keys)
+                except BlobTooLarge as e:
+                    print(f"⚠️  {collection} {record.get(id_fields[collection])}: {e} Left in place.")
+                    continue
+                db.patch(record.get(id_fields[collection]), changes, id_fields[collection])
+                moved += len(changes)
+        print(f"✅ {collection}: {moved} data URIs / absolute URLs replaced by blob paths")
+
+
+def backup(args):
+    import os
+    from datetime import datetime
+    from backup import backup as run_backup
+
+    out_dir = args.out or os.path.join("backups", datetime.utcnow().strftime("%Y%m%dT%H%M%SZ"))
+    manifest = run_backup(out_dir, args.collection, args.workers, args.chunk)
+    total = sum(c["records"] for c in manifest["collections"].values())
+    print(f"✅ Backup of {len(manifest['collections'])} nodes ({total:,} records) written to {out_dir}")
+
+
+def restore(args):
+    from backup import restore as run_restore
+
+    if not run_restore(args.path, args.collection, args.merge, args.workers, args.chunk):
+        print("⚠️  Restore incomplete; see above.")
+        return 1
+    print("ℹ️ Restored. Run rebuild-indexes, rebuild-summaries and rebuild-rollups if derived nodes were left out.")
+
+
+def index_rules(args):
+    from db_firebase import QUERY_INDEXES
+
+    # Merge into the "rules" object of the project's database rules
+    rules = {collection: {".indexOn": children} for collection, children in sorted(QUERY_INDEXES.items())}
+    print(json.dumps({"rules": rules}, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AgroTech backend maintenance commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("rebuild-indexes", help="Rebuild secondary indexes (e.g. phone -> record key) from existing data")
+    p.add_argument("--collection", help="Only rebuild indexes of this collection")
+    p.set_defaults(func=rebuild_indexes)
+
+    p = sub.add_parser("rebuild-summaries", help="Rebuild the projected summary records list endpoints read")
+    p.add_argument("--collection", help="Only rebuild summaries of this collection")
+    p.set_defaults(func=rebuild_summaries)
+
+    p = sub.add_parser("rebuild-rollups", help="Recompute the /admin/stats rollup tables (fills in field districts first)")
+    p.add_argument("--collection", help="Only rebuild rollups of this collection")
+    p.set_defaults(func=rebuild_rollups)
+
+    p = sub.add_parser("backfill-iot", help="Copy readings from the flat iot_data collection into the time-series store")
+    p.set_defaults(func=backfill_iot)
+
+    p = sub.add_parser("bench-iot-ingest", help="Measure bulk IoT ingestion throughput against the local stand-in")
+    p.add_argument("--rows", type=int, default=10000, help="Readings per batch")
+    p.add_argument("--batches", type=int, default=5)
+    p.add_argument("--fields", type=int, default=50)
+    p.set_defaults(func=bench_iot_ingest)
+
+    p = sub.add_parser("migrate-blobs", help="Move data-URI pictures/certificates out of user records into the blob store; store blob URLs as paths")
+    p.set_defaults(func=migrate_blobs)
+
+    p = sub.add_parser("backup", help="Write every top-level node to gzipped NDJSON files plus a manifest")
+    p.add_argument("--out", help="Backup directory (default: backups/<UTC timestamp>)")
+    p.add_argument("--collection", action="append", help="Only back up this top-level node (repeatable)")
+    p.add_argument("--workers", type=int, default=8, help="Key ranges read at once")
+    p.add_argument("--chunk", type=int, default=1000, help="Keys per range read")
+    p.set_defaults(func=backup)
+
+    p = sub.add_parser("restore", help="Write a backup back into the database (replaces each restored node)")
+    p.add_argument("path", help="Backup directory (holding manifest.json)")
+    p.add_argument("--collection", action="append", help="Only restore this top-level node (repeatable)")
+    p.add_argument("--merge", action="store_true", help="Write over existing data instead of replacing each node")
+    p.add_argument("--workers", type=int, default=8, help="Multi-path updates in flight")
+    p.add_argument("--chunk", type=int, default=1000, help="Records per multi-path update")
+    p.set_defaults(func=restore)
+
+    p = sub.add_parser("index-rules", help="Print the .indexOn rules needed for server-side queries")
+    p.set_defaults(func=index_rules)
+
+    args = parser.parse_args(argv)
+    initialize_firebase()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,21 @@
+import argparse
+import codecs
 import json
 import os
-from firebase_config import initialize_firebase, get_db_reference
-from db_firebase import FirebaseDatabase
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional, Tuple
 
-# Initialize Firebase
-initialize_firebase()
+from firebase_config import initialize_firebase, get_db_reference, use_local_store, CRED_PATH
+from db_firebase import FirebaseDatabase, index_key, COUNTER_ROOT
+
+# Uploads data/*.json into the Realtime Database. Each file is read incrementally and
+# written in bounded multi-path updates keyed by the records' primary keys (the dict
+# layout the adapter expects, instead of array indices). Collections upload in
+# parallel; progress is checkpointed after every chunk, so a rerun resumes where the
+# last one stopped.
 
 DATA_FILES = {
     "fields": "data/fields.json",
@@ -15,49 +26,288 @@ DATA_FILES = {
     "experts": "data/experts.json"
 }
 
-def migrate():
+CHECKPOINT_PATH = os.path.join(os.path.dirname(__file__), ".migration_checkpoint.json")
+# A chunk is flushed at whichever limit comes first; both stay far below the
+# database's per-request payload limit
+CHUNK_RECORDS = 500
+CHUNK_BYTES = 4 * 1024 * 1024
+# Characters read from a file at a time
+STREAM_BUFFER = 64 * 1024
+# Attempts per chunk before the collection is abandoned (a rerun resumes it)
+UPLOAD_ATTEMPTS = 4
+
+_WHITESPACE = " \t\r\n"
+
+
+def stream_records(path: str, offset: int = 0, buffer_size: int = STREAM_BUFFER) -> Iterator[Tuple[Optional[str], Any, int]]:
+    """
+    Values of the top-level JSON array (or object) in path, one at a time, as
+    (object key or None, value, byte offset just past the value). A non-zero offset
+    is one previously yielded: reading continues after that value.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "rb") as f:
+        head = f.read(buffer_size).decode("utf-8-sig", errors="ignore").lstrip(_WHITESPACE)
+        if not head or head[0] not in "[{":
+            raise ValueError(f"{path}: expected a JSON array or object")
+        is_object = head[0] == "{"
+
+        bom = 3 if f.seek(0) == 0 and f.read(3) == codecs.BOM_UTF8 else 0
+        f.seek(offset or bom)
+        reader = codecs.getincrementaldecoder("utf-8")()
+        buf, i, eof = "", 0, False
+        # Byte offset of buf[counted]; advanced lazily, so every character is encoded once
+        base, counted = offset or bom, 0
+        state = "sep" if offset else "open"
+        key = None
+
+        while True:
+            while i < len(buf) and buf[i] in _WHITESPACE:
+                i += 1
+            if i >= len(buf) - 1 and not eof:
+                # Refill, keeping only the unread tail
+                base += len(buf[counted:i].encode("utf-8"))
+                chunk = f.read(buffer_size)
+                eof = not chunk
+                buf, i, counted = buf[i:] + reader.decode(chunk, final=eof), 0, 0
+                continue
+            if i >= len(buf):
+                if state != "done":
+                    raise ValueError(f"{path}: truncated JSON at byte {base + len(buf[counted:].encode('utf-8'))}")
+                return
+
+            c = buf[i]
+            if state == "open":
+                i += 1
+                state = "key" if is_object else "value"
+                continue
+            if state == "done":
+                raise ValueError(f"{path}: unexpected data after the top-level value")
+            if state == "sep":
+                if c == ",":
+                    i += 1
+                    state = "key" if is_object else "value"
+                elif c == ("}" if is_object else "]"):
+                    i += 1
+                    state = "done"
+                else:
+                    raise ValueError(f"{path}: expected ',' at byte {base + len(buf[counted:i].encode('utf-8'))}")
+                continue
+            if c == ("}" if is_object else "]") and (state == "value" or state == "key"):
+                i += 1
+                state = "done"
+                continue
+            if state == "colon":
+                if c != ":":
+                    raise ValueError(f"{path}: expected ':' at byte {base + len(buf[counted:i].encode('utf-8'))}")
+                i += 1
+                state = "value"
+                continue
+
+            try:
+                value, end = decoder.raw_decode(buf, i)
+            except json.JSONDecodeError:
+                value, end = None, None
+            # A value touching the end of the buffer may continue past it (e.g. a number)
+            if end is None or (end >= len(buf) and not eof):
+                if eof:
+                    raise ValueError(f"{path}: invalid JSON at byte {base + len(buf[counted:i].encode('utf-8'))}")
+                base += len(buf[counted:i].encode("utf-8"))
+                chunk = f.read(buffer_size)
+                eof = not chunk
+                buf, i, counted = buf[i:] + reader.decode(chunk, final=eof), 0, 0
+                continue
+            if state == "key":
+                if not isinstance(value, str):
+                    raise ValueError(f"{path}: expected a key at byte {base + len(buf[counted:i].encode('utf-8'))}")
+                key, i, state = value, end, "colon"
+                continue
+            base += len(buf[counted:end].encode("utf-8"))
+            counted = i = end
+            yield (key if is_object else None), value, base
+            state = "sep"
+
+
+class Checkpoint:
+    """Per-collection progress in a JSON file, rewritten atomically after every chunk."""
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state: Dict[str, Dict[str, Any]] = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def get(self, collection: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return dict(self.state[collection]) if collection in self.state else None
+
+    def put(self, collection: str, progress: Dict[str, Any]):
+        with self.lock:
+            self.state[collection] = dict(progress)
+            if not self.path:
+                return
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp, self.path)
+
+
+def _upload(ref, chunk: Dict[str, Any]):
+    for attempt in range(UPLOAD_ATTEMPTS):
+        try:
+            ref.update(chunk)
+            return
+        except Exception as e:
+            if attempt == UPLOAD_ATTEMPTS - 1:
+                raise
+            print(f"WARNING: {ref.key}: chunk upload failed ({e}); retrying")
+            time.sleep(2 ** attempt)
+
+
+def migrate_collection(collection: str, file_path: str, checkpoint: Checkpoint,
+                       chunk_records: int = CHUNK_RECORDS, chunk_bytes: int = CHUNK_BYTES) -> Dict[str, Any]:
+    """Uploads one file; returns what was done for the throughput report."""
+    stat = os.stat(file_path)
+    source = {"size": stat.st_size, "mtime": stat.st_mtime}
+    progress = checkpoint.get(collection)
+    if progress and progress.get("source") != source:
+        print(f"⚠️  {collection}: {file_path} changed since the last run; starting over.")
+        progress = None
+    if progress and progress.get("done"):
+        return {"collection": collection, "records": 0, "bytes": 0, "seconds": 0.0, "skipped": True}
+
+    db = FirebaseDatabase(collection)
+    ref = get_db_reference(collection)
+    if progress is None:
+        # Start from an empty node, so no array-indexed records survive next to the keyed ones
+        ref.delete()
+        progress = {"source": source, "offset": 0, "records": 0, "max_id": None, "done": False}
+        checkpoint.put(collection, progress)
+    elif progress["records"]:
+        print(f"ℹ️ {collection}: resuming after {progress['records']} records")
+
+    began = time.perf_counter()
+    start_offset = progress["offset"]
+    uploaded = 0
+    chunk: Dict[str, Any] = {}
+    chunk_start = start_offset
+    position = progress["records"]
+
+    def flush(end_offset: int):
+        nonlocal chunk, chunk_start, uploaded
+        _upload(ref, chunk)
+        uploaded += len(chunk)
+        progress.update(offset=end_offset, records=progress["records"] + len(chunk))
+        checkpoint.put(collection, progress)
+        chunk, chunk_start = {}, end_offset
+
+    end_offset = start_offset
+    for key, record, end_offset in stream_records(file_path, start_offset):
+        pk = db._find_primary_key(record) if isinstance(record, dict) else None
+        if pk is None:
+            # No ID field: keep the key (or array position) it had in the file
+            pk = key if key is not None else position
+        chunk[index_key(pk)] = record
+        position += 1
+        if isinstance(pk, int) and not isinstance(pk, bool):
+            progress["max_id"] = pk if progress["max_id"] is None else max(progress["max_id"], pk)
+        if len(chunk) >= chunk_records or end_offset - chunk_start >= chunk_bytes:
+            flush(end_offset)
+    if chunk:
+        flush(end_offset)
+
+    if progress["max_id"] is not None:
+        # An existing ID counter must not hand out IDs the migrated records already use
+        max_id = progress["max_id"]
+        get_db_reference(f"{COUNTER_ROOT}/{collection}").transaction(
+            lambda current: current if current is None else max(int(current), max_id))
+    progress["done"] = True
+    checkpoint.put(collection, progress)
+    return {"collection": collection, "records": uploaded, "bytes": end_offset - start_offset,
+            "seconds": time.perf_counter() - began, "skipped": False}
+
+
+def _report(result: Dict[str, Any]):
+    if result["skipped"]:
+        print(f"ℹ️ {result['collection']}: already migrated (delete the checkpoint or use --restart to redo it)")
+        return
+    seconds = max(result["seconds"], 1e-9)
+    print(f"✅ {result['collection']}: {result['records']:,} records, {result['bytes'] / 1e6:.1f} MB in "
+          f"{result['seconds']:.2f}s ({result['records'] / seconds:,.0f} records/s, {result['bytes'] / 1e6 / seconds:.2f} MB/s)")
+
+
+def migrate(collections=None, workers: int = 4, checkpoint_path: Optional[str] = CHECKPOINT_PATH,
+            chunk_records: int = CHUNK_RECORDS, chunk_bytes: int = CHUNK_BYTES) -> bool:
+    """Migrates the given collections (default: all of DATA_FILES). Returns False if any failed."""
     print("🚀 Starting migration to Firebase...")
-    
-    for collection, filename in DATA_FILES.items():
-        file_path = os.path.join(os.path.dirname(__file__), filename)
+    checkpoint = Checkpoint(checkpoint_path)
+    jobs = {}
+    for collection in collections or DATA_FILES:
+        file_path = os.path.join(os.path.dirname(__file__), DATA_FILES[collection])
         if not os.path.exists(file_path):
-            print(f"⚠️  Skipping {collection}: File {filename} not found.")
+            print(f"⚠️  Skipping {collection}: File {DATA_FILES[collection]} not found.")
             continue
-            
-        print(f"📦 Migrating {collection}...")
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                
-            if not data:
-                print(f"   Empty data in {filename}.")
-                continue
-
-            # Use our wrapper to add items
-            # But the wrapper logic is a bit complex for bulk upload.
-            # Let's just use raw firebase-admin reference for bulk set.
-            ref = get_db_reference(collection)
-            
-            # Strategy: If the standard format is a list, likely integer IDs are preserved.
-            # If we upload a list to Firebase, it stores as array indices 0,1,2.
-            # This matches our current retrieval logic (list of objects).
-            
-            # HOWEVER, for better NoSQL, a dict is better.
-            # But changing to dict requires changing frontend/backend parsing logic potentially if it relied on list order? 
-            # Our backend routers currently return .values() or list(dict.values()) so dict storage is fine.
-            # But keeping it simple: just upload the list.
-            
-            ref.set(data)
-            print(f"✅ {collection} migrated successfully ({len(data)} items).")
-            
-        except Exception as e:
-            print(f"❌ Failed to migrate {collection}: {e}")
+        jobs[collection] = file_path
+
+    began = time.perf_counter()
+    ok = True
+    total_records = total_bytes = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="migrate") as pool:
+        futures = {c: pool.submit(migrate_collection, c, p, checkpoint, chunk_records, chunk_bytes)
+                   for c, p in jobs.items()}
+        for collection, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                ok = False
+                print(f"❌ Failed to migrate {collection}: {e} (rerun to resume)")
+                continue
+            _report(result)
+            total_records += result["records"]
+            total_bytes += result["bytes"]
 
-    print("\n🎉 Migration completed!")
+    elapsed = max(time.perf_counter() - began, 1e-9)
+    print(f"\n{'🎉 Migration completed' if ok else '⚠️  Migration incomplete'}: {total_records:,} records, "
+          f"{total_bytes / 1e6:.1f} MB in {elapsed:.2f}s ({total_records / elapsed:,.0f} records/s)")
+    if ok:
+        print("   Next: python manage.py rebuild-indexes && python manage.py rebuild-summaries && python manage.py rebuild-rollups")
+    return ok
 
-if __name__ == "__main__":
-    if not os.path.exists("serviceAccountKey.json"):
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload data/*.json into the Realtime Database")
+    parser.add_argument("--collection", action="append", choices=sorted(DATA_FILES),
+                        help="Only migrate this collection (repeatable)")
+    parser.add_argument("--workers", type=int, default=4, help="Collections uploaded at once")
+    parser.add_argument("--chunk-records", type=int, default=CHUNK_RECORDS, help="Most records per multi-path update")
+    parser.add_argument("--chunk-bytes", type=int, default=CHUNK_BYTES, help="Most source bytes per multi-path update")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Progress file used to resume")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and upload everything again")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Upload into an empty in-memory stand-in instead of Firebase (no checkpoint)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="With --dry-run: simulated seconds per database round trip")
+    args = parser.parse_args(argv)
+
+    checkpoint_path = args.checkpoint
+    if args.dry_run:
+        from local_store import LocalStore
+        use_local_store(LocalStore(latency=args.latency))
+        checkpoint_path = None
+        print("ℹ️ Dry run: writing to a local stand-in, not Firebase")
+    elif not os.path.exists(CRED_PATH):
         print("❌ Error: serviceAccountKey.json not found in backend/ directory.")
         print("   Please place your Firebase Admin SDK key here to run migration.")
+        return 1
     else:
-        migrate()
+        initialize_firebase()
+        if args.restart and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    ok = migrate(args.collection, args.workers, checkpoint_path, args.chunk_records, args.chunk_bytes)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
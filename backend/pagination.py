@@ -0,0 +1,31 @@
+from typing import Optional
+import base64
+import binascii
+
+from fastapi import HTTPException, Response
+
+# Cursor pagination shared by the list endpoints: `?limit=&after=<cursor>`, and the
+# cursor for the next page comes back in a header so response bodies stay plain lists.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(key: str) -> str:
+    """Opaque, URL-safe cursor for a storage key."""
+    return base64.urlsafe_b64encode(str(key).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[str]:
+    if not cursor:
+        return None
+    try:
+        return base64.b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def set_next_cursor(response: Response, key: Optional[str]):
+    """Adds the next-page cursor header; absent on the last page."""
+    if key is not None:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(key)
@@ -0,0 +1,203 @@
+import json
+import os
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from async_db import storage_pool
+from db_firebase import FirebaseDatabase
+
+# Expert presence, derived from /ws/status/ connections instead of clients PATCHing
+# is_online. Each worker knows its own expert sockets; workers exchange "presence"
+# envelopes through the WebSocket broker (deltas on change, a full snapshot now and
+# then), so every worker can answer is_online without a database read. The `status`
+# field is still persisted for readers of the database, in coalesced batches.
+
+# An expert socket that sent nothing (heartbeat or other) for this long is closed
+PRESENCE_IDLE_SECONDS = float(os.environ.get("AGROTECH_PRESENCE_IDLE", 90))
+# How often pending status changes are written, and idle sockets reaped
+PRESENCE_FLUSH_SECONDS = float(os.environ.get("AGROTECH_PRESENCE_FLUSH", 2))
+# How often each worker re-announces its experts; a worker silent for 3x this is presumed dead
+PRESENCE_SNAPSHOT_SECONDS = 30.0
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class PresenceRegistry:
+    """
+    In-memory presence: an expert is online while any worker holds a socket for them,
+    unless they switched themselves to unavailable.
+    """
+    def __init__(self, collection: str = "experts", worker_id: str = WORKER_ID):
+        self.db = FirebaseDatabase(collection)
+        self.worker_id = worker_id
+        self._send: Optional[Send] = None
+        # Sockets per expert on this worker
+        self._local: Dict[str, int] = {}
+        # worker -> (experts connected there, last heard from)
+        self._workers: Dict[str, Any] = {worker_id: (set(), time.monotonic())}
+        # Experts who switched themselves off (absent = available)
+        self._unavailable: Set[str] = set()
+        # Effective state last seen per expert, to detect changes
+        self._state: Dict[str, bool] = {}
+        # expert -> status to persist on the next flush
+        self._pending: Dict[str, str] = {}
+        self._last_snapshot = 0.0
+        # Called with (expert_id, online) on every change, from any worker
+        self._listeners: List[Callable[[str, bool], None]] = []
+        self.flushed = 0
+        self.flush_errors = 0
+
+    def bind(self, send: Send):
+        """send(envelope) routes presence envelopes to every worker (the broker)."""
+        self._send = send
+
+    def add_listener(self, listener: Callable[[str, bool], None]):
+        self._listeners.append(listener)
+
+    # --- Queries ---
+
+    def is_online(self, expert_id: Any) -> bool:
+        expert_id = str(expert_id)
+        if expert_id in self._unavailable:
+            return False
+        return any(expert_id in experts for experts, _ in self._workers.values())
+
+    def online_experts(self) -> List[str]:
+        online = set()
+        for experts, _ in self._workers.values():
+            online |= experts
+        return sorted(online - self._unavailable)
+
+    # --- Local events (this worker's sockets) ---
+
+    async def connected(self, expert_id: Any):
+        expert_id = str(expert_id)
+        self._local[expert_id] = self._local.get(expert_id, 0) + 1
+        if self._local[expert_id] == 1:
+            self._workers[self.worker_id][0].add(expert_id)
+            await self._announce({"add": [expert_id]})
+        await self._changed([expert_id], persist=True)
+
+    async def disconnected(self, expert_id: Any):
+        expert_id = str(expert_id)
+        count = self._local.get(expert_id, 0) - 1
+        if count > 0:
+            self._local[expert_id] = count
+            return
+        self._local.pop(expert_id, None)
+        self._workers[self.worker_id][0].discard(expert_id)
+        await self._announce({"remove": [expert_id]})
+        await self._changed([expert_id], persist=True)
+
+    async def set_available(self, expert_id: Any, available: bool):
+        """The expert's own online/offline switch (PATCH /expert/profile/ is_online)."""
+        expert_id = str(expert_id)
+        if available:
+            self._unavailable.discard(expert_id)
+        else:
+            self._unavailable.add(expert_id)
+        await self._announce({"available": {expert_id: available}})
+        await self._changed([expert_id], persist=True)
+
+    # --- Envelopes from other workers ---
+
+    async def apply(self, envelope: Dict[str, Any]):
+        worker = envelope.get("worker")
+        # Our own envelopes come back through the broker; they are already applied
+        if not worker or worker == self.worker_id:
+            return
+        touched: Set[str] = set()
+        experts, _ = self._workers.get(worker, (set(), 0.0))
+        if "snapshot" in envelope:
+            snapshot = set(map(str, envelope["snapshot"]))
+            touched |= experts ^ snapshot
+            experts = snapshot
+        for expert_id in envelope.get("add", []):
+            experts.add(str(expert_id))
+            touched.add(str(expert_id))
+        for expert_id in envelope.get("remove", []):
+            experts.discard(str(expert_id))
+            touched.add(str(expert_id))
+        self._workers[worker] = (experts, time.monotonic())
+        for expert_id, available in (envelope.get("available") or {}).items():
+            if available:
+                self._unavailable.discard(str(expert_id))
+            else:
+                self._unavailable.add(str(expert_id))
+            touched.add(str(expert_id))
+        # The worker where a change happened persists it; the others only update memory
+        await self._changed(touched, persist=False)
+
+    # --- Periodic work ---
+
+    async def tick(self):
+        """Re-announce this worker, expire dead workers and flush pending status writes."""
+        now = time.monotonic()
+        self._workers[self.worker_id] = (self._workers[self.worker_id][0], now)
+        if now - self._last_snapshot >= PRESENCE_SNAPSHOT_SECONDS:
+            self._last_snapshot = now
+            await self._announce({"snapshot": sorted(self._workers[self.worker_id][0])})
+
+        dead = [w for w, (_, seen) in self._workers.items()
+                if w != self.worker_id and now - seen > 3 * PRESENCE_SNAPSHOT_SECONDS]
+        if dead:
+            touched = set()
+            for worker in dead:
+                touched |= self._workers.pop(worker)[0]
+            # Nobody else is going to persist a dead worker's experts going offline
+            await self._changed(touched, persist=True)
+
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            # One multi-path update for every expert whose status changed since the last flush
+            await storage_pool.run(self.db.patch_many, {self._id_value(e): {"status": s} for e, s in pending.items()}, "expertID")
+            self.flushed += len(pending)
+        except Exception as e:
+            print(f"WARNING: presence flush failed ({e}); will retry")
+            self.flush_errors += 1
+            for expert_id, status in pending.items():
+                self._pending.setdefault(expert_id, status)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker": self.worker_id,
+            "workers": len(self._workers),
+            "local_experts": len(self._local),
+            "online": len(self.online_experts()),
+            "pending_writes": len(self._pending),
+            "flushed": self.flushed,
+            "flush_errors": self.flush_errors,
+        }
+
+    # --- Internals ---
+
+    async def _announce(self, fields: Dict[str, Any]):
+        if self._send is not None:
+            await self._send(dict(fields, kind="presence", worker=self.worker_id))
+
+    async def _changed(self, expert_ids, persist: bool):
+        for expert_id in expert_ids:
+            online = self.is_online(expert_id)
+            if self._state.get(expert_id) == online:
+                continue
+            self._state[expert_id] = online
+            for listener in self._listeners:
+                listener(expert_id, online)
+            if persist:
+                self._pending[expert_id] = "online" if online else "offline"
+                # Tell every connected client, in the shape the farmer app already listens for
+                if self._send is not None:
+                    text = json.dumps({"type": "status_update", "expert_id": self._id_value(expert_id), "is_online": online})
+                    await self._send({"kind": "broadcast", "text": text})
+
+    @staticmethod
+    def _id_value(expert_id: str) -> Any:
+        return int(expert_id) if expert_id.isdigit() else expert_id
@@ -0,0 +1,104 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
+import csv
+import io
+import json
+
+from async_db import storage_pool
+from db_firebase import FirebaseDatabase, get_root_ref, ROLLUP_ROOT
+from iot_store import IoTTimeSeriesStore
+
+router = APIRouter()
+
+# Records per storage read while exporting; only one chunk is held in memory at a time
+EXPORT_CHUNK = 1000
+
+IOT_COLUMNS = ["ioTDataID", "fieldID", "locationLat", "locationLng", "soilTemp", "soilMoisture",
+               "soilPH", "soilEC", "soilN", "soilP", "soilK", "createTime"]
+ADVICE_COLUMNS = ["reportId", "sourceType", "sourceId", "fieldId", "riskType", "severity",
+                  "confidence", "advices", "evidence", "createdAt"]
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+iot_export_store = IoTTimeSeriesStore()
+db_advice_export = FirebaseDatabase("advice_reports")
+
+# Tables /admin/stats returns (registered by the farmer, common and expert routers)
+STATS_ROLLUPS = ["fields_by_district_crop", "advice_by_risk_severity", "consultations_by_status"]
+
+
+def _prune_empty(node: Any) -> Any:
+    """
+    A rollup table without the groups whose measures all came back to zero. Increments
+    cannot delete a node, so a group outlives its last record until the next rebuild.
+    """
+    if not isinstance(node, dict):
+        return node
+    if node and all(isinstance(v, (int, float)) for v in node.values()):
+        return node if any(abs(v) > 1e-9 for v in node.values()) else None
+    kept = {k: _prune_empty(v) for k, v in node.items()}
+    kept = {k: v for k, v in kept.items() if v is not None}
+    return kept or None
+
+
+def _csv_cell(value: Any) -> Any:
+    # Nested values (advice lists, evidence objects) go into one cell as JSON
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+
+def _encode(rows: List[Dict[str, Any]], fmt: str, columns: List[str]) -> str:
+    if fmt == "ndjson":
+        return "".join(json.dumps(r) + "\n" for r in rows)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerows([_csv_cell(r.get(c)) for c in columns] for r in rows)
+    return out.getvalue()
+
+
+async def _stream(chunks: Iterator[List[Dict[str, Any]]], fmt: str, columns: List[str]) -> AsyncIterator[str]:
+    if fmt == "csv":
+        yield ",".join(columns) + "\r\n"
+    while True:
+        # Each chunk is a blocking storage read: pull it on the storage pool, not the event loop
+        chunk = await storage_pool.run(next, chunks, None, timeout=60)
+        if chunk is None:
+            break
+        yield _encode([r for r in chunk if isinstance(r, dict)], fmt, columns)
+
+
+def _export_response(chunks: Iterator[List[Dict[str, Any]]], fmt: str, columns: List[str], name: str) -> StreamingResponse:
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    return StreamingResponse(
+        _stream(chunks, fmt, columns),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'},
+    )
+
+
+# --- Endpoints ---
+
+@router.get("/admin/stats")
+async def get_stats():
+    """
+    Dashboard totals from the rollup tables kept up to date on writes: one read of
+    _rollups, whatever the size of the collections. Groups are nested by their keys,
+    e.g. fields_by_district_crop/<district>/<crop> -> {"fields", "acres"}.
+    """
+    tables = await storage_pool.run(get_root_ref().child(ROLLUP_ROOT).get)
+    tables = tables if isinstance(tables, dict) else {}
+    return {name: _prune_empty(tables.get(name)) or {} for name in STATS_ROLLUPS}
+
+
+@router.get("/admin/export/iot")
+async def export_iot(format: str = "ndjson", field_id: Optional[int] = None):
+    """All IoT readings (optionally one field's), oldest first per field, streamed as NDJSON or CSV."""
+    name = f"iot_field_{field_id}" if field_id is not None else "iot_data"
+    return _export_response(iot_export_store.scan(field_id, EXPORT_CHUNK), format, IOT_COLUMNS, name)
+
+
+@router.get("/admin/export/advice")
+async def export_advice(format: str = "ndjson"):
+    """All advice reports (expert and AI) in key order, streamed as NDJSON or CSV."""
+    return _export_response(db_advice_export.scan(EXPORT_CHUNK), format, ADVICE_COLUMNS, "advice_reports")
@@ -3,12 +3,20 @@ from pydantic import BaseModel
 from typing import Optional, Any
 from schemas import Farmer, Expert, UserStatus
 from datetime import datetime
-from db_firebase import FirebaseDatabase
-import base64
+from db_firebase import register_index
+from async_db import AsyncFirebaseDatabase
+from blob_store import blob_store, BLOB_FIELDS
+from routers.blobs import store_upload, externalize_files, public_files, upload_limit, UploadLimitRoute
+from routers.expert import expert_directory
 
-router = APIRouter()
-db_farmers = FirebaseDatabase("farmers")
-db_experts = FirebaseDatabase("experts")
+# UploadLimitRoute: the avatar limit is enforced while the body arrives
+router = APIRouter(route_class=UploadLimitRoute)
+# Cached like every other router: writes in this worker invalidate at once, writes in other
+# workers within CACHE_RECHECK_SECONDS (see db_firebase.ReadCache)
+db_farmers = AsyncFirebaseDatabase("farmers", cache_ttl=30)
+db_experts = AsyncFirebaseDatabase("experts", cache_ttl=30)
+
+MAX_AVATAR_BYTES = 2 * 1024 * 1024
 
 # --- Models ---
 class PhoneRequest(BaseModel):
@@ -36,17 +44,19 @@ def normalize_phone(phone: Any) -> str:
     p = str(phone).strip().replace("+88", "").replace("-", "").replace(" ", "")
     return p.lstrip("0")
 
+# Normalized phone -> record key, so auth lookups are a keyed read instead of a scan.
+# Rebuild for existing data with: python manage.py rebuild-indexes
+register_index("farmers", "phone", "farmerPhoneNumber", normalize_phone)
+register_index("experts", "phone", "expertPhoneNumber", normalize_phone)
+
 # --- Farmer Auth Endpoints ---
 
 @router.post("/auth/check-status/")
 async def check_status(req: PhoneRequest):
-    farmers = db_farmers.load()
     print(f"DEBUG: Checking status for {req.phone}")
     
-    req_phone_norm = normalize_phone(req.phone)
-    
-    # Robust matching
-    farmer = next((f for f in farmers if normalize_phone(f.get("farmerPhoneNumber")) == req_phone_norm), None)
+    # Robust matching (phone index normalizes both sides)
+    farmer = await db_farmers.find_by_index("phone", req.phone)
     
     if farmer:
         print(f"DEBUG: Found farmer {farmer.get('farmerName')}")
@@ -64,16 +74,14 @@ async def send_otp_farmer(req: PhoneRequest):
 @router.post("/auth/otp/verify/")
 async def verify_otp_farmer(req: VerifyOtpRequest):
     if req.code == "1234":
-        farmers = db_farmers.load()
-        req_phone_norm = normalize_phone(req.phone)
-        farmer_data = next((f for f in farmers if normalize_phone(f.get("farmerPhoneNumber")) == req_phone_norm), None)
+        farmer_data = await db_farmers.find_by_index("phone", req.phone)
         
         if farmer_data:
             return {
                 "action": "login",
                 "access": MOCK_TOKENS["access"],
                 "refresh": MOCK_TOKENS["refresh"],
-                "user": farmer_data,
+                "user": public_files(farmer_data, BLOB_FIELDS["farmers"]),
                 "message": "Login successful"
             }
         else:
@@ -86,8 +94,9 @@ async def verify_otp_farmer(req: VerifyOtpRequest):
 
 @router.post("/auth/register/")
 async def register_farmer(req: dict):
-    farmers = db_farmers.load()
-    new_id = len(farmers) + 1
+    new_id = await db_farmers.next_id("farmerID")
+    # The registration form sends the picture as a data URI: keep only a blob URL in the record
+    await externalize_files(req, ["profilePicture"])
     
     # Create persistent mocked user
     # In real app, proper validation required
@@ -106,7 +115,7 @@ async def register_farmer(req: dict):
         createTime=datetime.now().isoformat()
     )
     
-    db_farmers.add(new_farmer.dict())
+    await db_farmers.add(new_farmer.dict())
     
     return {
         "message": "Registration successful. Please login."
@@ -114,9 +123,7 @@ async def register_farmer(req: dict):
 
 @router.post("/auth/login/")
 async def login_farmer(req: LoginRequest):
-    farmers = db_farmers.load()
-    req_phone_norm = normalize_phone(req.phone)
-    farmer_data = next((f for f in farmers if normalize_phone(f.get("farmerPhoneNumber")) == req_phone_norm), None)
+    farmer_data = await db_farmers.find_by_index("phone", req.phone)
     
     # Match password from DB
     if farmer_data:
@@ -125,24 +132,17 @@ async def login_farmer(req: LoginRequest):
              return {
                 "access": MOCK_TOKENS["access"],
                 "refresh": MOCK_TOKENS["refresh"],
-                "user": farmer_data
+                "user": public_files(farmer_data, BLOB_FIELDS["farmers"])
             }
     
     raise HTTPException(status_code=400, detail="Invalid credentials")
 
 @router.get("/profile/")
 async def get_profile(id: str):
-    farmers = db_farmers.load()
-    # Normalize ID comparison
-    try:
-        f_id = int(id)
-    except:
-        f_id = id
-        
-    farmer_data = next((f for f in farmers if f.get("farmerID") == f_id or str(f.get("farmerID")) == str(f_id)), None)
+    farmer_data = await db_farmers.get_by_id(id, "farmerID")
     
     if farmer_data:
-        return farmer_data
+        return public_files(farmer_data, BLOB_FIELDS["farmers"])
     raise HTTPException(status_code=404, detail="User not found")
 
 @router.patch("/profile/")
@@ -156,99 +156,61 @@ async def update_profile(profile_data: dict):
     if not farmer_id:
         raise HTTPException(status_code=400, detail="Farmer ID is required")
         
-    # We need to find the key in Firebase.
-    # Since we are using FirebaseDatabase wrapper, let's use the update method IF we knew the key.
-    # Or cleaner: load all, find matching ID, update that specific item.
-    
-    farmers = db_farmers.load()
-    # Find index and object
-    target_idx = -1
-    target_farmer = None
-    
     # Check if ID is int or str in DB
     # The new farmers from JSON likely have int IDs.
     try:
         f_id = int(farmer_id)
     except:
         f_id = farmer_id # Fallback
-        
-    for i, f in enumerate(farmers):
-        if f.get("farmerID") == f_id or str(f.get("farmerID")) == str(f_id):
-            target_idx = i
-            target_farmer = f
-            break
-            
+
+    # Mappings: name->farmerName, etc.
+    changes = {}
+    if "name" in profile_data: changes["farmerName"] = profile_data["name"]
+    if "division" in profile_data: changes["farmerDivision"] = profile_data["division"]
+    if "district" in profile_data: changes["farmerDistrict"] = profile_data["district"]
+    if "upazila" in profile_data: changes["farmerUpazila"] = profile_data["upazila"]
+    if "address" in profile_data: changes["farmerAddress"] = profile_data["address"]
+    # Allow updating other fields directly if keys match (but never the ID itself)
+    for k, v in profile_data.items():
+        if k.startswith("farmer") and k != "farmerID":
+            changes[k] = v
+    await externalize_files(changes, BLOB_FIELDS["farmers"])
+
+    # Only the changed keys are written (one multi-path update, phone index kept in sync)
+    target_farmer = await db_farmers.patch(f_id, changes, "farmerID")
     if target_farmer:
-        # Update fields
-        # Mappings: name->farmerName, etc.
-        if "name" in profile_data: target_farmer["farmerName"] = profile_data["name"]
-        if "division" in profile_data: target_farmer["farmerDivision"] = profile_data["division"]
-        if "district" in profile_data: target_farmer["farmerDistrict"] = profile_data["district"]
-        if "upazila" in profile_data: target_farmer["farmerUpazila"] = profile_data["upazila"]
-        if "address" in profile_data: target_farmer["farmerAddress"] = profile_data["address"]
-        # Allow updating other fields directly if keys match
-        for k, v in profile_data.items():
-            if k.startswith("farmer"):
-                target_farmer[k] = v
-                
-        # Save back using the wrapper's update logic would be best if we had the key.
-        # But our wrapper .update(key, val, new_data) uses query.
-        # db_farmers.update("farmerID", f_id, target_farmer)
-        
-        # Let's try that:
-        success = db_farmers.update("farmerID", f_id, target_farmer)
-        if success:
-            return {
-                "message": "Profile updated successfully",
-                "user": target_farmer
-            }
+        return {
+            "message": "Profile updated successfully",
+            "user": public_files(target_farmer, BLOB_FIELDS["farmers"])
+        }
         
     raise HTTPException(status_code=404, detail="User not found")
 
 @router.post("/profile/avatar/")
+@upload_limit(MAX_AVATAR_BYTES)
 async def upload_avatar(
     file: UploadFile = File(...),
     farmer_id: str = Form(...) # We need to identify who to update
 ):
-    # 1. Read file
-    contents = await file.read()
-    
-    # 2. Check size (2MB limit for example)
-    if len(contents) > 2 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="Image too large. Max 2MB.")
-        
-    # 3. Convert to Base64
-    base64_encoded = base64.b64encode(contents).decode("utf-8")
-    mime_type = file.content_type or "image/jpeg"
-    data_uri = f"data:{mime_type};base64,{base64_encoded}"
-    
-    # 4. Update in DB
-    farmers = db_farmers.load()
-    target_idx = -1
-    target_farmer = None
+    # 1. Copy into the blob store (2MB limit: checked on Content-Length / as the body
+    #    arrives by UploadLimitRoute, then exactly on the file's bytes)
+    if not file.content_type:
+        file.content_type = "image/jpeg"
+    url = await store_upload(file, MAX_AVATAR_BYTES)
     
+    # 2. Update in DB: the record keeps only the URL
     # Match ID similar to update_profile logic
     try:
         f_id = int(farmer_id)
     except:
         f_id = farmer_id 
         
-    for i, f in enumerate(farmers):
-        if f.get("farmerID") == f_id or str(f.get("farmerID")) == str(f_id):
-            target_idx = i
-            target_farmer = f
-            break
-            
+    target_farmer = await db_farmers.patch(f_id, {"farmerProfilePicture": url}, "farmerID")
     if target_farmer:
-        target_farmer["farmerProfilePicture"] = data_uri
-        
-        # Use our updated update logic
-        success = db_farmers.update("farmerID", f_id, target_farmer)
-        if success:
-             return {
-                "message": "Avatar uploaded successfully",
-                "url": data_uri # Frontend can display this immediately
-            }
+         return {
+            "message": "Avatar uploaded successfully",
+            "url": blob_store.public_url(url) # Frontend can display this immediately
+        }
             
     raise HTTPException(status_code=404, detail="User not found")
 
@@ -258,11 +220,9 @@ async def upload_avatar(
 
 @router.post("/experts/auth/check-status/")
 async def check_expert_status(req: PhoneRequest):
-    experts = db_experts.load()
     print(f"DEBUG: Checking expert status for {req.phone}")
     
-    req_phone_norm = normalize_phone(req.phone)
-    expert = next((e for e in experts if normalize_phone(e.get("expertPhoneNumber")) == req_phone_norm), None)
+    expert = await db_experts.find_by_index("phone", req.phone)
     
     if expert:
         is_password_set = bool(expert.get("expertPassword"))
@@ -285,15 +245,10 @@ async def verify_otp_expert(req: VerifyOtpRequest):
 
 @router.post("/experts/auth/register/")
 async def register_expert(req: dict):
-    experts = db_experts.load()
-    
-    # Generate ID
-    # If list is empty, start at 1. If not, max + 1.
-    new_id = 1
-    if experts:
-        ids = [int(e.get("expertID", 0)) for e in experts if str(e.get("expertID", "0")).isdigit()]
-        if ids:
-            new_id = max(ids) + 1
+    # Picture and certificate arrive as data URIs: keep only blob URLs in the record
+    await externalize_files(req, BLOB_FIELDS["experts"])
+    # Generate ID (atomic counter, seeded from the current max on first use)
+    new_id = await db_experts.next_id("expertID")
             
     # Create Expert object
     try:
@@ -315,7 +270,8 @@ async def register_expert(req: dict):
             status=UserStatus.OFFLINE
         )
         
-        db_experts.add(new_expert.dict())
+        await db_experts.add(new_expert.dict())
+        expert_directory.upsert(new_expert.dict())
         
         return {
             "message": "Registration successful",
@@ -327,10 +283,7 @@ async def register_expert(req: dict):
 
 @router.post("/experts/auth/login/")
 async def login_expert(req: LoginRequest):
-    experts = db_experts.load()
-    req_phone_norm = normalize_phone(req.phone)
-    
-    expert = next((e for e in experts if normalize_phone(e.get("expertPhoneNumber")) == req_phone_norm), None)
+    expert = await db_experts.find_by_index("phone", req.phone)
     
     if expert:
         stored_password = expert.get("expertPassword")
@@ -0,0 +1,126 @@
+from fastapi import APIRouter, HTTPException, Request, UploadFile, File
+from fastapi.responses import FileResponse, Response
+from fastapi.routing import APIRoute
+
+from typing import Any, Callable, Dict, List, Optional
+
+from async_db import storage_pool
+from blob_store import blob_store, BlobTooLarge, MAX_BLOB_BYTES, SAFE_CONTENT_TYPES
+
+# Bytes read from an upload per step; the size limit is checked after each one
+UPLOAD_CHUNK = 64 * 1024
+# Multipart framing (boundary, part headers, other form fields) allowed on top of a file
+MULTIPART_OVERHEAD = 64 * 1024
+# Blobs never change (the URL is the content hash)
+BLOB_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def upload_limit(max_bytes: int) -> Callable:
+    """
+    Marks an endpoint's upload limit, enforced by UploadLimitRoute. Goes below the route
+    decorator (the route reads it when it is registered).
+    """
+    def mark(endpoint: Callable) -> Callable:
+        endpoint.max_upload_bytes = max_bytes
+        return endpoint
+    return mark
+
+
+class UploadLimitRoute(APIRoute):
+    """
+    Enforces upload_limit() on the raw body, before FastAPI parses the form (which spools
+    the whole file): a declared Content-Length over the limit is rejected unread, and a
+    body without one is cut off as soon as it crosses the limit.
+    """
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        max_bytes = getattr(self.endpoint, "max_upload_bytes", None)
+        if max_bytes is None:
+            return handler
+        limit = max_bytes + MULTIPART_OVERHEAD
+
+        async def limited_handler(request: Request) -> Response:
+            length = request.headers.get("content-length", "")
+            if length.isdigit() and int(length) > limit:
+                raise HTTPException(status_code=400, detail=str(BlobTooLarge(max_bytes)))
+            received = 0
+
+            async def receive():
+                nonlocal received
+                message = await request.receive()
+                if message["type"] == "http.request":
+                    received += len(message.get("body", b""))
+                    if received > limit:
+                        raise HTTPException(status_code=400, detail=str(BlobTooLarge(max_bytes)))
+                return message
+
+            return await handler(Request(request.scope, receive))
+        return limited_handler
+
+
+router = APIRouter(route_class=UploadLimitRoute)
+
+
+async def store_upload(file: UploadFile, max_bytes: int = MAX_BLOB_BYTES) -> str:
+    """
+    Copies an upload into the blob store and returns its path (what a record stores),
+    checking the exact file size as it goes. Disk writes run on the storage pool, off the
+    event loop. The request body was limited as it arrived only if the endpoint has an
+    upload_limit() and its router uses UploadLimitRoute.
+    """
+    writer = await storage_pool.run(blob_store.writer, max_bytes)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK)
+            if not chunk:
+                break
+            await storage_pool.run(writer.write, chunk)
+        digest = await storage_pool.run(writer.commit, file.content_type)
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        await storage_pool.run(writer.abort)
+        raise
+    return blob_store.url_of(digest)
+
+
+async def externalize_files(record: Dict[str, Any], keys: List[str]) -> Dict[str, Any]:
+    """
+    Moves data-URI pictures/documents in a request body into the blob store (disk I/O off
+    the loop); blob URLs sent back as responses showed them are stored as paths again.
+    """
+    try:
+        return await storage_pool.run(blob_store.externalize, record, keys)
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def public_files(record: Optional[Dict[str, Any]], keys: List[str]) -> Optional[Dict[str, Any]]:
+    """A record as responses show it: the blob paths under keys as absolute URLs (a copy)."""
+    return blob_store.public_urls(record, keys)
+
+
+# --- Endpoints ---
+
+@router.post("/blobs/")
+@upload_limit(MAX_BLOB_BYTES)
+async def upload_blob(file: UploadFile = File(...)):
+    """Generic upload (documents, certificates): returns the URL to store in a record."""
+    return {"url": blob_store.public_url(await store_upload(file))}
+
+
+@router.get("/blobs/{digest}")
+async def get_blob(digest: str, request: Request):
+    found = await storage_pool.run(blob_store.open, digest)
+    if not found:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    path, content_type = found
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": BLOB_CACHE_CONTROL, "X-Content-Type-Options": "nosniff"}
+    if content_type not in SAFE_CONTENT_TYPES:
+        # Never rendered by the browser on the API origin
+        headers["Content-Disposition"] = f'attachment; filename="{digest}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=content_type, headers=headers)
@@ -1,22 +1,35 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Response, Query
 from typing import List, Optional
 from datetime import datetime
 from schemas import AdviceReport, SourceType
-from db_firebase import FirebaseDatabase
+from db_firebase import cache_stats, register_rollup
+from async_db import AsyncFirebaseDatabase, pool_stats
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, set_next_cursor
+from routers.websocket import manager as ws_manager, advice_topic
 
 router = APIRouter()
-db_advice = FirebaseDatabase("advice_reports")
+db_advice = AsyncFirebaseDatabase("advice_reports", cache_ttl=30)
+# Advice reports per risk type and severity, for /admin/stats
+register_rollup("advice_reports", "advice_by_risk_severity",
+                lambda r: (r.get("riskType"), r.get("severity")),
+                {"reports": lambda r: 1})
 
 # --- Endpoints ---
 
 @router.get("/expert-advice/", response_model=List[dict])
-async def get_advice(field: Optional[int] = None):
-    # Filter for Expert sources
-    reports = db_advice.load()
-    expert_reports = [r for r in reports if r.get("sourceType") == SourceType.EXPERT]
-    
+async def get_advice(
+    response: Response,
+    field: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None
+):
+    # Filter for Expert sources (pages over the field's reports can come back short)
     if field:
-        expert_reports = [r for r in expert_reports if r.get("fieldId") == field]
+        reports, next_key = await db_advice.page(limit, decode_cursor(after), [("fieldId", field)])
+        expert_reports = [r for r in reports if r.get("sourceType") == SourceType.EXPERT]
+    else:
+        expert_reports, next_key = await db_advice.page(limit, decode_cursor(after), [("sourceType", SourceType.EXPERT.value)])
+    set_next_cursor(response, next_key)
         
     # Map to frontend interface
     mapped_reports = []
@@ -50,23 +63,28 @@ async def get_advice(field: Optional[int] = None):
 @router.post("/expert-advice/")
 async def post_advice(report_data: dict):
     # Accept dict to avoid validation issues on strict Enums if necessary, but ideally use Schema
-    reports = db_advice.load()
-    
     # Assign ID
-    report_data["reportId"] = len(reports) + 1
+    report_data["reportId"] = await db_advice.next_id("reportId")
     report_data["createdAt"] = datetime.now().isoformat()
     
-    db_advice.add(report_data)
+    await db_advice.add(report_data)
+    await ws_manager.publish(advice_topic(report_data.get("fieldId")), {"event": "created", "report": report_data})
     return report_data
 
 @router.get("/ai-consultations/", response_model=List[dict])
 @router.get("/ai-consultations/", response_model=List[dict])
-async def get_ai_consultations(field_id: Optional[int] = None):
-    reports = db_advice.load()
-    ai_reports = [r for r in reports if r.get("sourceType") == SourceType.AI]
-    
+async def get_ai_consultations(
+    response: Response,
+    field_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None
+):
     if field_id:
-        ai_reports = [r for r in ai_reports if r.get("fieldId") == field_id]
+        reports, next_key = await db_advice.page(limit, decode_cursor(after), [("fieldId", field_id)])
+        ai_reports = [r for r in reports if r.get("sourceType") == SourceType.AI]
+    else:
+        ai_reports, next_key = await db_advice.page(limit, decode_cursor(after), [("sourceType", SourceType.AI.value)])
+    set_next_cursor(response, next_key)
     
     # Map to frontend interface
     mapped_reports = []
@@ -80,3 +98,13 @@ async def get_ai_consultations(field_id: Optional[int] = None):
         })
         
     return mapped_reports
+
+@router.get("/metrics/storage/")
+async def get_storage_metrics():
+    # Read cache hit/miss counters (round trips saved) and storage pool queue depth
+    return {"cache": cache_stats(), "pool": pool_stats()}
+
+@router.get("/metrics/websocket/")
+async def get_websocket_metrics():
+    # Outbound queue depth per socket and messages dropped for slow clients
+    return ws_manager.stats()
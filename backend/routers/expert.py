@@ -1,142 +1,207 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Response, Query
 from typing import List
 from schemas import Expert
 # form db import JSONDatabase # Removed
-from db_firebase import FirebaseDatabase
+from async_db import AsyncFirebaseDatabase
+from db_firebase import register_summary, register_rollup
+from blob_store import BLOB_FIELDS
+from routers.blobs import externalize_files, public_files
+from routers.websocket import manager as ws_manager, presence, consultation_topic
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, set_next_cursor
+from expert_directory import ExpertDirectory, STATUSES, SORTS
+from expert_matching import ConsultationLoad, rank_experts
+import asyncio
 
 router = APIRouter()
-db_experts = FirebaseDatabase("experts")
-db_consultations = FirebaseDatabase("consultations")
+db_experts = AsyncFirebaseDatabase("experts", cache_ttl=30)
+db_consultations = AsyncFirebaseDatabase("consultations")
+# Read for matching: the field's farmer gives the area, its latest report the risk type
+db_fields = AsyncFirebaseDatabase("fields", cache_ttl=30)
+db_farmers = AsyncFirebaseDatabase("farmers", cache_ttl=30)
+db_advice = AsyncFirebaseDatabase("advice_reports", cache_ttl=30)
+
+# What the /experts/ directory shows: list pages read these instead of whole records
+# (which carry NID, password, certificate and balances)
+register_summary("experts", [
+    "expertID", "expertName", "expertSpecialization", "expertTitle", "expertBio",
+    "expertExperience", "expertRating", "status", "expertProfilePicture",
+    "expertDivision", "expertDistrict", "expertUpazila"
+])
+# Consultations per status, for /admin/stats
+register_rollup("consultations", "consultations_by_status",
+                lambda c: (str(c.get("status") or "").upper() or None,),
+                {"consultations": lambda c: 1})
+# Blob paths in directory/match items, made absolute per response
+DIRECTORY_FILES = ["profile_picture"]
+# Filterable in-memory directory built from those summaries (see expert_directory.py)
+expert_directory = ExpertDirectory(db_experts.db, presence)
+# Open consultations per expert, for load balancing in /experts/match
+consultation_load = ConsultationLoad(db_consultations.db)
 
 
 # --- Endpoints ---
 
-from typing import List, Union
+from typing import List, Optional, Union
 
 @router.get("/expert/profile/", response_model=dict)
 async def get_profile(id: Union[int, str] = None):
     # For now, return the first expert or specific if ID provided (mocking session)
-    experts = db_experts.load()
-    if not experts:
-        return {}
-    
     if id:
-         target = next((e for e in experts if e.get("expertID") == id or str(e.get("expertID")) == str(id)), None)
-         return target if target else {}
+         target = await db_experts.get_by_id(id, "expertID")
+         return public_files(target, BLOB_FIELDS["experts"]) if target else {}
 
     # Default to first one if no auth context yet (mock)
-    return experts[0] if experts else {}
+    experts = await db_experts.load()
+    return public_files(experts[0], BLOB_FIELDS["experts"]) if experts else {}
 
 @router.patch("/expert/profile/", response_model=dict)
 async def update_profile(data: dict):
-    experts = db_experts.load()
-    if not experts:
-        return {}
-        
     # Mock logged in user - in real app get from token
     # We need to identifying who to update. 
     # Attempt to find by ID in data, or fallback to first
-    target_expert = None
     target_id = data.get("expertID")
     
-    if target_id:
-         target_expert = next((e for e in experts if str(e.get("expertID")) == str(target_id)), None)
-    else:
-         target_expert = experts[0] # Fallback
-         target_id = target_expert.get("expertID")
+    if not target_id:
+         experts = await db_experts.load()
+         if not experts:
+             return {}
+         target_id = experts[0].get("expertID") # Fallback
     
-    if target_expert:
-        # Status Update Logic
-        new_status = None
-        if "is_online" in data:
-            new_status = "online" if data["is_online"] else "offline"
-            del data["is_online"]
-            
-        # Remove 'status' from data if it exists to prevent stale overwrites from frontend state
-        if "status" in data:
-            del data["status"]
-
-        # Map Frontend keys to Backend Expert Schema keys
-        key_mapping = {
-            "name": "expertName",
-            "phone": "expertPhoneNumber",
-            "email": "expertEmail",
-            "division": "expertDivision",
-            "district": "expertDistrict",
-            "upazila": "expertUpazila",
-            "address": "expertAddress",
-            "bio": "expertBio",
-            "education": "expertQualification", 
-            "experience_years": "expertExperience",
-            "profile_picture": "expertProfilePicture",
-            "avatar": "expertProfilePicture",
-            "specialization": "expertSpecialization",
-            "title": "expertTitle",
-            "affiliation": "expertAffiliation"
-        }
-        
-        for fe_key, be_key in key_mapping.items():
-            if fe_key in data:
-                data[be_key] = data[fe_key]
-                # Remove the frontend key to prevent double storage in DB
-                del data[fe_key]
-
-        # Apply updates
-        target_expert.update(data)
-        
-        # CLEANUP: Remove frontend keys from the FINAL object to be saved, 
-        # to ensure legacy duplicates are removed from the database.
-        # We aggressively clean common frontend keys that might have persisted.
-        keys_to_clean = list(key_mapping.keys()) + [
-            "rating", "reviews", 
-            "id", "password", 
-            "nid", "isVerified", "verified", 
-            "role"
-        ]
-        
-        for key in keys_to_clean:
-            if key in target_expert:
-                del target_expert[key]
+    # Online/offline switch: presence (see presence.py) decides and persists `status`
+    available = None
+    if "is_online" in data:
+        available = bool(data["is_online"])
+        del data["is_online"]
         
-        # Apply strict status update if requested
-        if new_status:
-            target_expert["status"] = new_status
-            
-        # Update in Firebase
-        # Update in Firebase
-        # Using "expertID" as the key to find the record
-        db_experts.update("expertID", target_id, target_expert)
-        return target_expert
+    # Remove 'status' from data if it exists to prevent stale overwrites from frontend state
+    if "status" in data:
+        del data["status"]
+    # Never rewrite the ID itself (frontend may send it as a string)
+    data.pop("expertID", None)
+
+    # Map Frontend keys to Backend Expert Schema keys
+    key_mapping = {
+        "name": "expertName",
+        "phone": "expertPhoneNumber",
+        "email": "expertEmail",
+        "division": "expertDivision",
+        "district": "expertDistrict",
+        "upazila": "expertUpazila",
+        "address": "expertAddress",
+        "bio": "expertBio",
+        "education": "expertQualification", 
+        "experience_years": "expertExperience",
+        "profile_picture": "expertProfilePicture",
+        "avatar": "expertProfilePicture",
+        "specialization": "expertSpecialization",
+        "title": "expertTitle",
+        "affiliation": "expertAffiliation"
+    }
     
-    return {}
+    for fe_key, be_key in key_mapping.items():
+        if fe_key in data:
+            data[be_key] = data[fe_key]
+            # Remove the frontend key to prevent double storage in DB
+            del data[fe_key]
 
-@router.get("/experts/", response_model=List[dict])
-async def get_all_experts():
-    experts = db_experts.load()
-    mapped_experts = []
+    # Pictures/certificates sent as data URIs are stored as blobs; the record keeps the URL
+    await externalize_files(data, BLOB_FIELDS["experts"])
+
+    # CLEANUP: Remove frontend keys from the stored record (None deletes the key),
+    # to ensure legacy duplicates are removed from the database.
+    # We aggressively clean common frontend keys that might have persisted.
+    keys_to_clean = list(key_mapping.keys()) + [
+        "rating", "reviews", 
+        "id", "password", 
+        "nid", "isVerified", "verified", 
+        "role"
+    ]
+    changes = dict(data)
+    for key in keys_to_clean:
+        changes[key] = None
     
-    for e in experts:
-        # Robust handling if fields missing
-        mapped_experts.append({
-            "id": str(e.get("expertID", "")),
-            "user": e.get("expertID"), 
-            "name": e.get("expertName", "Unknown"),
-            "specialization": e.get("expertSpecialization", "Agronomist"),
-            "title": e.get("expertTitle", "Expert"),
-            "bio": e.get("expertBio", ""),
-            "experience_years": e.get("expertExperience", 0),
-            "rating": e.get("expertRating", 0),
-            "is_online": e.get("status") == "online",
-            "profile_picture": e.get("expertProfilePicture")
-        })
-        
-    return mapped_experts
+    # Update in Firebase: only the changed keys, using "expertID" to find the record
+    target_expert = await db_experts.patch(target_id, changes, "expertID")
+    if target_expert:
+        expert_directory.upsert(target_expert)
+    if available is not None:
+        await presence.set_available(target_id, available)
+    if target_expert:
+        target_expert["status"] = "online" if presence.is_online(target_id) else "offline"
+    return public_files(target_expert, BLOB_FIELDS["experts"]) if target_expert else {}
+
+@router.get("/experts/", response_model=List[dict])
+async def get_all_experts(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    status: Optional[str] = None,
+    specialization: Optional[str] = None,
+    division: Optional[str] = None,
+    district: Optional[str] = None,
+    upazila: Optional[str] = None,
+    sort: str = "id"
+):
+    """
+    The expert directory, optionally filtered (case-insensitive exact matches) and sorted
+    by "id" or "rating" (highest first). Answered from memory; no database read per call.
+    """
+    if status is not None and status not in STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(STATUSES)}")
+    if sort not in SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(SORTS)}")
+
+    await expert_directory.ensure_loaded()
+    filters = {"specialization": specialization, "division": division, "district": district, "upazila": upazila}
+    try:
+        experts, next_cursor = expert_directory.query(filters, status, sort, limit, decode_cursor(after))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_next_cursor(response, next_cursor)
+
+    # Live presence, not the (lagging) stored status
+    return [dict(public_files(e, DIRECTORY_FILES), is_online=presence.is_online(e["id"])) for e in experts]
+
+@router.get("/experts/match", response_model=List[dict])
+async def match_experts(
+    fieldID: int,
+    risk_type: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=50),
+    include_offline: bool = False
+):
+    """
+    Best experts for a field: nearest to its farmer (upazila > district > division), then
+    specialists in the risk type (default: the field's latest advice report), then least
+    loaded, then highest rated. Only online experts unless include_offline is set.
+    """
+    field = await db_fields.get_by_id(fieldID, "fieldID")
+    if not field:
+        raise HTTPException(status_code=404, detail="Field not found")
+    matches = await _match(field, risk_type, limit, not include_offline)
+    return [dict(public_files(m, DIRECTORY_FILES), is_online=presence.is_online(m["id"])) for m in matches]
+
+async def _match(field: dict, risk_type: Optional[str], limit: int, online_only: bool) -> List[dict]:
+    farmer = None
+    if field.get("farmerID") is not None:
+        farmer = await db_farmers.get_by_id(field["farmerID"], "farmerID")
+    farmer = farmer or {}
+    area = {
+        "division": farmer.get("farmerDivision"),
+        "district": farmer.get("farmerDistrict"),
+        "upazila": farmer.get("farmerUpazila"),
+    }
+    if risk_type is None:
+        reports = await db_advice.query("fieldId", field.get("fieldID"))
+        if reports:
+            risk_type = max(reports, key=lambda r: str(r.get("createdAt", ""))).get("riskType")
+
+    await asyncio.gather(expert_directory.ensure_loaded(), consultation_load.ensure_loaded())
+    return rank_experts(expert_directory, consultation_load, area, risk_type, limit, online_only)
 
 @router.get("/experts/{id}/", response_model=dict)
 async def get_expert_detail(id: int):
-    experts = db_experts.load()
-    target = next((e for e in experts if e.get("expertID") == id or str(e.get("expertID")) == str(id)), None)
-    return target if target else {}
+    target = await db_experts.get_by_id(id, "expertID")
+    return public_files(target, BLOB_FIELDS["experts"]) if target else {}
 
 # --- Consultation Endpoints (Firebase) ---
 
@@ -144,15 +209,13 @@ from datetime import datetime
 
 @router.post("/consultations/", response_model=dict)
 async def create_consultation(req: dict):
-    consultations = db_consultations.load()
-    
     # Generate ID
-    new_id = len(consultations) + 1
+    new_id = await db_consultations.next_id("id")
     
     # Construct object
     new_consultation = {
         "id": new_id,
-        "expertID": req.get("expert"), # Frontend sends 'expert' (id)
+        "expertID": req.get("expert"), # Frontend sends 'expert' (id); matched below if absent
         "fieldID": req.get("field"),
         "issueType": req.get("issue_type"),
         "description": req.get("description"),
@@ -172,56 +235,62 @@ async def create_consultation(req: dict):
         }
     }
     
-    db_consultations.add(new_consultation)
+    if new_consultation["expertID"] is None and new_consultation["fieldID"] is not None:
+        field = await db_fields.get_by_id(new_consultation["fieldID"], "fieldID")
+        matches = await _match(field, None, 1, True) if field else []
+        if matches:
+            new_consultation["expertID"] = matches[0]["user"]
+
+    await db_consultations.add(new_consultation)
+    consultation_load.record(new_consultation)
+    # Push to the assigned expert's app instead of waiting for its next poll
+    await ws_manager.publish(consultation_topic(new_consultation["expertID"]),
+                             {"event": "created", "consultation": new_consultation})
     return new_consultation
 
 @router.get("/consultations/assignments", response_model=List[dict])
-async def get_consultation_assignments(expert_id: Union[int, str] = None):
+async def get_consultation_assignments(
+    response: Response,
+    expert_id: Union[int, str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None
+):
     """
-    Returns a list of consultations assigned to the 'logged in' expert.
+    Returns a page of consultations assigned to the 'logged in' expert.
     """
-    all_consultations = db_consultations.load()
-    
+    filters = None
     if expert_id:
-        # Filter by expert_id (assuming the consultation record has 'expertId' or 'expert_id')
-        # DB schema check needed? Assuming 'expertID' based on other schemas, or 'expert_id'.
-        # Let's check common.py or just be robust.
-        return [c for c in all_consultations if str(c.get("expertID")) == str(expert_id) or str(c.get("expert_id")) == str(expert_id)]
-        
-    # If no ID provided, return all (fallback for testing) or empty? 
-    # Returning all might confuse user again. Let's return empty if no ID to be strict, 
-    # OR all if truly mock mode. Let's stick to ALL for backward compat but UI will now send ID.
-    return all_consultations
+        # expertID is written as whatever the farmer app sent (int or numeric string): match both
+        filters = [("expertID", str(expert_id))]
+        if str(expert_id).isdigit():
+            filters.append(("expertID", int(expert_id)))
+
+    # If no ID provided, return all (backward compat; the UI sends the ID)
+    consultations, next_key = await db_consultations.page(limit, decode_cursor(after), filters)
+    set_next_cursor(response, next_key)
+    return consultations
 
 @router.post("/consultations/{id}/accept")
 async def accept_consultation(id: str):
-    return _update_consultation_status(id, "ACCEPTED")
+    return await _update_consultation_status(id, "ACCEPTED")
 
 @router.post("/consultations/{id}/reject")
 async def reject_consultation(id: str):
-    return _update_consultation_status(id, "REJECTED")
+    return await _update_consultation_status(id, "REJECTED")
 
 @router.post("/consultations/{id}/complete")
 async def complete_consultation(id: str):
-    return _update_consultation_status(id, "COMPLETED")
+    return await _update_consultation_status(id, "COMPLETED")
 
-def _update_consultation_status(id: str, status: str):
-    consultations = db_consultations.load()
-    target = None
-    target_idx = -1
-    
-    # ID matching logic (string vs int)
-    for i, c in enumerate(consultations):
-        if str(c.get("id")) == str(id):
-            target = c
-            target_idx = i
-            break
+async def _update_consultation_status(id: str, status: str):
+    # ID matching logic (string vs int) lives in the adapter; only 'status' is written
+    target = await db_consultations.patch(id, {"status": status}, "id")
             
     if target:
-        target["status"] = status
-        db_consultations.update("id", id, target)
+        consultation_load.record(target)
+        await ws_manager.publish(consultation_topic(target.get("expertID")),
+                                 {"event": "status", "id": target.get("id"), "status": status})
         return {"message": f"Consultation {status}", "id": id, "status": status}
         
     # If not found, return error or mock success?
     return {"message": "Consultation not found (or mocked success)", "id": id, "status": status}
-
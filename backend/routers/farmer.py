@@ -1,113 +1,230 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request, Response, Query
 from typing import List, Optional
 from datetime import datetime
 from schemas import Field, IoTData
-from db_firebase import FirebaseDatabase
+from async_db import AsyncFirebaseDatabase, AsyncStorage, storage_pool
+from db_firebase import FirebaseDatabase, register_rollup
+from iot_store import IoTTimeSeriesStore
+from iot_aggregate import IoTAggregator, BUCKETS, AGG_METRICS
+import iot_ingest
+from routers.websocket import manager as ws_manager, field_iot_topic
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, set_next_cursor
+from spatial_index import FieldSpatialIndex, parse_bbox
 
 router = APIRouter()
-db_fields = FirebaseDatabase("fields")
-db_iot = FirebaseDatabase("iot_data")
+db_fields = AsyncFirebaseDatabase("fields", cache_ttl=30)
+# Read on field creation, to copy the farmer's district onto the field
+db_farmers = AsyncFirebaseDatabase("farmers", cache_ttl=30)
+iot_store = AsyncStorage(IoTTimeSeriesStore())
+iot_aggregator = AsyncStorage(IoTAggregator(iot_store.target))
+# Counter for ioTDataID (batches reserve a whole block in one transaction)
+db_iot_ids = FirebaseDatabase("iot_data")
+
+# Largest accepted batch body (bytes)
+MAX_BATCH_BYTES = 32 * 1024 * 1024
+# Most fields /fields/within returns at once
+MAX_WITHIN_RESULTS = 10000
+
+
+def _acres(f: dict) -> float:
+    try:
+        return float(f.get("fieldArea") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+# Field count and acreage per district and crop, for /admin/stats
+register_rollup("fields", "fields_by_district_crop",
+                lambda f: (f.get("fieldDistrict"), f.get("fieldCropName")),
+                {"fields": lambda f: 1, "acres": _acres})
 
 # --- Endpoints ---
 
 @router.get("/fields/", response_model=List[dict]) # Return dicts as they come from JSON
 @router.get("/fields/", response_model=List[dict])
-async def get_fields(farmer_id: Optional[str] = None):
-    fields = db_fields.get_all()
+async def get_fields(
+    response: Response,
+    farmer_id: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None
+):
     mapped_fields = []
     
-    # Filter by farmer_id
+    # Filter by farmer_id on the database side. farmerID is usually an int, but older
+    # fields hold it as a numeric string: match both
+    filters = None
     if farmer_id:
-        try:
-            f_id = int(farmer_id)
-            fields = [f for f in fields if f.get("farmerID") == f_id or str(f.get("farmerID")) == farmer_id]
-        except:
-             fields = [f for f in fields if str(f.get("farmerID")) == farmer_id]
+        filters = [("farmerID", str(farmer_id))]
+        if str(farmer_id).isdigit():
+            filters.append(("farmerID", int(farmer_id)))
+    fields, next_key = await db_fields.page(limit, decode_cursor(after), filters)
+    set_next_cursor(response, next_key)
 
     for f in fields:
-        mapped_fields.append({
-            "id": str(f.get("fieldID")),
-            "name": f.get("fieldName"),
-            "crop_type": f.get("fieldCropName"), # Map to frontend key
-            "harvest_time": f.get("fieldCropHarvestTime"),
-            "area_in_acres": f.get("fieldArea"),
-            "boundary": f.get("fieldCoordinates"),
-            "created_at": f.get("createTime")
-        })
+        mapped_fields.append(_map_field(f))
         
     return mapped_fields
 
+def _map_field(f: dict) -> dict:
+    return {
+        "id": str(f.get("fieldID")),
+        "name": f.get("fieldName"),
+        "crop_type": f.get("fieldCropName"), # Map to frontend key
+        "harvest_time": f.get("fieldCropHarvestTime"),
+        "area_in_acres": f.get("fieldArea"),
+        "boundary": f.get("fieldCoordinates"),
+        "created_at": f.get("createTime")
+    }
+
+# Fields by location (in-memory grid over fieldCoordinates), for maps and sensor readings
+field_index = FieldSpatialIndex(db_fields.db, _map_field)
+
+@router.get("/fields/within", response_model=List[dict])
+async def get_fields_within(
+    response: Response,
+    bbox: str,
+    limit: int = Query(1000, ge=1, le=MAX_WITHIN_RESULTS)
+):
+    """Fields overlapping bbox ("min_lng,min_lat,max_lng,max_lat"), in fieldID order."""
+    try:
+        box = parse_bbox(bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await field_index.ensure_loaded()
+    fields = field_index.within(box, limit + 1)
+    if len(fields) > limit:
+        # More in view than requested: the client should zoom in (or ask for more)
+        response.headers["X-Truncated"] = "true"
+    return fields[:limit]
+
+@router.get("/fields/at", response_model=List[dict])
+async def get_fields_at(lat: float, lng: float):
+    """Fields whose boundary contains the point, e.g. a sensor reading's location."""
+    await field_index.ensure_loaded()
+    return field_index.at(lat, lng)
+
 @router.post("/fields/", response_model=Field)
 async def create_field(field_data: dict):
-    fields = db_fields.load()
-    
+    farmer_id = field_data.get("farmerID", 1) # Use provided ID or default mock
+    farmer = await db_farmers.get_by_id(farmer_id, "farmerID") or {}
     new_field = Field(
-        fieldID=len(fields) + 1,
+        fieldID=await db_fields.next_id("fieldID"),
 
-        farmerID=field_data.get("farmerID", 1), # Use provided ID or default mock
+        farmerID=farmer_id,
         fieldName=field_data.get("fieldName") or field_data.get("name", "New Field"),
         fieldCoordinates=field_data.get("fieldCoordinates") or field_data.get("boundary", []),
         fieldArea=field_data.get("fieldArea") or field_data.get("area_in_acres", 0.0),
         fieldCropName=field_data.get("fieldCropName") or field_data.get("crop_type", "Unknown"),
         fieldCropHarvestTime=field_data.get("fieldCropHarvestTime") or field_data.get("harvest_time", datetime.now().isoformat()),
-        createTime=datetime.now().isoformat()
+        createTime=datetime.now().isoformat(),
+        fieldDistrict=farmer.get("farmerDistrict")
     )
     
-    db_fields.add(new_field.dict())
+    await db_fields.add(new_field.dict())
+    field_index.upsert(new_field.dict())
     return new_field
 
 @router.delete("/fields/{field_id}/")
 async def delete_field(field_id: int):
-    # JSONDatabase doesn't have a direct delete by ID method exposed as "delete" usually
-    # But checking db.py usage, we might need to implement logic or use existing if any.
-    # Assuming standard pattern, let's load, filter, and save.
-    
-    # Wait, let's check db.py to see available methods first to be safe?
-    # Actually, I'll just look at db_fields methods by reading db.py quickly or just assume load/save pattern.
-    # To be safe and fast:
-    fields = db_fields.load()
-    fields = [f for f in fields if f.get("fieldID") != field_id]
-    db_fields.save(fields)
+    # Removes just this field's node instead of rewriting the whole collection
+    await db_fields.delete_by_id(field_id, "fieldID")
+    field_index.remove(field_id)
     return {"message": "Field deleted successfully"}
 
 @router.get("/iot/", response_model=List[dict])
-async def get_iot(field_id: Optional[str] = None):
-    iot_list = db_iot.load()
-    
-    if not iot_list:
-        return []
-        
-    filtered_data = []
+async def get_iot(
+    response: Response,
+    field_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None
+):
+    # Readings come back sorted by createTime descending (latest first);
+    # `after` continues with the readings older than the previous page's last one
+    before = decode_cursor(after)
     if field_id:
         try:
             f_id = int(field_id)
-            filtered_data = [data for data in iot_list if data.get("fieldID") == f_id]
         except ValueError:
             return []
+        # Only this field's time buckets are read (or its in-memory buffer)
+        filtered_data = await iot_store.range(f_id, since, until, limit + 1, before)
     else:
-        filtered_data = iot_list
-            
-    # Sort by createTime descending (latest first)
-    filtered_data.sort(key=lambda x: x.get("createTime", ""), reverse=True)
+        filtered_data = await iot_store.range_all(since, until, limit + 1, before)
+
+    if len(filtered_data) > limit:
+        filtered_data = filtered_data[:limit]
+        set_next_cursor(response, iot_store.target.position_of(filtered_data[-1]))
+
+    if not filtered_data:
+        return []
     
     # Map to frontend expected format (snake_case)
-    mapped_list = []
-    
-    for item in filtered_data:
-        mapped_item = {
-            "id": item.get("ioTDataID"),
-            "field": item.get("fieldID"),
-            "latitude": item.get("locationLat"),
-            "longitude": item.get("locationLng"),
-            "soil_temperature": item.get("soilTemp"),
-            "soil_moisture": item.get("soilMoisture"),
-            "soil_ph": item.get("soilPH"),
-            "soil_ec": item.get("soilEC"),
-            "nitrogen": item.get("soilN"),
-            "phosphorus": item.get("soilP"),
-            "potassium": item.get("soilK"),
-            "recorded_at": item.get("createTime")
-        }
-        mapped_list.append(mapped_item)
-        
-    return mapped_list
+    return [_map_reading(item) for item in filtered_data]
+
+def _map_reading(item: dict) -> dict:
+    return {
+        "id": item.get("ioTDataID"),
+        "field": item.get("fieldID"),
+        "latitude": item.get("locationLat"),
+        "longitude": item.get("locationLng"),
+        "soil_temperature": item.get("soilTemp"),
+        "soil_moisture": item.get("soilMoisture"),
+        "soil_ph": item.get("soilPH"),
+        "soil_ec": item.get("soilEC"),
+        "nitrogen": item.get("soilN"),
+        "phosphorus": item.get("soilP"),
+        "potassium": item.get("soilK"),
+        "recorded_at": item.get("createTime")
+    }
+
+@router.get("/iot/aggregate")
+async def aggregate_iot(
+    field_id: int,
+    bucket: str = "1h",
+    metrics: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    """min/max/mean/last per bucket (15m, 1h or 1d) for charts, instead of raw readings."""
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(BUCKETS)}")
+    metric_list = None
+    if metrics:
+        metric_list = [m.strip() for m in metrics.split(",") if m.strip()]
+        unknown = [m for m in metric_list if m not in AGG_METRICS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown metrics: {', '.join(unknown)}")
+    return await iot_aggregator.aggregate(field_id, bucket, metric_list, since, until)
+
+@router.post("/iot/batch")
+async def ingest_iot_batch(request: Request):
+    """
+    Bulk sensor upload. Body is NDJSON (one IoTData object per line) or CSV with a
+    header row (Content-Type: text/csv). ioTDataID is assigned by the server.
+    Valid rows are stored; invalid ones are reported per row and skipped.
+    """
+    body = await request.body()
+    if len(body) > MAX_BATCH_BYTES:
+        raise HTTPException(status_code=413, detail=f"Batch too large. Max {MAX_BATCH_BYTES} bytes.")
+
+    content_type = request.headers.get("content-type", "")
+    fmt = "csv" if "csv" in content_type else "ndjson"
+
+    try:
+        # Parsing, validation and the chunked writes all run off the event loop
+        result = await storage_pool.run(iot_ingest.ingest, body, fmt, iot_store.target, db_iot_ids, timeout=120)
+    except iot_ingest.BatchFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # One event per field that got readings: how many, and the newest one
+    latest = {}
+    counts = {}
+    for reading in result.pop("readings"):
+        f_id = reading["fieldID"]
+        counts[f_id] = counts.get(f_id, 0) + 1
+        if f_id not in latest or reading["createTime"] > latest[f_id]["createTime"]:
+            latest[f_id] = reading
+    for f_id, reading in latest.items():
+        await ws_manager.publish(field_iot_topic(f_id), {"event": "readings", "count": counts[f_id], "latest": _map_reading(reading)})
+    return result
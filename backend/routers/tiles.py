@@ -0,0 +1,46 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+
+from async_db import storage_pool
+from routers.farmer import field_index
+from vector_tiles import TileCache, render_tile, tile_bbox, MAX_ZOOM, TILE_BUFFER, MEDIA_TYPE
+
+router = APIRouter()
+
+# Rendered tiles, dropped as soon as a field under them is created, moved or deleted
+tile_cache = TileCache()
+field_index.add_listener(tile_cache.invalidate)
+
+# Browsers may reuse a tile briefly; the server-side cache is what stays current
+TILE_CACHE_CONTROL = "public, max-age=60"
+
+
+# --- Endpoints ---
+
+@router.get("/tiles/fields/{z}/{x}/{y}")
+async def get_field_tile(z: int, x: int, y: int, request: Request):
+    """Field boundaries of one XYZ tile as a Mapbox Vector Tile (layer "fields")."""
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    await field_index.ensure_loaded()
+
+    key = (z, x, y)
+    cached = tile_cache.get(key)
+    if cached is None:
+        generation = tile_cache.generation
+        features = field_index.features(tile_bbox(z, x, y, TILE_BUFFER))
+        # Projection, simplification and encoding run off the event loop
+        data = await storage_pool.run(render_tile, z, x, y, features, timeout=60)
+        cached = tile_cache.put(key, data, generation)
+
+    data, etag = cached
+    headers = {"ETag": etag, "Cache-Control": TILE_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=MEDIA_TYPE, headers=headers)
+
+
+@router.get("/tiles/stats")
+async def get_tile_stats():
+    return {"cache": tile_cache.stats(), "index": field_index.stats()}
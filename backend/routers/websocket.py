@@ -1,49 +1,318 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
-from typing import List, Dict
+from typing import List, Dict, Any, Optional, Set, Iterable
+import asyncio
+import json
+import os
+import re
+import time
+
+from ws_broker import create_broker
+from presence import PresenceRegistry, PRESENCE_IDLE_SECONDS, PRESENCE_FLUSH_SECONDS
 
 router = APIRouter()
 
+# Outbound messages buffered per connection before the slow-client policy applies
+WS_QUEUE_SIZE = int(os.environ.get("AGROTECH_WS_QUEUE", 100))
+# "drop_oldest": discard the oldest queued message to make room;
+# "disconnect": close the socket so the client reconnects and resyncs
+WS_SLOW_POLICY = os.environ.get("AGROTECH_WS_SLOW_POLICY", "drop_oldest")
+SLOW_POLICIES = ("drop_oldest", "disconnect")
+# Close code for clients dropped for falling behind ("try again later")
+WS_CLOSE_SLOW = 1013
+# Close code for expert sockets that stopped sending heartbeats
+WS_CLOSE_IDLE = 4408
+
+# Topics clients can subscribe to with {"action": "subscribe", "topics": [...]}
+TOPIC_RE = re.compile(r"^(consultation:[\w-]+|field:[\w-]+:iot|advice:[\w-]+)$")
+MAX_TOPICS_PER_CONNECTION = 100
+
+
+def consultation_topic(expert_id: Any) -> str:
+    """New consultations and status changes for one expert."""
+    return f"consultation:{expert_id}"
+
+
+def field_iot_topic(field_id: Any) -> str:
+    """New sensor readings of one field."""
+    return f"field:{field_id}:iot"
+
+
+def advice_topic(field_id: Any) -> str:
+    """New advice reports (expert or AI) for one field."""
+    return f"advice:{field_id}"
+
+
+class ClientConnection:
+    """
+    One socket with its bounded outbound queue and the writer task draining it,
+    so a slow client only ever delays itself.
+    """
+    def __init__(self, manager: "ConnectionManager", websocket: WebSocket, user_id: str, role: Optional[str] = None):
+        self.manager = manager
+        self.websocket = websocket
+        self.user_id = user_id
+        self.role = role
+        self.last_seen = time.monotonic()
+        # Set once this socket's presence has been released (disconnect may run twice)
+        self.presence_released = role != "expert"
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=manager.queue_size)
+        self.dropped = 0
+        self.closed = False
+        self.topics: Set[str] = set()
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, text: str) -> bool:
+        """Queues a serialized message without waiting. Returns False if the connection is (now) closed."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.manager.policy == "disconnect":
+            self.manager.slow_disconnects += 1
+            self.manager.disconnect(self.user_id, self)
+            asyncio.create_task(self._close_socket(WS_CLOSE_SLOW))
+            return False
+        self.queue.get_nowait()
+        self.queue.put_nowait(text)
+        self.dropped += 1
+        self.manager.dropped += 1
+        return True
+
+    async def _write_loop(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"WS Error: send to {self.user_id} failed ({e})")
+        finally:
+            self.manager.disconnect(self.user_id, self)
+
+    def stop(self):
+        """Stops accepting and sending messages (the socket itself is left to its owner)."""
+        self.closed = True
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
+    async def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.manager.disconnect(self.user_id, self)
+        await self._close_socket(code)
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    """
+    Sockets connected to this worker. Outgoing messages go through a broker (see
+    ws_broker.py), which hands them to every worker's manager for local delivery.
+    """
+    def __init__(self, queue_size: int = WS_QUEUE_SIZE, policy: str = WS_SLOW_POLICY, broker=None,
+                 presence: Optional[PresenceRegistry] = None):
+        if policy not in SLOW_POLICIES:
+            print(f"WARNING: unknown WebSocket slow-client policy '{policy}', using drop_oldest")
+            policy = "drop_oldest"
+        self.queue_size = queue_size
+        self.policy = policy
+        self.active_connections: Dict[str, ClientConnection] = {}
+        # topic -> connections subscribed to it
+        self.topics: Dict[str, Set[ClientConnection]] = {}
+        # Totals since start, for /metrics/websocket/
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.published = 0
+        self.broker = broker or create_broker()
+        self._broker_started = False
+        self.presence = presence
+        self._maintenance: Optional[asyncio.Task] = None
+        if presence is not None:
+            presence.bind(self._route)
+
+    async def start(self):
+        if not self._broker_started:
+            self._broker_started = True
+            await self.broker.start(self._deliver)
+            if self.presence is not None:
+                self._maintenance = asyncio.create_task(self._maintenance_loop())
+
+    async def stop(self):
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            self._maintenance = None
+        if self.presence is not None:
+            await self.presence.flush()
+        await self.broker.stop()
+        self._broker_started = False
+
+    async def _maintenance_loop(self):
+        while True:
+            await asyncio.sleep(PRESENCE_FLUSH_SECONDS)
+            try:
+                self.reap_idle()
+                await self.presence.tick()
+            except Exception as e:
+                print(f"WARNING: WebSocket maintenance failed ({e})")
+
+    def reap_idle(self, idle_seconds: float = PRESENCE_IDLE_SECONDS):
+        """Closes expert sockets that have not sent anything (heartbeats) for idle_seconds."""
+        cutoff = time.monotonic() - idle_seconds
+        for connection in list(self.active_connections.values()):
+            if connection.role == "expert" and connection.last_seen < cutoff:
+                asyncio.create_task(connection.close(WS_CLOSE_IDLE))
 
-    async def connect(self, websocket: WebSocket, user_id: str):
+    async def _route(self, envelope: Dict[str, Any]):
+        await self.start()
+        await self.broker.publish(envelope)
+
+    async def _deliver(self, envelope: Dict[str, Any]):
+        """Hands a brokered message to the matching sockets of this worker."""
+        kind = envelope.get("kind")
+        text = envelope.get("text")
+        if kind == "presence":
+            if self.presence is not None:
+                await self.presence.apply(envelope)
+            return
+        if kind == "user":
+            targets = [self.active_connections.get(str(envelope.get("user_id")))]
+        elif kind == "topic":
+            targets = list(self.topics.get(envelope.get("topic"), ()))
+        elif kind == "broadcast":
+            targets = list(self.active_connections.values())
+        else:
+            return
+        for connection in targets:
+            if connection is not None:
+                connection.enqueue(text)
+
+    async def connect(self, websocket: WebSocket, user_id: str, role: Optional[str] = None) -> ClientConnection:
         await websocket.accept()
-        self.active_connections[user_id] = websocket
+        previous = self.active_connections.get(user_id)
+        connection = ClientConnection(self, websocket, user_id, role)
+        self.active_connections[user_id] = connection
+        if role == "expert" and self.presence is not None:
+            await self.presence.connected(user_id)
+        if previous is not None:
+            # Same user reconnected (e.g. a reloaded tab): the new socket wins
+            await previous.close()
+        return connection
 
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
+    def disconnect(self, user_id: str, connection: Optional[ClientConnection] = None):
+        # Only forget the socket that actually went away, not a newer one for the same user
+        current = self.active_connections.get(user_id)
+        if current is not None and (connection is None or current is connection):
             del self.active_connections[user_id]
+        target = connection or current
+        if target is not None:
+            target.stop()
+            self.unsubscribe(target, list(target.topics))
+            if not target.presence_released:
+                target.presence_released = True
+                if self.presence is not None:
+                    asyncio.create_task(self.presence.disconnected(target.user_id))
+
+    def subscribe(self, connection: ClientConnection, topics: Iterable[str]) -> List[str]:
+        """Adds valid topics to the connection's subscriptions. Returns the ones accepted."""
+        accepted = []
+        for topic in topics:
+            if not isinstance(topic, str) or not TOPIC_RE.match(topic):
+                continue
+            if topic not in connection.topics and len(connection.topics) >= MAX_TOPICS_PER_CONNECTION:
+                break
+            connection.topics.add(topic)
+            self.topics.setdefault(topic, set()).add(connection)
+            accepted.append(topic)
+        return accepted
+
+    def unsubscribe(self, connection: ClientConnection, topics: Iterable[str]):
+        for topic in topics:
+            connection.topics.discard(topic)
+            subscribers = self.topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self.topics[topic]
+
+    async def publish(self, topic: str, payload: dict):
+        """Sends an event to every connection subscribed to topic, in any worker (serialized once)."""
+        self.published += 1
+        text = json.dumps({"type": "event", "topic": topic, "payload": payload}, default=str)
+        await self._route({"kind": "topic", "topic": topic, "text": text})
+
+    def handle_command(self, connection: ClientConnection, data: str):
+        """Client -> server messages: subscribe/unsubscribe; anything else (heartbeats) just marks the socket alive."""
+        connection.last_seen = time.monotonic()
+        try:
+            command = json.loads(data)
+        except ValueError:
+            return
+        if not isinstance(command, dict):
+            return
+        action = command.get("action")
+        topics = command.get("topics") or []
+        if isinstance(topics, str):
+            topics = [topics]
+        if action == "subscribe":
+            accepted = self.subscribe(connection, topics)
+            connection.enqueue(json.dumps({"type": "subscribed", "topics": accepted}))
+        elif action == "unsubscribe":
+            self.unsubscribe(connection, topics)
+            connection.enqueue(json.dumps({"type": "unsubscribed", "topics": topics}))
 
     async def send_personal_message(self, message: dict, user_id: str):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_json(message)
+        # The user's socket may be held by another worker
+        await self._route({"kind": "user", "user_id": str(user_id), "text": json.dumps(message)})
 
     async def broadcast(self, message: dict):
-        for connection in self.active_connections.values():
-            await connection.send_json(message)
+        # Serialized once; each writer task sends it at its own pace
+        await self._route({"kind": "broadcast", "text": json.dumps(message)})
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [c.queue.qsize() for c in self.active_connections.values()]
+        return {
+            "connections": len(depths),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_size": self.queue_size,
+            "policy": self.policy,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "topics": len(self.topics),
+            "subscriptions": sum(len(s) for s in self.topics.values()),
+            "published": self.published,
+            "broker": self.broker.stats(),
+            "presence": self.presence.stats() if self.presence is not None else None,
+        }
 
-manager = ConnectionManager()
+presence = PresenceRegistry()
+manager = ConnectionManager(presence=presence)
 
 @router.websocket("/ws/status/")
-async def websocket_endpoint(websocket: WebSocket, user_id: str = Query(...)):
-    await manager.connect(websocket, user_id)
+async def websocket_endpoint(websocket: WebSocket, user_id: str = Query(...), role: Optional[str] = None):
+    # role=expert: this socket makes the expert online (see presence.py); expert clients
+    # send {"action": "heartbeat"} at least every PRESENCE_IDLE_SECONDS
+    connection = await manager.connect(websocket, user_id, role)
     try:
-        # Send a welcome message or initial status
-        await manager.send_personal_message(
-            {
-                "type": "notification", 
-                "payload": {"message": "Connected to Mock Notification Service"}
-            }, 
-            user_id
-        )
+        # Send a welcome message or initial status (this socket is local: no broker hop)
+        connection.enqueue(json.dumps({
+            "type": "notification",
+            "payload": {"message": "Connected to Mock Notification Service"}
+        }))
         while True:
-            # Keep connection open and listen for messages (ack or ping)
+            # Keep connection open and listen for messages (subscriptions, pings)
             data = await websocket.receive_text()
-            # Echo back or handle commands if needed
-            # For now just keep alive
+            manager.handle_command(connection, data)
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, connection)
     except Exception as e:
         print(f"WS Error: {e}")
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, connection)
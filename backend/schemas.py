@@ -106,6 +106,7 @@ class Field(BaseModel):
     fieldCropName: str
     fieldCropHarvestTime: Union[str, datetime]
     createTime: Union[str, datetime]
+    fieldDistrict: Optional[str] = None # Copied from the farmer at creation, for per-district totals
 
 class IoTData(BaseModel):
     ioTDataID: int
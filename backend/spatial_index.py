@@ -0,0 +1,269 @@
+import asyncio
+import math
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from async_db import storage_pool
+from db_firebase import FirebaseDatabase
+
+# Field boundaries in a uniform grid, in memory: each field is listed in every cell its
+# bounding box overlaps, so a bounding-box or point query only looks at the fields of
+# the cells it touches. Creates/deletes in this worker apply immediately; other workers'
+# writes arrive with the next periodic reload.
+
+# Cell size in degrees (~1.1 km of latitude); fields are a few acres, so most sit in one cell
+GRID_CELL_DEGREES = float(os.environ.get("AGROTECH_GRID_CELL", 0.01))
+# Seconds between background reloads from the database
+SPATIAL_REFRESH_SECONDS = float(os.environ.get("AGROTECH_SPATIAL_REFRESH", 300))
+# A field covering more cells than this (bad coordinates, huge estates) is kept out of
+# the grid and checked by every query instead
+MAX_CELLS_PER_FIELD = 4096
+
+BBox = Tuple[float, float, float, float]  # (min_lng, min_lat, max_lng, max_lat)
+Ring = List[Tuple[float, float]]  # (lng, lat) vertices
+
+
+def polygon_of(coordinates: Any) -> Ring:
+    """(lng, lat) vertices of fieldCoordinates ([{"lat", "lng"}, ...]); malformed points are skipped."""
+    ring = []
+    for point in coordinates or []:
+        try:
+            if isinstance(point, dict):
+                ring.append((float(point["lng"]), float(point["lat"])))
+            else:
+                ring.append((float(point[1]), float(point[0])))
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+    return ring
+
+
+def bbox_of(ring: Ring) -> Optional[BBox]:
+    if not ring:
+        return None
+    lngs = [p[0] for p in ring]
+    lats = [p[1] for p in ring]
+    return (min(lngs), min(lats), max(lngs), max(lats))
+
+
+def parse_bbox(value: str) -> BBox:
+    """"min_lng,min_lat,max_lng,max_lat" -> BBox. Raises ValueError."""
+    parts = [float(v) for v in value.split(",")]
+    if len(parts) != 4 or not all(math.isfinite(v) for v in parts):
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat")
+    min_lng, min_lat, max_lng, max_lat = parts
+    if min_lng > max_lng or min_lat > max_lat:
+        raise ValueError("bbox minimums must not exceed maximums")
+    return (min_lng, min_lat, max_lng, max_lat)
+
+
+def intersects(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def contains_point(ring: Ring, lng: float, lat: float) -> bool:
+    """Even-odd ray casting; points on the boundary may land either way."""
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i]
+        xj, yj = ring[j]
+        if (yi > lat) != (yj > lat) and lng < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+class _Grid:
+    def __init__(self, cell: float):
+        self.cell = cell
+        # field key -> (bbox, ring, entry)
+        self.fields: Dict[str, Tuple[BBox, Ring, Dict[str, Any]]] = {}
+        self.cells: Dict[Tuple[int, int], Set[str]] = {}
+        self.oversized: Set[str] = set()
+
+    def cell_range(self, bbox: BBox) -> Tuple[int, int, int, int]:
+        c = self.cell
+        return (math.floor(bbox[0] / c), math.floor(bbox[1] / c), math.floor(bbox[2] / c), math.floor(bbox[3] / c))
+
+    def add(self, key: str, ring: Ring, entry: Dict[str, Any]):
+        bbox = bbox_of(ring)
+        if bbox is None:
+            return
+        self.fields[key] = (bbox, ring, entry)
+        x0, y0, x1, y1 = self.cell_range(bbox)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_CELLS_PER_FIELD:
+            self.oversized.add(key)
+            return
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                self.cells.setdefault((x, y), set()).add(key)
+
+    def remove(self, key: str):
+        found = self.fields.pop(key, None)
+        if found is None:
+            return
+        if key in self.oversized:
+            self.oversized.discard(key)
+            return
+        x0, y0, x1, y1 = self.cell_range(found[0])
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                keys = self.cells.get((x, y))
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.cells[(x, y)]
+
+    def candidates(self, bbox: BBox) -> Iterator[Set[str]]:
+        """Keys of the fields listed in the cells bbox touches, cell by cell (a key may repeat)."""
+        if self.oversized:
+            yield self.oversized
+        x0, y0, x1, y1 = self.cell_range(bbox)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # Wide query: walking the occupied cells is cheaper than probing every cell
+            for (x, y), keys in self.cells.items():
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    yield keys
+            return
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                keys = self.cells.get((x, y))
+                if keys:
+                    yield keys
+
+    def query(self, bbox: BBox, limit: Optional[int] = None) -> List[str]:
+        """Keys of the fields whose bbox intersects bbox; stops once `limit` are found."""
+        found: Set[str] = set()
+        for keys in self.candidates(bbox):
+            for key in keys:
+                if key not in found and intersects(self.fields[key][0], bbox):
+                    found.add(key)
+                    if limit is not None and len(found) >= limit:
+                        return list(found)
+        return list(found)
+
+
+class FieldSpatialIndex:
+    """
+    Fields by location. `to_entry` maps a field record to what queries return (kept per
+    field, so results need no further mapping).
+    """
+    def __init__(self, db: FirebaseDatabase, to_entry: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 cell: float = GRID_CELL_DEGREES, refresh_seconds: float = SPATIAL_REFRESH_SECONDS):
+        self.db = db
+        self.to_entry = to_entry
+        self.cell = cell
+        self.refresh_seconds = refresh_seconds
+        self._grid = _Grid(cell)
+        self._loaded_at: Optional[float] = None
+        self._loading: Optional[asyncio.Task] = None
+        # Writes made while a reload is reading, re-applied on top of it: (key, record or None)
+        self._replay: List[Tuple[str, Optional[Dict[str, Any]]]] = []
+        # Called with the bboxes (before and after) of fields that changed, e.g. to drop cached tiles
+        self._listeners: List[Callable[[List[BBox]], None]] = []
+
+    def add_listener(self, listener: Callable[[List[BBox]], None]):
+        self._listeners.append(listener)
+
+    async def ensure_loaded(self):
+        """Loads the index on first use; afterwards reloads it in the background when stale."""
+        if self._loaded_at is None:
+            if self._loading is None:
+                self._loading = asyncio.create_task(self.reload())
+            await asyncio.shield(self._loading)
+        elif time.monotonic() - self._loaded_at > self.refresh_seconds and self._loading is None:
+            self._loading = asyncio.create_task(self.reload())
+
+    async def reload(self):
+        self._replay = []
+        try:
+            grid = await storage_pool.run(self._build, timeout=300)
+            previous, self._grid = self._grid, grid
+            for key, record in self._replay:
+                self._apply(key, record)
+            if self._loaded_at is not None:
+                # Fields written by other workers since the last load
+                self._notify(self._changed_between(previous, grid))
+            self._loaded_at = time.monotonic()
+        finally:
+            self._replay = []
+            self._loading = None
+
+    def _build(self) -> _Grid:
+        grid = _Grid(self.cell)
+        for chunk in self.db.scan():
+            for record in chunk:
+                if isinstance(record, dict) and record.get("fieldID") is not None:
+                    grid.add(str(record["fieldID"]), polygon_of(record.get("fieldCoordinates")), self.to_entry(record))
+        return grid
+
+    @staticmethod
+    def _changed_between(old: _Grid, new: _Grid) -> List[BBox]:
+        changed = []
+        for key in old.fields.keys() | new.fields.keys():
+            a, b = old.fields.get(key), new.fields.get(key)
+            if a is None or b is None or a[1] != b[1] or a[2] != b[2]:
+                changed.extend(found[0] for found in (a, b) if found is not None)
+        return changed
+
+    def upsert(self, record: Dict[str, Any]):
+        """Applies a created or updated field record (call after writing it)."""
+        if record.get("fieldID") is None:
+            return
+        self._write(str(record["fieldID"]), record)
+
+    def remove(self, field_id: Any):
+        self._write(str(field_id), None)
+
+    def _write(self, key: str, record: Optional[Dict[str, Any]]):
+        if self._loading is not None:
+            self._replay.append((key, record))
+        self._notify(self._apply(key, record))
+
+    def _apply(self, key: str, record: Optional[Dict[str, Any]]) -> List[BBox]:
+        """Updates the grid; returns the field's bboxes before and after."""
+        touched = []
+        old = self._grid.fields.get(key)
+        if old is not None:
+            touched.append(old[0])
+        self._grid.remove(key)
+        if record is not None:
+            self._grid.add(key, polygon_of(record.get("fieldCoordinates")), self.to_entry(record))
+            new = self._grid.fields.get(key)
+            if new is not None:
+                touched.append(new[0])
+        return touched
+
+    def _notify(self, bboxes: List[BBox]):
+        if bboxes:
+            for listener in self._listeners:
+                listener(bboxes)
+
+    def within(self, bbox: BBox, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Fields whose bounding box intersects bbox, in fieldID order. With a limit, a wide
+        bbox returns the first `limit` fields found, not the lowest IDs.
+        """
+        fields = self._grid.fields
+        keys = self._grid.query(bbox, limit)
+        keys.sort(key=lambda k: (0, int(k)) if k.isdigit() else (1, k))
+        return [fields[k][2] for k in keys]
+
+    def features(self, bbox: BBox) -> List[Tuple[BBox, Ring, Dict[str, Any]]]:
+        """(bbox, ring, entry) of every field intersecting bbox, unordered and unlimited."""
+        fields = self._grid.fields
+        return [fields[k] for k in self._grid.query(bbox)]
+
+    def at(self, lat: float, lng: float) -> List[Dict[str, Any]]:
+        """Fields whose polygon contains the point (usually one)."""
+        fields = self._grid.fields
+        return [fields[k][2] for k in sorted(self._grid.query((lng, lat, lng, lat)))
+                if contains_point(fields[k][1], lng, lat)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "fields": len(self._grid.fields),
+            "cells": len(self._grid.cells),
+            "loaded_seconds_ago": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+        }
@@ -0,0 +1,40 @@
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_db import AsyncStorage, StorageTimeout
+
+
+class Slow:
+    def __init__(self):
+        self.done = threading.Event()
+
+    def write(self, seconds):
+        threading.Event().wait(seconds)
+        self.done.set()
+        return "written"
+
+
+class TimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.slow = Slow()
+        self.storage = AsyncStorage(self.slow, timeout=0.05)
+
+    def test_facade_timeout_applies_by_default(self):
+        with self.assertRaises(StorageTimeout) as caught:
+            asyncio.run(self.storage.write(0.3))
+        # Already running: it cannot be stopped and completes afterwards
+        self.assertTrue(caught.exception.still_running)
+        self.assertTrue(self.slow.done.wait(2))
+
+    def test_none_and_zero_disable_the_timeout(self):
+        self.assertEqual(asyncio.run(self.storage.write(0.1, timeout=None)), "written")
+        self.assertEqual(asyncio.run(self.storage.write(0.1, timeout=0)), "written")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from blob_store import blob_store, LocalBlobStore, MAX_BLOB_BYTES
+from routers import blobs
+from routers.blobs import MULTIPART_OVERHEAD
+
+
+class UrlTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = LocalBlobStore(tmp.name, "https://api.example.org/api/v1/blobs")
+        self.digest = "ab" * 32
+
+    def test_records_store_a_path_and_responses_an_absolute_url(self):
+        stored = self.store.store_data_uri("data:image/png;base64,iVBORw0K")
+        self.assertTrue(stored.startswith("/api/v1/blobs/"))
+        self.assertEqual(self.store.public_url(stored), "https://api.example.org" + stored)
+
+    def test_old_absolute_urls_follow_the_configured_host(self):
+        old = f"http://127.0.0.1:8000/api/v1/blobs/{self.digest}"
+        self.assertEqual(self.store.public_url(old), f"https://api.example.org/api/v1/blobs/{self.digest}")
+        record = {"pic": old}
+        self.store.externalize(record, ["pic"])
+        self.assertEqual(record, {"pic": f"/api/v1/blobs/{self.digest}"})
+
+    def test_other_urls_are_left_alone(self):
+        record = {"pic": "https://cdn.example.org/a.png", "name": "x"}
+        self.assertEqual(self.store.public_urls(record, ["pic"]), record)
+
+
+class ServeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root, blob_store.root = blob_store.root, self.tmp.name
+        self.addCleanup(setattr, blob_store, "root", self.root)
+        app = FastAPI()
+        app.include_router(blobs.router, prefix="/api/v1")
+        self.client = TestClient(app)
+
+    def upload(self, data, content_type):
+        response = self.client.post("/api/v1/blobs/", files={"file": ("f", data, content_type)})
+        self.assertEqual(response.status_code, 200)
+        url = response.json()["url"]
+        self.assertTrue(url.startswith("http"))
+        return url.rsplit("/", 1)[1]
+
+    def test_raster_image_is_served_inline(self):
+        digest = self.upload(b"\x89PNG fake", "image/png")
+        response = self.client.get(f"/api/v1/blobs/{digest}")
+        self.assertEqual(response.headers["content-type"], "image/png")
+        self.assertEqual(response.headers["x-content-type-options"], "nosniff")
+        self.assertNotIn("content-disposition", response.headers)
+
+    def test_html_and_svg_are_served_as_attachments(self):
+        for data, content_type in [(b"<script>alert(1)</script>", "text/html"),
+                                   (b"<svg onload='alert(1)'/>", "image/svg+xml")]:
+            digest = self.upload(data, content_type)
+            response = self.client.get(f"/api/v1/blobs/{digest}")
+            self.assertEqual(response.headers["content-type"], "application/octet-stream")
+            self.assertTrue(response.headers["content-disposition"].startswith("attachment"))
+            self.assertEqual(response.headers["x-content-type-options"], "nosniff")
+
+    def test_declared_oversize_upload_is_rejected_unread(self):
+        body = b"x" * (MAX_BLOB_BYTES + MULTIPART_OVERHEAD + 1)
+        response = self.client.post("/api/v1/blobs/", content=body,
+                                    headers={"content-type": "multipart/form-data; boundary=b"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("too large", response.json()["detail"])
+
+    def test_undeclared_oversize_upload_is_cut_off(self):
+        def body():
+            for _ in range((MAX_BLOB_BYTES + MULTIPART_OVERHEAD) // 65536 + 2):
+                yield b"x" * 65536
+        response = self.client.post("/api/v1/blobs/", content=body(),
+                                    headers={"content-type": "multipart/form-data; boundary=b"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("too large", response.json()["detail"])
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_unsafe_sidecar_from_before_the_whitelist_is_ignored(self):
+        digest = blob_store.put(b"<html></html>")
+        with open(blob_store.path_of(digest) + ".type", "w") as f:
+            f.write("text/html")
+        self.assertEqual(blob_store.open(digest)[1], "application/octet-stream")
+
+    def test_data_uri_type_is_whitelisted_too(self):
+        url = blob_store.store_data_uri("data:text/html;base64,PGgxPng8L2gxPg==")
+        digest = url.rsplit("/", 1)[1]
+        self.assertEqual(blob_store.open(digest)[1], "application/octet-stream")
+
+
+if __name__ == "__main__":
+    unittest.main()
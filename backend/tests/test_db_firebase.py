@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import firebase_config
+import db_firebase
+from local_store import LocalStore
+from db_firebase import FirebaseDatabase
+
+
+class LegacyKeyedRecordsTest(unittest.TestCase):
+    """Consultations stored under their fieldID, before PRIMARY_KEYS made `id` the key."""
+    def setUp(self):
+        firebase_config.use_local_store(LocalStore())
+        db_firebase._root_ref = None
+        db_firebase._layout_state.clear()
+        firebase_config.get_db_reference("consultations").set({
+            "5": {"id": 12, "fieldID": 5, "status": "PENDING"},
+            "7": {"id": 5, "fieldID": 7, "status": "PENDING"},
+        })
+        self.db = FirebaseDatabase("consultations")
+
+    def test_found_by_primary_key(self):
+        self.assertEqual(self.db.get_by_id(12)["fieldID"], 5)
+        self.assertEqual(self.db.get_by_id("5")["fieldID"], 7)
+        self.assertIsNone(self.db.get_by_id(99))
+
+    def test_patched_in_place(self):
+        self.assertEqual(self.db.patch(12, {"status": "ACCEPTED"})["status"], "ACCEPTED")
+        self.assertEqual(self.db.patch_many({5: {"status": "REJECTED"}}), 1)
+        stored = firebase_config.get_db_reference("consultations").get()
+        self.assertEqual((stored["5"]["status"], stored["7"]["status"]), ("ACCEPTED", "REJECTED"))
+
+    def test_new_records_are_keyed_by_primary_key(self):
+        self.db.add({"id": 13, "fieldID": 5, "status": "PENDING"})
+        self.assertEqual(self.db.get_by_id(13)["id"], 13)
+        self.assertEqual(firebase_config.get_db_reference("consultations/13").get()["id"], 13)
+
+
+if __name__ == "__main__":
+    unittest.main()
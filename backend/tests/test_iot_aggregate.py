@@ -0,0 +1,90 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import firebase_config
+from local_store import LocalStore
+from iot_store import IoTTimeSeriesStore
+from iot_aggregate import IoTAggregator, summarize
+
+
+class SummarizeTest(unittest.TestCase):
+    def test_min_max_mean_last_per_bucket(self):
+        rows = [
+            {"createTime": "2026-01-01T10:50:00", "soilPH": 7.0, "soilN": 10},
+            {"createTime": "2026-01-01T10:05:00", "soilPH": 6.0},
+            {"createTime": "2026-01-01T10:20:00", "soilPH": 5.0, "soilN": "n/a"},
+            {"createTime": "2026-01-01T11:00:00", "soilPH": 8.0},
+            {"createTime": "garbage", "soilPH": 1.0},
+        ]
+        out = summarize(rows, 3600)
+        ten, eleven = sorted(out)
+        self.assertEqual(eleven - ten, 3600)
+        self.assertEqual(out[ten]["count"], 3)
+        self.assertEqual(out[ten]["soilPH"], {"min": 5.0, "max": 7.0, "mean": 6.0, "last": 7.0})
+        self.assertEqual(out[ten]["soilN"], {"min": 10.0, "max": 10.0, "mean": 10.0, "last": 10.0})
+        self.assertIsNone(out[ten]["soilK"])
+        self.assertEqual(out[eleven]["soilPH"]["last"], 8.0)
+
+
+class AggregateCacheTest(unittest.TestCase):
+    def setUp(self):
+        firebase_config.use_local_store(LocalStore())
+        self.store = IoTTimeSeriesStore()
+        self.aggregator = IoTAggregator(self.store)
+        self.store.add_many([
+            {"ioTDataID": i, "fieldID": 1, "soilPH": 6.0, "createTime": t}
+            for i, t in enumerate(["2026-01-01T10:05:00", "2026-01-01T10:10:00", "2026-01-01T10:45:00"], 1)
+        ])
+
+    def counts(self, until):
+        result = self.aggregator.aggregate(1, "1h", since=datetime(2026, 1, 1, 9), until=until)
+        return [b["count"] for b in result["buckets"]]
+
+    def test_bucket_cut_off_by_until_is_not_cached(self):
+        self.assertEqual(self.counts(datetime(2026, 1, 1, 10, 30)), [2])
+        self.assertEqual(self.counts(datetime(2026, 1, 1, 12, 0)), [3])
+
+    def test_completed_buckets_are_not_read_again(self):
+        self.counts(datetime(2026, 1, 1, 12, 0))
+        reads = []
+        original = self.store.range
+        self.store.range = lambda *a, **k: reads.append(k["since"]) or original(*a, **k)
+        self.assertEqual(self.counts(datetime(2026, 1, 1, 12, 0)), [3])
+        # Only the bucket cut off by until (12:00-13:00) is read again
+        self.assertEqual(reads, [datetime(2026, 1, 1, 12, 0)])
+
+    def test_late_reading_from_another_worker_invalidates_a_cached_bucket(self):
+        self.assertEqual(self.counts(datetime(2026, 1, 1, 12, 0)), [3])
+        # Another process: its writes never pass through this store object
+        IoTTimeSeriesStore().add({"ioTDataID": 9, "fieldID": 1, "soilPH": 7.0, "createTime": "2026-01-01T10:50:00"})
+        self.assertEqual(self.counts(datetime(2026, 1, 1, 12, 0)), [4])
+
+    def test_backfilled_reading_invalidates_a_cached_bucket(self):
+        self.assertEqual(self.counts(datetime(2026, 1, 1, 12, 0)), [3])
+        IoTTimeSeriesStore().backfill([{"ioTDataID": 9, "fieldID": 1, "soilPH": 7.0, "createTime": "2026-01-01T10:20:00"}])
+        self.assertEqual(self.counts(datetime(2026, 1, 1, 12, 0)), [4])
+
+    def test_other_days_stay_cached(self):
+        self.counts(datetime(2026, 1, 1, 12, 0))
+        cached = dict(self.aggregator._cache)
+        IoTTimeSeriesStore().add({"ioTDataID": 9, "fieldID": 1, "soilPH": 7.0, "createTime": "2026-01-02T10:20:00"})
+        self.assertEqual(self.counts(datetime(2026, 1, 1, 12, 0)), [3])
+        self.assertEqual(dict(self.aggregator._cache), cached)
+
+    def test_completed_bucket_is_not_computed_from_a_lagging_buffer(self):
+        now = datetime.now().replace(microsecond=0)
+        hour = now.replace(minute=0, second=0) - timedelta(hours=1)
+        self.store.add({"ioTDataID": 10, "fieldID": 2, "soilPH": 6.0, "createTime": hour.isoformat()})
+        self.store.latest(2, 10)  # buffer synced: trusted for BUFFER_TTL seconds
+        IoTTimeSeriesStore().add({"ioTDataID": 11, "fieldID": 2, "soilPH": 6.0,
+                                  "createTime": (hour + timedelta(minutes=30)).isoformat()})
+        result = self.aggregator.aggregate(2, "1h", since=hour)
+        self.assertEqual(result["buckets"][0]["count"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import firebase_config
+import db_firebase
+from local_store import LocalStore
+from db_firebase import FirebaseDatabase
+from iot_store import IoTTimeSeriesStore
+from iot_ingest import parse_ndjson, ingest, BatchFormatError
+
+GOOD = {"fieldID": 3, "locationLat": 24.8, "locationLng": 89.3, "soilTemp": 25, "soilMoisture": 40,
+        "soilPH": 6.5, "soilEC": 1.2, "soilN": 40, "soilP": 20, "soilK": 30}
+
+
+class ParseNdjsonTest(unittest.TestCase):
+    def test_one_object_per_line(self):
+        rows, errors = parse_ndjson(b'{"fieldID": 1}\n\n{"fieldID": 2}\n')
+        self.assertEqual(rows, [{"fieldID": 1}, {"fieldID": 2}])
+        self.assertEqual(errors, {})
+
+    def test_two_objects_on_one_line_are_one_bad_row(self):
+        rows, errors = parse_ndjson(b'{"fieldID": 1}\n{"fieldID": 2},{"fieldID": 3}\n{"fieldID": 4}\n')
+        self.assertEqual(rows, [{"fieldID": 1}, {}, {"fieldID": 4}])
+        self.assertEqual(list(errors), [1])
+
+    def test_bad_line_keeps_later_row_numbers(self):
+        rows, errors = parse_ndjson(b'{"fieldID": 1}\nnot json\n{"fieldID": 2}\n')
+        self.assertEqual(rows, [{"fieldID": 1}, {}, {"fieldID": 2}])
+        self.assertEqual(list(errors), [1])
+
+
+class IngestTest(unittest.TestCase):
+    def setUp(self):
+        firebase_config.use_local_store(LocalStore())
+        db_firebase._root_ref = None
+        self.store = IoTTimeSeriesStore()
+        self.ids = FirebaseDatabase("iot_data")
+
+    def ndjson(self, *rows):
+        return "\n".join(row if isinstance(row, str) else json.dumps(row) for row in rows).encode()
+
+    def test_valid_rows_are_written_and_bad_ones_reported_by_row(self):
+        body = self.ndjson(
+            dict(GOOD, createTime="2026-01-01T10:00:00"),
+            dict(GOOD, soilPH=15, createTime="2026-01-01T10:01:00"),
+            "not json",
+            dict(GOOD, fieldID=0, createTime="2026-01-01T10:02:00"),
+            dict(GOOD, createTime="yesterday"),
+            dict(GOOD, createTime="2026-01-01T10:03:00"),
+        )
+        result = ingest(body, "ndjson", self.store, self.ids)
+        self.assertEqual((result["received"], result["accepted"], result["rejected"]), (6, 2, 4))
+        self.assertEqual([r["row"] for r in result["rejections"]], [2, 3, 4, 5])
+        self.assertIn("soilPH out of range", result["rejections"][0]["reason"])
+        stored = self.store.range(3, since="2026-01-01T00:00:00")
+        self.assertEqual([r["createTime"] for r in stored], ["2026-01-01T10:03:00", "2026-01-01T10:00:00"])
+        ids = sorted(r["ioTDataID"] for r in stored)
+        self.assertEqual(ids[1] - ids[0], 1)
+
+    def test_csv_body(self):
+        header = ",".join(list(GOOD) + ["createTime"])
+        line = ",".join(str(v) for v in GOOD.values()) + ",2026-01-01T10:00:00"
+        result = ingest(f"{header}\n{line}\n1,2\n".encode(), "csv", self.store, self.ids)
+        self.assertEqual((result["accepted"], result["rejected"]), (1, 1))
+        self.assertEqual(result["rejections"][0]["row"], 2)
+
+    def test_csv_without_field_column_is_refused(self):
+        with self.assertRaises(BatchFormatError):
+            ingest(b"soilPH\n6.5\n", "csv", self.store, self.ids)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import firebase_config
+from local_store import LocalStore
+from db_firebase import FirebaseDatabase
+from iot_store import IoTTimeSeriesStore, RecentReadings, LEGACY_COLLECTION
+
+
+def reading(reading_id, time, field_id=1):
+    return {"ioTDataID": reading_id, "fieldID": field_id, "soilPH": 6.5, "createTime": time}
+
+
+class RangeTest(unittest.TestCase):
+    def setUp(self):
+        firebase_config.use_local_store(LocalStore())
+        self.store = IoTTimeSeriesStore(buffer_ttl=0)
+        self.store.add_many([
+            reading(1, "2026-01-01T00:10:00"),
+            reading(2, "2026-01-01T00:20:00"),
+            reading(3, "2026-01-01T23:50:00"),
+            reading(4, "2026-01-02T00:05:00"),
+        ])
+
+    def ids(self, rows):
+        return [r["ioTDataID"] for r in rows]
+
+    def test_since_in_the_middle_of_a_day(self):
+        rows = self.store.range(1, since=datetime(2026, 1, 1, 0, 15))
+        self.assertEqual(self.ids(rows), [4, 3, 2])
+
+    def test_since_and_until_on_the_same_day(self):
+        rows = self.store.range(1, since=datetime(2026, 1, 1, 0, 15), until=datetime(2026, 1, 1, 12, 0))
+        self.assertEqual(self.ids(rows), [2])
+
+    def test_since_is_inclusive(self):
+        rows = self.store.range(1, since=datetime(2026, 1, 1, 0, 20), limit=10)
+        self.assertEqual(self.ids(rows), [4, 3, 2])
+
+
+class LayoutAndPagingTest(unittest.TestCase):
+    def setUp(self):
+        firebase_config.use_local_store(LocalStore())
+        self.store = IoTTimeSeriesStore()
+        self.store.add_many([reading(i, f"2026-01-0{1 + i // 3}T0{i % 3}:00:00") for i in range(1, 8)])
+
+    def test_readings_are_partitioned_by_field_and_day(self):
+        self.assertEqual(self.store.buckets(1), ["2026-01-01", "2026-01-02", "2026-01-03"])
+        day = firebase_config.get_db_reference("iot_ts/1/2026-01-02").get()
+        self.assertEqual(sorted(day), ["000000000000_3", "010000000000_4", "020000000000_5"])
+
+    def test_latest_n(self):
+        self.assertEqual([r["ioTDataID"] for r in self.store.latest(1, 3)], [7, 6, 5])
+
+    def test_pages_with_a_before_cursor_cover_everything_once(self):
+        seen, before = [], None
+        while True:
+            page = self.store.range(1, limit=3, before=before)
+            if not page:
+                break
+            seen.extend(r["ioTDataID"] for r in page)
+            before = self.store.position_of(page[-1])
+        self.assertEqual(seen, [7, 6, 5, 4, 3, 2, 1])
+
+
+class RecentReadingsTest(unittest.TestCase):
+    def test_out_of_order_readings_keep_the_latest(self):
+        buf = RecentReadings(capacity=3)
+        for reading_id, time in [(1, "10:00"), (3, "10:30"), (2, "10:15"), (4, "10:45"), (0, "09:00")]:
+            buf.append(reading(reading_id, f"2026-01-01T{time}:00"))
+        self.assertEqual([r["ioTDataID"] for r in buf.to_dicts(buf.select())], [4, 3, 2])
+        self.assertEqual([r["ioTDataID"] for r in buf.to_dicts(buf.select(limit=1))], [4])
+
+    def test_buffered_rows_match_the_stored_ones(self):
+        firebase_config.use_local_store(LocalStore())
+        store = IoTTimeSeriesStore()
+        row = {"ioTDataID": "legacy-7", "fieldID": 1, "soilN": 12, "soilPH": 6.5, "deviceID": "s-1",
+               "createTime": "2026-01-01T10:00:00"}
+        store.add(row)
+        from_database = store.range(1, since=datetime(2026, 1, 1))
+        store.latest(1, 5)  # syncs the buffer
+        store.add(dict(row, ioTDataID="legacy-8", createTime="2026-01-01T10:05:00"))
+        from_buffer = store.range(1, since=datetime(2026, 1, 1))
+        self.assertEqual(from_buffer[1], from_database[0])
+        self.assertEqual(from_buffer[0]["ioTDataID"], "legacy-8")
+        self.assertIs(type(from_buffer[1]["soilN"]), int)
+
+
+class LegacyTest(unittest.TestCase):
+    def setUp(self):
+        firebase_config.use_local_store(LocalStore())
+        legacy = FirebaseDatabase(LEGACY_COLLECTION)
+        legacy.add(reading(1, "2025-12-01T08:00:00"))
+        legacy.add(reading(2, "2025-12-02T08:00:00"))
+        self.store = IoTTimeSeriesStore(buffer_ttl=0)
+        self.store.add_many([reading(2, "2025-12-02T08:00:00"), reading(3, "2026-01-01T08:00:00")])
+
+    def ids(self, rows):
+        return [r["ioTDataID"] for r in rows]
+
+    def test_legacy_rows_are_read_until_backfilled(self):
+        self.assertEqual(self.ids(self.store.range(1)), [3, 2, 1])
+        self.assertEqual(self.ids(self.store.range_all()), [3, 2, 1])
+        self.assertEqual(sorted(self.ids(r for chunk in self.store.scan() for r in chunk)), [1, 2, 3])
+
+    def test_backfill_marker_stops_legacy_reads(self):
+        self.store.mark_backfilled(0)
+        self.assertEqual(self.ids(self.store.range(1)), [3, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
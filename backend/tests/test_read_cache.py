@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import firebase_config
+import db_firebase
+from local_store import LocalStore
+from db_firebase import FirebaseDatabase, CACHE_GENERATION_ROOT, get_root_ref
+
+
+class CrossProcessInvalidationTest(unittest.TestCase):
+    def setUp(self):
+        firebase_config.use_local_store(LocalStore())
+        db_firebase._root_ref = None
+        db_firebase._read_cache = db_firebase.ReadCache()
+        self.db = FirebaseDatabase("farmers", cache_ttl=30)
+        self.db.add({"farmerID": 1, "farmerDistrict": "Bogura"})
+
+    def write_from_another_process(self, district):
+        # What another worker's patch leaves in the database: the record and a new token
+        get_root_ref().update({"farmers/1/farmerDistrict": district, f"{CACHE_GENERATION_ROOT}/farmers": district})
+
+    def district(self):
+        return self.db.get_by_id(1, "farmerID")["farmerDistrict"]
+
+    def test_cached_record_is_kept_until_the_recheck(self):
+        self.assertEqual(self.district(), "Bogura")
+        self.write_from_another_process("Rangpur")
+        self.assertEqual(self.district(), "Bogura")
+
+    def test_foreign_write_is_seen_after_the_recheck(self):
+        self.assertEqual(self.district(), "Bogura")
+        self.write_from_another_process("Rangpur")
+        with mock.patch.object(db_firebase, "CACHE_RECHECK_SECONDS", 0):
+            self.assertEqual(self.district(), "Rangpur")
+
+    def test_own_write_does_not_count_as_foreign(self):
+        def invalidations():
+            return db_firebase.cache_stats()["collections"]["farmers"]["invalidations"]
+        self.district()
+        self.db.patch(1, {"farmerName": "Rahim"}, "farmerID")
+        after_write = invalidations()
+        with mock.patch.object(db_firebase, "CACHE_RECHECK_SECONDS", 0):
+            self.district()
+        self.assertEqual(invalidations(), after_write)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,331 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from spatial_index import BBox, Ring
+
+# Field boundaries as Mapbox Vector Tiles (protobuf, the format MapLibre/Leaflet.VectorGrid
+# read), encoded here without extra dependencies. Polygons are simplified to the tile's
+# resolution; fields smaller than a couple of pixels become points, and points sharing a
+# pixel are merged into one with a count, so low-zoom tiles stay small.
+
+TILE_EXTENT = 4096
+# Features reaching into the neighbouring tiles by this much (tile units) are included,
+# so polygons crossing a tile edge are drawn without seams
+TILE_BUFFER = 64
+# Douglas-Peucker tolerance: about one pixel of a 256px tile
+SIMPLIFY_TOLERANCE = TILE_EXTENT / 256
+# Polygons narrower and shorter than this (tile units, ~2px) are drawn as points
+MIN_POLYGON_SIZE = 2 * TILE_EXTENT / 256
+# Points within the same square of this many pixels are merged (at most 64x64 per tile)
+POINT_CLUSTER_PIXELS = 4
+MAX_ZOOM = 22
+LAYER_NAME = "fields"
+
+# Rendered tiles kept in memory (most are a few KB)
+TILE_CACHE_MAX = int(os.environ.get("AGROTECH_TILE_CACHE", 10000))
+
+MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+# --- Tile math (Web Mercator, XYZ scheme) ---
+
+def tile_bbox(z: int, x: int, y: int, buffer: float = 0.0) -> BBox:
+    """(min_lng, min_lat, max_lng, max_lat) of a tile, grown by `buffer` tile units per side."""
+    n = 2 ** z
+    pad = buffer / TILE_EXTENT
+
+    def lng(tx: float) -> float:
+        return tx / n * 360.0 - 180.0
+
+    def lat(ty: float) -> float:
+        ty = min(max(ty, 0.0), float(n))
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return (lng(x - pad), lat(y + 1 + pad), lng(x + 1 + pad), lat(y - pad))
+
+
+def tiles_covering(bbox: BBox, z: int) -> Tuple[int, int, int, int]:
+    """(x0, y0, x1, y1) range of the tiles at zoom z that bbox touches."""
+    n = 2 ** z
+    x0, y1 = _world(bbox[0], bbox[1], n)
+    x1, y0 = _world(bbox[2], bbox[3], n)
+    clamp = lambda v: min(max(int(math.floor(v)), 0), n - 1)
+    return clamp(x0), clamp(y0), clamp(x1), clamp(y1)
+
+
+def _world(lng: float, lat: float, n: int) -> Tuple[float, float]:
+    """Tile-space position (in tiles) of a coordinate at a zoom with n tiles per side."""
+    lat = min(max(lat, -85.05112878), 85.05112878)
+    rad = math.radians(lat)
+    return ((lng + 180.0) / 360.0 * n, (1.0 - math.log(math.tan(rad) + 1.0 / math.cos(rad)) / math.pi) / 2.0 * n)
+
+
+# --- Geometry ---
+
+def _simplify(points: List[Tuple[int, int]], tolerance: float) -> List[Tuple[int, int]]:
+    """Douglas-Peucker over an open path (iterative, so big rings don't hit the recursion limit)."""
+    if len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (ax, ay), (bx, by) = points[first], points[last]
+        dx, dy = bx - ax, by - ay
+        length = math.hypot(dx, dy)
+        worst, index = 0.0, -1
+        for i in range(first + 1, last):
+            px, py = points[i]
+            if length:
+                distance = abs(dy * px - dx * py + bx * ay - by * ax) / length
+            else:
+                distance = math.hypot(px - ax, py - ay)
+            if distance > worst:
+                worst, index = distance, i
+        if worst > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def _signed_area(ring: Sequence[Tuple[int, int]]) -> float:
+    return sum(ring[i - 1][0] * ring[i][1] - ring[i][0] * ring[i - 1][1] for i in range(len(ring))) / 2.0
+
+
+# --- Protobuf (vector_tile.proto, version 2) ---
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _field(number: int, wire_type: int) -> bytes:
+    return _varint((number << 3) | wire_type)
+
+
+def _bytes_field(number: int, payload: bytes) -> bytes:
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _packed(number: int, values: List[int]) -> bytes:
+    return _bytes_field(number, b"".join(_varint(v) for v in values))
+
+
+def _value(value: Any) -> bytes:
+    if isinstance(value, bool):
+        return _field(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _field(5, 0) + _varint(value) if value >= 0 else _field(6, 0) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _field(3, 1) + struct.pack("<d", value)
+    return _bytes_field(1, str(value).encode("utf-8"))
+
+
+def _command(command_id: int, count: int) -> int:
+    return (command_id & 0x7) | (count << 3)
+
+
+class _Layer:
+    def __init__(self, name: str):
+        self.name = name
+        self.features: List[bytes] = []
+        self.keys: Dict[str, int] = {}
+        self.values: Dict[Tuple[type, Any], int] = {}
+
+    def _tags(self, properties: Dict[str, Any]) -> List[int]:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(self.keys.setdefault(key, len(self.keys)))
+            tags.append(self.values.setdefault((type(value), value), len(self.values)))
+        return tags
+
+    def add(self, feature_id: Optional[int], geom_type: int, geometry: List[int], properties: Dict[str, Any]):
+        body = b""
+        if feature_id is not None and feature_id >= 0:
+            body += _field(1, 0) + _varint(feature_id)
+        tags = self._tags(properties)
+        if tags:
+            body += _packed(2, tags)
+        body += _field(3, 0) + _varint(geom_type)
+        body += _packed(4, geometry)
+        self.features.append(body)
+
+    def encode(self) -> bytes:
+        body = _field(15, 0) + _varint(2)
+        body += _bytes_field(1, self.name.encode("utf-8"))
+        body += b"".join(_bytes_field(2, f) for f in self.features)
+        body += b"".join(_bytes_field(3, k.encode("utf-8")) for k in self.keys)
+        body += b"".join(_bytes_field(4, _value(v)) for _, v in self.values)
+        body += _field(5, 0) + _varint(TILE_EXTENT)
+        return _bytes_field(3, body)
+
+
+def render_tile(z: int, x: int, y: int, features: List[Tuple[BBox, Ring, Dict[str, Any]]]) -> bytes:
+    """
+    One tile from (bbox, ring, entry) of the fields around it (entries as /fields/ maps them).
+    Returns b"" when nothing is drawn.
+    """
+    n = 2 ** z
+    layer = _Layer(LAYER_NAME)
+    # Cluster cell -> [x, y, count, first entry] of the fields drawn there as points
+    points: Dict[Tuple[int, int], List[Any]] = {}
+    cluster = POINT_CLUSTER_PIXELS * TILE_EXTENT // 256
+    low, high = -TILE_BUFFER, TILE_EXTENT + TILE_BUFFER
+
+    for bbox, ring, entry in features:
+        # Size check on the bbox first: at low zoom most fields are points, and their
+        # vertices need not be projected
+        ax, ay = _world(bbox[0], bbox[3], n)
+        bx, by = _world(bbox[2], bbox[1], n)
+        if (bx - ax) * TILE_EXTENT < MIN_POLYGON_SIZE and (by - ay) * TILE_EXTENT < MIN_POLYGON_SIZE:
+            cx, cy = int(((ax + bx) / 2 - x) * TILE_EXTENT), int(((ay + by) / 2 - y) * TILE_EXTENT)
+            if low <= cx <= high and low <= cy <= high:
+                slot = points.setdefault((cx // cluster, cy // cluster), [cx, cy, 0, entry])
+                slot[2] += 1
+            continue
+
+        local = []
+        for lng, lat in ring:
+            wx, wy = _world(lng, lat, n)
+            px, py = int(round((wx - x) * TILE_EXTENT)), int(round((wy - y) * TILE_EXTENT))
+            if not local or local[-1] != (px, py):
+                local.append((px, py))
+        if len(local) > 1 and local[0] == local[-1]:
+            local.pop()
+        if not local:
+            continue
+
+        ring_out = _simplify(local + [local[0]], SIMPLIFY_TOLERANCE)[:-1]
+        if len(ring_out) < 3 or _signed_area(ring_out) == 0:
+            # Collapsed by simplification (e.g. a sliver): draw it as a point
+            cx, cy = sum(p[0] for p in local) // len(local), sum(p[1] for p in local) // len(local)
+            if low <= cx <= high and low <= cy <= high:
+                slot = points.setdefault((cx // cluster, cy // cluster), [cx, cy, 0, entry])
+                slot[2] += 1
+            continue
+
+        # Exterior rings are clockwise on screen (positive area with y pointing down)
+        if _signed_area(ring_out) < 0:
+            ring_out.reverse()
+        geometry = [_command(1, 1), _zigzag(ring_out[0][0]), _zigzag(ring_out[0][1]), _command(2, len(ring_out) - 1)]
+        for (ax, ay), (bx, by) in zip(ring_out, ring_out[1:]):
+            geometry += [_zigzag(bx - ax), _zigzag(by - ay)]
+        geometry.append(_command(7, 1))
+        layer.add(_feature_id(entry), 3, geometry, _properties(entry))
+
+    for cx, cy, count, entry in points.values():
+        properties = _properties(entry) if count == 1 else {"count": count}
+        layer.add(_feature_id(entry) if count == 1 else None, 1,
+                  [_command(1, 1), _zigzag(cx), _zigzag(cy)], properties)
+
+    return layer.encode() if layer.features else b""
+
+
+def _feature_id(entry: Dict[str, Any]) -> Optional[int]:
+    value = str(entry.get("id", ""))
+    return int(value) if value.isdigit() else None
+
+
+def _properties(entry: Dict[str, Any]) -> Dict[str, Any]:
+    area = entry.get("area_in_acres")
+    return {
+        "id": entry.get("id"),
+        "name": entry.get("name"),
+        "crop": entry.get("crop_type"),
+        "area": float(area) if isinstance(area, (int, float)) and not isinstance(area, bool) else None,
+    }
+
+
+# --- Cache ---
+
+class TileCache:
+    """Rendered tiles by (z, x, y), LRU-bounded; entries are dropped when a field under them changes."""
+    def __init__(self, max_tiles: int = TILE_CACHE_MAX):
+        self.max_tiles = max_tiles
+        self._tiles: "OrderedDict[Tuple[int, int, int], Tuple[bytes, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a tile rendered from older data isn't stored
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def get(self, key: Tuple[int, int, int]) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            found = self._tiles.get(key)
+            if found is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return found
+
+    def put(self, key: Tuple[int, int, int], data: bytes, generation: int) -> Tuple[bytes, str]:
+        """
+        Stores a tile rendered from data read at `generation`; returns (data, etag).
+        Not stored if fields changed in between (the next request renders it again).
+        """
+        etag = '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+        with self._lock:
+            if generation != self.generation:
+                return data, etag
+            self._tiles[key] = (data, etag)
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return data, etag
+
+    def invalidate(self, bboxes: List[BBox]):
+        """Drops the cached tiles (every zoom) that show any of the bboxes."""
+        with self._lock:
+            self.generation += 1
+            if not self._tiles:
+                return
+            zooms = {key[0] for key in self._tiles}
+            for bbox in bboxes:
+                for z in zooms:
+                    # A feature is drawn by the tiles whose buffered area reaches it
+                    x0, y0, x1, y1 = tiles_covering(_grow(bbox, z), z)
+                    if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._tiles):
+                        stale = [k for k in self._tiles if k[0] == z and x0 <= k[1] <= x1 and y0 <= k[2] <= y1]
+                    else:
+                        stale = [(z, tx, ty) for tx in range(x0, x1 + 1) for ty in range(y0, y1 + 1)]
+                    for key in stale:
+                        if self._tiles.pop(key, None) is not None:
+                            self.invalidated += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tiles": len(self._tiles),
+                "bytes": sum(len(data) for data, _ in self._tiles.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+            }
+
+
+def _grow(bbox: BBox, z: int) -> BBox:
+    """bbox grown by TILE_BUFFER tile units at zoom z (in degrees of longitude, generously for latitude)."""
+    pad = TILE_BUFFER / TILE_EXTENT * 360.0 / 2 ** z
+    return (bbox[0] - pad, bbox[1] - pad, bbox[2] + pad, bbox[3] + pad)
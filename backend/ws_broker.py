@@ -0,0 +1,193 @@
+import asyncio
+import fcntl
+import json
+import os
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+# Routes WebSocket messages between uvicorn workers, so a message for a user (or a
+# topic) reaches whichever process holds the socket. Messages are "envelopes":
+#   {"kind": "user", "user_id": ..., "text": ...}
+#   {"kind": "topic", "topic": ..., "text": ...}
+#   {"kind": "broadcast", "text": ...}
+# where text is the already-serialized message for the client.
+
+# "local": in-process only (single worker); "unix": hub on a Unix socket shared by the workers
+WS_BROKER = os.environ.get("AGROTECH_WS_BROKER", "local")
+WS_HUB_PATH = os.environ.get("AGROTECH_WS_HUB_PATH", os.path.join(tempfile.gettempdir(), "agrotech-ws.sock"))
+
+# Longest envelope line accepted from the hub
+MAX_ENVELOPE_BYTES = 4 * 1024 * 1024
+# Unsent bytes a hub lets pile up for one worker before dropping its connection
+HUB_MAX_PEER_BUFFER = 16 * 1024 * 1024
+RECONNECT_DELAY = 1.0
+
+Deliver = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class InProcessBroker:
+    """Delivers envelopes straight back to this process's connections."""
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def publish(self, envelope: Dict[str, Any]):
+        if self._deliver is not None:
+            await self._deliver(envelope)
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "local"}
+
+
+class UnixSocketBroker:
+    """
+    Multi-worker delivery without an external service. One worker holds a lock file and
+    runs a hub on a Unix socket; every worker (the hub's own included) connects to it,
+    sends its envelopes as JSON lines, and the hub relays each line to all workers.
+    If the hub's worker dies, the lock is released and the next worker to reconnect
+    takes over.
+    """
+    def __init__(self, path: str = WS_HUB_PATH):
+        self.path = path
+        self._deliver: Optional[Deliver] = None
+        self._task: Optional[asyncio.Task] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connected = asyncio.Event()
+        # Hub side (only in the worker holding the lock)
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self.relayed = 0
+        self.local_fallbacks = 0
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=2)
+        except asyncio.TimeoutError:
+            print(f"WARNING: WebSocket hub at {self.path} not reachable yet; delivering locally until it is")
+
+    async def publish(self, envelope: Dict[str, Any]):
+        writer = self._writer
+        if writer is None or writer.is_closing():
+            # Hub down: at least reach the users connected to this worker
+            self.local_fallbacks += 1
+            if self._deliver is not None:
+                await self._deliver(envelope)
+            return
+        writer.write(json.dumps(envelope).encode("utf-8") + b"\n")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            for peer in list(self._peers):
+                peer.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "unix",
+            "path": self.path,
+            "connected": self._connected.is_set(),
+            "is_hub": self._server is not None,
+            "hub_peers": len(self._peers),
+            "relayed": self.relayed,
+            "local_fallbacks": self.local_fallbacks,
+        }
+
+    # --- Worker side ---
+
+    async def _run(self):
+        while True:
+            try:
+                await self._ensure_hub()
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_ENVELOPE_BYTES)
+                self._writer = writer
+                self._connected.set()
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    try:
+                        envelope = json.loads(line)
+                    except ValueError:
+                        continue
+                    if self._deliver is not None:
+                        await self._deliver(envelope)
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ValueError) as e:
+                print(f"WARNING: WebSocket hub connection failed ({e}); retrying")
+            finally:
+                self._writer = None
+                self._connected.clear()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    # --- Hub side ---
+
+    def _try_lock(self) -> bool:
+        if self._lock_fd is not None:
+            return True
+        fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _ensure_hub(self):
+        if self._server is not None or not self._try_lock():
+            return
+        # We hold the lock, so any socket file left behind is from a dead hub
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path, limit=MAX_ENVELOPE_BYTES)
+        print(f"ℹ️ WebSocket hub listening on {self.path} (pid {os.getpid()})")
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.relayed += 1
+                for peer in list(self._peers):
+                    if peer.transport.get_write_buffer_size() > HUB_MAX_PEER_BUFFER:
+                        # A stuck worker must not make the hub buffer without bound
+                        print("WARNING: dropping a WebSocket hub peer that stopped reading")
+                        self._peers.discard(peer)
+                        peer.close()
+                        continue
+                    peer.write(line)
+        except (OSError, ValueError, asyncio.CancelledError):
+            # Cancelled: this worker is shutting down and another one will take over the hub
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+
+def create_broker(backend: str = WS_BROKER):
+    if backend == "unix":
+        return UnixSocketBroker()
+    if backend != "local":
+        print(f"WARNING: unknown AGROTECH_WS_BROKER '{backend}', using local")
+    return InProcessBroker()
@@ -4,6 +4,9 @@ class NotificationService {
     private socket: WebSocket | null = null;
     private callbacks: NotificationCallback[] = [];
     private reconnectInterval = 3000;
+    // The server marks an expert offline when their socket stays silent for 90s
+    private heartbeatInterval = 25000;
+    private heartbeatTimer: ReturnType<typeof setInterval> | null = null;
     private userId: string | null = null;
 
     constructor() { }
@@ -16,13 +19,14 @@ class NotificationService {
         }
 
         this.userId = userId;
-        const wsUrl = `ws://localhost:8000/ws/status/?user_id=${userId}`;
+        const wsUrl = `ws://localhost:8000/ws/status/?user_id=${userId}&role=expert`;
 
         console.log(`Connecting to WS: ${wsUrl}`);
         this.socket = new WebSocket(wsUrl);
 
         this.socket.onopen = () => {
             console.log('Notification Service Connected');
+            this.startHeartbeat();
         };
 
         this.socket.onmessage = (event) => {
@@ -40,6 +44,7 @@ class NotificationService {
 
         this.socket.onclose = (event) => {
             console.log('Notification Service Disconnected.', event.reason);
+            this.stopHeartbeat();
             this.socket = null; // Clear instance
 
             // Only reconnect if we have a userId and it wasn't a clean close (optional check)
@@ -65,9 +70,26 @@ class NotificationService {
         this.callbacks.forEach(cb => cb(payload));
     }
 
+    private startHeartbeat() {
+        this.stopHeartbeat();
+        this.heartbeatTimer = setInterval(() => {
+            if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+                this.socket.send(JSON.stringify({ action: 'heartbeat' }));
+            }
+        }, this.heartbeatInterval);
+    }
+
+    private stopHeartbeat() {
+        if (this.heartbeatTimer) {
+            clearInterval(this.heartbeatTimer);
+            this.heartbeatTimer = null;
+        }
+    }
+
     disconnect() {
         // Clear userId to prevent auto-reconnect
         this.userId = null;
+        this.stopHeartbeat();
         if (this.socket) {
             // Remove listeners to avoid triggering errors or reconnects during intentional close
             this.socket.onclose = null;